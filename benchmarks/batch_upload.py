@@ -0,0 +1,137 @@
+'''
+Загрузка множества маленьких файлов: по одному против пакетной загрузки.
+
+Запускается из корня проекта при заполненном .env, на тестовой базе
+с примененными миграциями:
+
+    python benchmarks/batch_upload.py --files 1000 --size 1024
+
+Приложение вызывается напрямую через ASGITransport, без сети. Для замера
+регистрируется новый пользователь, его файлы в конце удаляются через
+crud_file.delete, чтобы освободить содержимое в хранилище. Кроме времени
+выводится число SQL-запросов на каждый вариант.
+'''
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from core.settings import BASE_URL  # noqa: E402
+from db.crud import crud_file, crud_user  # noqa: E402
+from db.session import async_session, engine  # noqa: E402
+from main import app  # noqa: E402
+from utils.storage import init_storage  # noqa: E402
+
+
+def make_files(count: int, size: int, prefix: str) -> list:
+    # Разное содержимое, чтобы дедупликация не сокращала запись на диск
+    return [
+        (f'{prefix}{number}.txt', f'{number:0{size}d}'.encode()[:size])
+        for number in range(count)
+    ]
+
+
+async def one_by_one(client: AsyncClient, headers: dict, files: list) -> None:
+    for filename, content in files:
+        response = await client.post(
+            '/api/files/upload',
+            params={'path': f'bench/single/{filename}'},
+            files={'file': (filename, content)},
+            headers=headers
+        )
+        response.raise_for_status()
+
+
+async def batched(
+    client: AsyncClient,
+    headers: dict,
+    files: list,
+    batch: int
+) -> None:
+    for start in range(0, len(files), batch):
+        response = await client.post(
+            '/api/files/upload/batch',
+            params={'path': 'bench/batch'},
+            files=[('files', item) for item in files[start:start + batch]],
+            headers=headers
+        )
+        response.raise_for_status()
+        assert all(item['status'] == 200 for item in response.json())
+
+
+async def measure(title: str, coro) -> None:
+    queries = 0
+
+    def count(*args) -> None:
+        nonlocal queries
+        queries += 1
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    try:
+        await coro
+    finally:
+        elapsed = time.perf_counter() - start
+        event.remove(engine.sync_engine, 'before_cursor_execute', count)
+    print(f'{title:<12} {elapsed:>10.2f} {queries:>10}')
+
+
+async def cleanup(username: str) -> None:
+    async with async_session() as db:
+        user = await crud_user.get_by_username(db=db, username=username)
+        if user is None:
+            return
+        files = await crud_file.get_by_filters(
+            db=db, options={'user_id': user.uid}
+        )
+        for file in files:
+            await crud_file.delete(db=db, db_obj=file)
+        await crud_user.delete(db=db, db_obj=user)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+    init_storage()
+
+    credentials = {
+        'username': f'bench-{uuid.uuid4().hex[:8]}',
+        'password': 'Changeme1!'
+    }
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url=BASE_URL) as client:
+        await client.post('/api/auth/register', json=credentials)
+        token = (
+            await client.post('/api/auth/token', data=credentials)
+        ).json()
+        headers = {
+            'Authorization': f'{token["token_type"]} {token["access_token"]}'
+        }
+        try:
+            print(f'{"вариант":<12} {"время, с":>10} {"запросов":>10}')
+            await measure('по одному', one_by_one(
+                client, headers, make_files(args.files, args.size, 'single')
+            ))
+            await measure('пакетом', batched(
+                client,
+                headers,
+                make_files(args.files, args.size, 'batch'),
+                args.batch
+            ))
+        finally:
+            await cleanup(credentials['username'])
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+'''
+Сравнение пропускной способности FileResponse и RangeFileResponse.
+
+Запускается из корня проекта при заполненном .env:
+
+    python benchmarks/download_throughput.py --size 256 --requests 20
+
+Кроме полной отдачи файла замеряется докачка последних 10% файла
+через Range, которую старый обработчик не поддерживал. Оба ответа
+копируют байты через Python: без копирования, с sendfile, файлы
+отдает nginx при APP_DOWNLOAD_ACCEL_REDIRECT=True.
+'''
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import FileResponse  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from utils.responses import RangeFileResponse  # noqa: E402
+
+
+def build_app(path: Path) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/plain')
+    async def plain() -> FileResponse:
+        return FileResponse(path=path, filename=path.name)
+
+    @app.get('/range')
+    async def ranged() -> RangeFileResponse:
+        return RangeFileResponse(path=path, filename=path.name)
+
+    return app
+
+
+async def measure(
+    client: AsyncClient,
+    url: str,
+    requests: int,
+    concurrency: int,
+    headers: dict
+) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    received = 0
+
+    async def fetch() -> None:
+        nonlocal received
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+            received += len(response.content)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fetch() for _ in range(requests)))
+    return received, time.perf_counter() - start
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=64, help='МБ')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'payload.bin'
+        with open(path, 'wb') as f:
+            for _ in range(args.size):
+                f.write(b'x' * 1024 * 1024)
+        size = args.size * 1024 * 1024
+        resume = {'Range': f'bytes={size - size // 10}-'}
+
+        transport = ASGITransport(app=build_app(path))
+        async with AsyncClient(
+            transport=transport, base_url='http://bench'
+        ) as client:
+            cases = [
+                ('FileResponse, весь файл', '/plain', {}),
+                ('RangeFileResponse, весь файл', '/range', {}),
+                ('RangeFileResponse, докачка 10%', '/range', resume),
+            ]
+            print(f'{"вариант":<34} {"МБ/с":>10} {"запросов/с":>12}')
+            for title, url, headers in cases:
+                received, elapsed = await measure(
+                    client, url, args.requests, args.concurrency, headers
+                )
+                print(
+                    f'{title:<34} {received / elapsed / 2 ** 20:>10.1f} '
+                    f'{args.requests / elapsed:>12.1f}'
+                )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+'''
+Задержка операций с файлами при разных раскладках хранилища.
+
+Запускается из корня проекта:
+
+    python benchmarks/fs_layout.py --files 1000000 --dir /mnt/data
+
+Для каждой раскладки создается files пустых файлов одного
+пользователя: user - все в одной директории пользователя, как после
+загрузок по одному пути, sharded - в data/.files/ab/cd/<fid>. Затем на
+samples случайных файлах замеряются stat существующего и отсутствующего
+файла, открытие с чтением и подготовка директории перед записью (для
+user - exists/mkdir из get_path_name, для sharded - mkdir директории
+shard-а), а также время полного обхода дерева, как при резервном
+копировании. Выводятся p50/p99 в микросекундах. Файлы создаются в
+--dir (по умолчанию во временной директории): результат зависит от ФС,
+замеры идут при прогретом кэше страниц.
+'''
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+from uuid import UUID, uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from utils.storage import sharded_relpath  # noqa: E402
+
+USERNAME = 'heavy'
+
+
+def user_path(root: Path, number: int) -> Path:
+    return root / USERNAME / 'photos' / f'IMG_{number:07d}.jpg'
+
+
+def sharded_path(root: Path, fid: UUID) -> Path:
+    return root / sharded_relpath(fid)
+
+
+def populate(paths: List[Path]) -> List[float]:
+    '''Создает пустые файлы, возвращает время создания каждого.'''
+    timings = []
+    for path in paths:
+        start = time.perf_counter()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def measure(paths: List[Path], operation: Callable[[Path], None]) -> list:
+    timings = []
+    for path in paths:
+        start = time.perf_counter()
+        operation(path)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def exists(path: Path) -> None:
+    path.exists()
+
+
+def open_read(path: Path) -> None:
+    with open(path, mode='rb') as f:
+        f.read()
+
+
+def prepare_user_dir(path: Path) -> None:
+    # Как get_path_name: проверка директории и создание при отсутствии
+    if not path.parent.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def prepare_shard_dir(path: Path) -> None:
+    # Как write_upload в раскладке sharded
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def scan(root: Path) -> float:
+    start = time.perf_counter()
+    count = sum(len(files) for _, _, files in os.walk(root))
+    assert count
+    return time.perf_counter() - start
+
+
+def run_layout(
+    layout: str,
+    root: Path,
+    args: argparse.Namespace
+) -> Dict[str, list]:
+    rng = random.Random(args.seed)
+    if layout == 'user':
+        paths = [user_path(root, n) for n in range(args.files)]
+        missing = [
+            user_path(root, args.files + n) for n in range(args.samples)
+        ]
+        prepare = prepare_user_dir
+    else:
+        paths = [sharded_path(root, uuid4()) for _ in range(args.files)]
+        missing = [sharded_path(root, uuid4()) for _ in range(args.samples)]
+        prepare = prepare_shard_dir
+    results = {'create': populate(paths)}
+    sample = rng.sample(paths, min(args.samples, len(paths)))
+    results['stat'] = measure(sample, exists)
+    results['stat_missing'] = measure(missing, exists)
+    results['open_read'] = measure(sample, open_read)
+    results['prepare_dir'] = measure(missing, prepare)
+    results['scan'] = [scan(root)]
+    return results
+
+
+def percentile(values: list, q: int) -> float:
+    if len(values) < 2:
+        return values[0] * 1e6
+    return statistics.quantiles(values, n=100)[q - 1] * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=1000000)
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--dir', type=Path, default=None)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument(
+        '--layouts', nargs='+', default=['user', 'sharded'],
+        choices=['user', 'sharded']
+    )
+    args = parser.parse_args()
+
+    print(f'{"раскладка":<10} {"операция":<14} '
+          f'{"p50, мкс":>12} {"p99, мкс":>12}')
+    for layout in args.layouts:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            results = run_layout(layout, Path(tmp), args)
+            for operation, timings in results.items():
+                print(
+                    f'{layout:<10} {operation:<14} '
+                    f'{percentile(timings, 50):>12.1f} '
+                    f'{percentile(timings, 99):>12.1f}'
+                )
+
+
+if __name__ == '__main__':
+    main()
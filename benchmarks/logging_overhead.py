@@ -0,0 +1,131 @@
+'''
+Цена логирования на один запрос.
+
+Запускается из корня проекта:
+
+    python benchmarks/logging_overhead.py --requests 5000 --records 5
+
+Обработчик тестового приложения пишет records INFO-записей с
+аргументами, как это делают CRUD и обработчики API. Сравниваются
+варианты: логи ниже порога уровня (off), запись в файл прямо в цикле
+событий (sync), через очередь и поток QueueListener (queue), в JSON и
+с прореживанием LOG_SAMPLING. С --fsync файл синхронизируется после
+каждой записи - так ведет себя медленный диск или сетевой сборщик.
+Выводится среднее время запроса и разница с off в микросекундах.
+'''
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from fastapi import FastAPI  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from core.logger import (  # noqa: E402
+    LOG_FORMAT_VERBOSE,
+    JsonFormatter,
+    start_log_queue,
+    stop_log_queue
+)
+from core.settings import app_settings  # noqa: E402
+
+logger = logging.getLogger('bench.crud')
+
+# Вариант: (уровень корневого логера, очередь, формат, доля записей)
+CASES = {
+    'off': (logging.WARNING, False, 'text', None),
+    'sync': (logging.INFO, False, 'text', None),
+    'sync-json': (logging.INFO, False, 'json', None),
+    'queue': (logging.INFO, True, 'text', None),
+    'queue-json': (logging.INFO, True, 'json', None),
+    'queue-10%': (logging.INFO, True, 'text', 0.1),
+}
+
+
+class FsyncFileHandler(logging.FileHandler):
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        os.fsync(self.stream.fileno())
+
+
+def build_app(records: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/files/{path}')
+    async def get_file(path: str) -> dict:
+        for number in range(records):
+            logger.info(
+                'Got file %s for user %s, step %d', path, 'bench', number
+            )
+        return {'path': path}
+
+    return app
+
+
+def configure(
+    case: str,
+    path: Path,
+    fsync: bool
+) -> logging.Handler:
+    level, queue, log_format, rate = CASES[case]
+    handler_class = FsyncFileHandler if fsync else logging.FileHandler
+    handler = handler_class(path, encoding='utf-8')
+    handler.setFormatter(
+        JsonFormatter() if log_format == 'json'
+        else logging.Formatter(LOG_FORMAT_VERBOSE)
+    )
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    app_settings.LOG_SAMPLING = {'bench': rate} if rate else {}
+    if queue:
+        start_log_queue()
+    return handler
+
+
+async def run_case(case: str, args: argparse.Namespace, tmp: Path) -> float:
+    handler = configure(case, tmp / f'{case}.log', args.fsync)
+    app = build_app(args.records)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(
+        transport=transport, base_url='http://bench'
+    ) as client:
+        await client.get('/files/warmup')
+        start = time.perf_counter()
+        for number in range(args.requests):
+            await client.get(f'/files/{number}')
+        elapsed = time.perf_counter() - start
+    # Очередь дописывается вне замера: запросы ее не ждут
+    stop_log_queue()
+    handler.close()
+    return elapsed / args.requests * 1e6
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--records', type=int, default=5)
+    parser.add_argument('--fsync', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{"вариант":<12} {"мкс/запрос":>12} {"к off, мкс":>12}')
+        baseline = None
+        for case in CASES:
+            per_request = await run_case(case, args, Path(tmp))
+            if baseline is None:
+                baseline = per_request
+            print(
+                f'{case:<12} {per_request:>12.1f} '
+                f'{per_request - baseline:>12.1f}'
+            )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
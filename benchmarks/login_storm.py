@@ -0,0 +1,126 @@
+'''
+Задержка скачивания файлов во время всплеска входов.
+
+Запускается из корня проекта при заполненном .env:
+
+    python benchmarks/login_storm.py --logins 200 --downloads 200
+
+Сравниваются три варианта проверки пароля: bcrypt прямо в обработчике
+(как было раньше), в пуле потоков и в отдельном пуле процессов с
+ограничением очереди. Для каждого выводятся перцентили задержки
+скачивания небольшого файла, пока параллельно идут входы.
+'''
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from fastapi import FastAPI  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from core.executors import ExecutorOverloaded  # noqa: E402
+from core.executors import InstrumentedExecutor  # noqa: E402
+from utils.auth import hash_password, verify_password  # noqa: E402
+from utils.responses import RangeFileResponse  # noqa: E402
+
+
+def build_app(path: Path, hashed: str, mode: str, workers: int) -> FastAPI:
+    app = FastAPI()
+    threads = InstrumentedExecutor(name='threads', max_workers=workers)
+    processes = InstrumentedExecutor(
+        name='password',
+        max_workers=workers,
+        processes=True,
+        max_concurrency=workers,
+        queue_timeout=30
+    )
+    app.state.executors = (threads, processes)
+
+    @app.post('/login')
+    async def login() -> dict:
+        check = partial(verify_password, 'Secret123', hashed)
+        if mode == 'inline':
+            valid = check()
+        elif mode == 'threads':
+            valid = await threads.run(check)
+        else:
+            try:
+                valid = await processes.run(check)
+            except ExecutorOverloaded:
+                return {'valid': None}
+        return {'valid': valid}
+
+    @app.get('/download')
+    async def download() -> RangeFileResponse:
+        return RangeFileResponse(path=path, filename=path.name)
+
+    return app
+
+
+async def run_case(
+    path: Path,
+    hashed: str,
+    mode: str,
+    args: argparse.Namespace
+) -> list:
+    app = build_app(path, hashed, mode, args.workers)
+    transport = ASGITransport(app=app)
+    latencies = []
+    async with AsyncClient(
+        transport=transport, base_url='http://bench'
+    ) as client:
+        # Прогрев: запуск процессов не должен попадать в замер
+        await client.post('/login')
+
+        async def download() -> None:
+            start = time.perf_counter()
+            await client.get('/download')
+            latencies.append(time.perf_counter() - start)
+
+        async def downloads() -> None:
+            for _ in range(args.downloads):
+                await download()
+                await asyncio.sleep(0.005)
+
+        logins = [client.post('/login') for _ in range(args.logins)]
+        await asyncio.gather(downloads(), *logins)
+    for executor in app.state.executors:
+        executor.shutdown()
+    return latencies
+
+
+def percentile(values: list, q: float) -> float:
+    return statistics.quantiles(values, n=100)[int(q) - 1] * 1000
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--downloads', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    hashed = hash_password('Secret123')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'small.bin'
+        path.write_bytes(b'x' * 64 * 1024)
+
+        print(f'{"вариант":<12} {"p50, мс":>10} '
+              f'{"p99, мс":>10} {"max, мс":>10}')
+        for mode in ('inline', 'threads', 'processes'):
+            latencies = await run_case(path, hashed, mode, args)
+            print(
+                f'{mode:<12} {percentile(latencies, 50):>10.1f} '
+                f'{percentile(latencies, 99):>10.1f} '
+                f'{max(latencies) * 1000:>10.1f}'
+            )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+'''
+Задержка авторизованных запросов с кэшем пользователей и без него.
+
+Запускается из корня проекта при заполненном .env, на тестовой базе
+с примененными миграциями:
+
+    python benchmarks/principal_cache.py --requests 2000 --concurrency 50
+
+Обработчик только проверяет токен через get_current_user и ничего не
+читает сам, поэтому разница между вариантами - это запрос пользователя
+в Postgres на каждый вызов. Без кэша PrincipalCache создается с ttl=0,
+с кэшем - с настройками из .env. Для каждого варианта выводятся
+перцентили задержки и число запросов к базе на один вызов. Тестовый
+пользователь удаляется в конце.
+'''
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+from uuid import uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from fastapi import Depends, FastAPI  # noqa: E402
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from core.settings import app_settings  # noqa: E402
+from db.crud import crud_user  # noqa: E402
+from db.session import async_session, engine  # noqa: E402
+from schemas.users import UserCreate, UserPrincipal  # noqa: E402
+from utils import auth  # noqa: E402
+from utils.cache import PrincipalCache  # noqa: E402
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/me')
+    async def me(
+        user: UserPrincipal = Depends(auth.get_current_user)
+    ) -> dict:
+        return {'uid': str(user.uid)}
+
+    return app
+
+
+async def run_case(token: str, cached: bool, args: argparse.Namespace):
+    ttl = app_settings.PRINCIPAL_CACHE_TTL if cached else 0
+    auth.principal_cache = PrincipalCache(
+        ttl=ttl,
+        max_size=app_settings.PRINCIPAL_CACHE_SIZE if cached else 0,
+        use_redis=cached and app_settings.PRINCIPAL_CACHE_REDIS
+    )
+    queries = 0
+
+    def count(*args) -> None:
+        nonlocal queries
+        queries += 1
+
+    transport = ASGITransport(app=build_app())
+    headers = {'Authorization': f'Bearer {token}'}
+    latencies = []
+    async with AsyncClient(
+        transport=transport, base_url='http://bench'
+    ) as client:
+        # Прогрев: соединения пула и первая запись в кэш
+        await client.get('/me', headers=headers)
+        event.listen(engine.sync_engine, 'before_cursor_execute', count)
+        queue = asyncio.Queue()
+        for _ in range(args.requests):
+            queue.put_nowait(None)
+
+        async def worker() -> None:
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.get('/me', headers=headers)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        event.remove(engine.sync_engine, 'before_cursor_execute', count)
+    return latencies, queries / args.requests
+
+
+def percentile(values: list, q: int) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    username = f'bench{uuid4().hex[:12]}'
+    async with async_session() as db:
+        user = await crud_user.create(
+            db=db, data_in=UserCreate(username=username, password='-')
+        )
+    token = auth.create_access_token(data={'sub': username})
+    try:
+        print(f'{"вариант":<12} {"p50, мс":>10} {"p99, мс":>10} '
+              f'{"max, мс":>10} {"запросов":>10}')
+        for cached in (False, True):
+            latencies, queries = await run_case(token, cached, args)
+            name = 'с кэшем' if cached else 'без кэша'
+            print(
+                f'{name:<12} {percentile(latencies, 50):>10.2f} '
+                f'{percentile(latencies, 99):>10.2f} '
+                f'{max(latencies) * 1000:>10.2f} {queries:>10.2f}'
+            )
+    finally:
+        async with async_session() as db:
+            await crud_user.delete(db=db, db_obj=user)
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+'''
+Поиск файлов по большой таблице с индексами и без них.
+
+Запускается из корня проекта при заполненном .env, на тестовой базе
+с примененными миграциями:
+
+    python benchmarks/search_indexes.py --rows 1000000 --users 100
+
+Все делается в одной транзакции, которая в конце откатывается: таблица
+file заполняется rows строками, запросы поиска выполняются через
+EXPLAIN ANALYZE сначала без индексов поиска, затем с ними. Удаление
+индексов внутри транзакции блокирует таблицу, поэтому на рабочей базе
+скрипт запускать нельзя.
+'''
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncConnection  # noqa: E402
+
+from db.crud import crud_file  # noqa: E402
+from db.session import engine  # noqa: E402
+
+INDEXES = {
+    'ix_file_user_id_created': 'file (user_id, created)',
+    'ix_file_user_id_extension': 'file (user_id, extension)',
+    'ix_file_path': 'file (path varchar_pattern_ops)',
+    'ix_file_name_trgm': 'file USING gin (name gin_trgm_ops)',
+}
+
+SEED_USERS = '''
+INSERT INTO users (uid, username, password)
+SELECT md5('bench' || u)::uuid, 'bench-user-' || u, '-'
+FROM generate_series(1, :users) AS u
+'''
+
+SEED_FILES = '''
+INSERT INTO file (fid, name, created, path, size, extension, user_id)
+SELECT
+    md5('bench-file' || n)::uuid,
+    CASE WHEN n % 5000 = 0 THEN 'report-needle-' ELSE 'file-' END
+        || n || '.' || ext,
+    now() - n * interval '1 second',
+    'bench-user-' || (n % :users + 1) || '/dir' || n % 100 || '/file-' || n
+        || '.' || ext,
+    n % 100000,
+    ext,
+    md5('bench' || (n % :users + 1))::uuid
+FROM generate_series(1, :rows) AS n,
+    LATERAL (
+        SELECT (ARRAY['txt', 'pdf', 'png', 'jpg', 'doc',
+                      'xls', 'zip', 'mp3', 'mp4', 'csv'])[n % 10 + 1]
+    ) AS e(ext)
+'''
+
+
+def bench_uid(number: int) -> uuid.UUID:
+    return uuid.UUID(hashlib.md5(f'bench{number}'.encode()).hexdigest())
+
+
+def cases(users: int) -> list:
+    uid = bench_uid(1)
+    return [
+        ('имя содержит needle', {'user_id': uid, 'query': 'needle'}),
+        ('расширение pdf', {'user_id': uid, 'extension': 'pdf'}),
+        ('точный путь', {
+            'user_id': uid,
+            'path': f'bench-user-1/dir0/file-{users * 100}.txt'
+        }),
+        ('последние 20', {
+            'user_id': uid, 'order_by': '-created', 'limit': 20
+        }),
+    ]
+
+
+async def explain(conn: AsyncConnection, options: dict) -> tuple:
+    sql = crud_file.search_stmt(options).compile(
+        dialect=conn.dialect,
+        compile_kwargs={'literal_binds': True}
+    )
+    result = await conn.exec_driver_sql(
+        f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}'
+    )
+    plan = result.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Execution Time'], plan[0]['Plan']['Node Type']
+
+
+async def run_cases(conn: AsyncConnection, users: int, title: str) -> None:
+    print(f'\n{title}')
+    print(f'{"запрос":<22} {"мс":>10}  план')
+    for name, options in cases(users):
+        # Первый прогон прогревает кэш страниц
+        await explain(conn, options)
+        elapsed, node = await explain(conn, options)
+        print(f'{name:<22} {elapsed:>10.2f}  {node}')
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            for name in INDEXES:
+                await conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            start = time.perf_counter()
+            await conn.execute(text(SEED_USERS), {'users': args.users})
+            await conn.execute(
+                text(SEED_FILES), {'rows': args.rows, 'users': args.users}
+            )
+            await conn.execute(text('ANALYZE file'))
+            print(f'Заполнено {args.rows} строк за '
+                  f'{time.perf_counter() - start:.1f} с')
+            await run_cases(conn, args.users, 'Без индексов')
+
+            start = time.perf_counter()
+            for name, definition in INDEXES.items():
+                await conn.execute(
+                    text(f'CREATE INDEX {name} ON {definition}')
+                )
+            await conn.execute(text('ANALYZE file'))
+            print(f'\nИндексы построены за '
+                  f'{time.perf_counter() - start:.1f} с')
+            await run_cases(conn, args.users, 'С индексами')
+        finally:
+            await transaction.rollback()
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
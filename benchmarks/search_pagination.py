@@ -0,0 +1,89 @@
+'''
+Время страницы поиска в зависимости от глубины: OFFSET против курсора.
+
+Запускается из корня проекта при заполненном .env, на тестовой базе
+с примененными миграциями:
+
+    python benchmarks/search_pagination.py --rows 1000000
+
+Таблица file заполняется файлами одного пользователя в транзакции,
+которая в конце откатывается. Для каждой глубины страница из 100 записей
+запрашивается через OFFSET и через keyset-условие, как в /files/search.
+'''
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncConnection  # noqa: E402
+
+from db.crud import crud_file  # noqa: E402
+from db.session import engine  # noqa: E402
+from search_indexes import SEED_FILES, SEED_USERS, bench_uid  # noqa: E402
+
+PAGE_SIZE = 100
+
+
+async def execution_time(conn: AsyncConnection, stmt) -> float:
+    sql = stmt.compile(
+        dialect=conn.dialect,
+        compile_kwargs={'literal_binds': True}
+    )
+    for _ in range(2):
+        result = await conn.exec_driver_sql(
+            f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}'
+        )
+    plan = result.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Execution Time']
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    options = {
+        'user_id': bench_uid(1),
+        'order_by': '-created',
+        'limit': PAGE_SIZE,
+    }
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            await conn.execute(text(SEED_USERS), {'users': 1})
+            await conn.execute(
+                text(SEED_FILES), {'rows': args.rows, 'users': 1}
+            )
+            await conn.execute(text('ANALYZE file'))
+
+            print(f'{"глубина":>10} {"OFFSET, мс":>12} {"курсор, мс":>12}')
+            depth = 0
+            while depth < args.rows - PAGE_SIZE:
+                offset_stmt = crud_file.search_stmt(options).offset(depth)
+                after = (await conn.execute(
+                    crud_file.search_stmt(options).
+                    offset(max(depth - 1, 0)).limit(1)
+                )).one()
+                keyset_options = dict(options)
+                if depth:
+                    keyset_options['after'] = (after.created, after.fid)
+                keyset_stmt = crud_file.search_stmt(keyset_options)
+                print(
+                    f'{depth:>10} '
+                    f'{await execution_time(conn, offset_stmt):>12.2f} '
+                    f'{await execution_time(conn, keyset_stmt):>12.2f}'
+                )
+                depth = depth * 10 if depth else 1000
+        finally:
+            await transaction.rollback()
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
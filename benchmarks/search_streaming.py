@@ -0,0 +1,101 @@
+'''
+Память и время до первого байта: поиск целиком против потоковой выдачи.
+
+Запускается из корня проекта при заполненном .env, на тестовой базе
+с примененными миграциями:
+
+    python benchmarks/search_streaming.py --rows 200000
+
+Потоковая выдача открывает свою сессию, поэтому строки для замера
+сохраняются в базе и удаляются вместе с пользователем в конце.
+Сравниваются старый путь (все строки -> List[BaseFile] -> JSON) и
+NDJSON через stream_scalars. Пик памяти считается tracemalloc.
+'''
+import argparse
+import asyncio
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import orjson  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from api.v1.handlers.files import iter_ndjson  # noqa: E402
+from db.crud import crud_file  # noqa: E402
+from db.session import async_session, engine  # noqa: E402
+from schemas.entities import BaseFile  # noqa: E402
+from search_indexes import SEED_FILES, SEED_USERS, bench_uid  # noqa: E402
+
+FILES = TypeAdapter(list[BaseFile])
+
+
+async def load_all(options: dict) -> tuple:
+    start = time.perf_counter()
+    async with async_session() as db:
+        files = await crud_file.get_by_filters(db=db, options=options)
+        body = orjson.dumps(
+            FILES.dump_python(
+                FILES.validate_python(files, from_attributes=True),
+                mode='json'
+            )
+        )
+    # Весь ответ готов только после загрузки всех строк
+    return time.perf_counter() - start, len(body)
+
+
+async def stream(options: dict, batch_size: int) -> tuple:
+    start = time.perf_counter()
+    first_byte, size = None, 0
+    batches = crud_file.stream_by_filters(options, batch_size=batch_size)
+    async for chunk in iter_ndjson(batches):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    return first_byte, size
+
+
+async def measure(title: str, coro) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_byte, size = await coro
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        f'{title:<16} {first_byte * 1000:>12.0f} {total * 1000:>10.0f} '
+        f'{peak / 2 ** 20:>10.1f} {size / 2 ** 20:>10.1f}'
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+
+    async with engine.begin() as conn:
+        await conn.execute(text(SEED_USERS), {'users': 1})
+        await conn.execute(text(SEED_FILES), {'rows': args.rows, 'users': 1})
+    try:
+        options = {'user_id': bench_uid(1), 'order_by': 'created'}
+        print(
+            f'{"вариант":<16} {"1-й байт, мс":>12} {"всего, мс":>10} '
+            f'{"пик, МБ":>10} {"ответ, МБ":>10}'
+        )
+        await measure('весь список', load_all(options))
+        await measure('NDJSON поток', stream(options, args.batch))
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text('DELETE FROM users WHERE uid = :uid'),
+                {'uid': bench_uid(1)}
+            )
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
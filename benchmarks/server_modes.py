@@ -0,0 +1,158 @@
+'''
+Пропускная способность сервера в разных режимах запуска.
+
+Запускается из корня проекта при заполненном .env и доступной базе:
+
+    python benchmarks/server_modes.py --duration 10 --clients 4
+
+Для каждого режима src/main.py запускается отдельным процессом на
+свободном порту, затем несколько процессов-клиентов по keep-alive
+соединениям запрашивают --path в течение --duration секунд. Режимы:
+
+    dev      - как раньше: reload, asyncio, h11, один процесс
+    single   - один процесс, uvloop и httptools
+    workers  - --workers процессов, uvloop и httptools
+
+Клиенты тоже занимают ядра, поэтому на машине с малым числом ядер
+разница между single и workers будет меньше, чем в продакшене.
+'''
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODES = {
+    'dev': {
+        'APP_SERVER_RELOAD': 'True',
+        'APP_SERVER_WORKERS': '1',
+        'APP_SERVER_LOOP': 'asyncio',
+        'APP_SERVER_HTTP': 'h11',
+    },
+    'single': {
+        'APP_SERVER_RELOAD': 'False',
+        'APP_SERVER_WORKERS': '1',
+        'APP_SERVER_LOOP': 'uvloop',
+        'APP_SERVER_HTTP': 'httptools',
+    },
+    'workers': {
+        'APP_SERVER_RELOAD': 'False',
+        'APP_SERVER_LOOP': 'uvloop',
+        'APP_SERVER_HTTP': 'httptools',
+    },
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, port: int, workers: int) -> subprocess.Popen:
+    env = os.environ | MODES[mode] | {
+        'APP_HOST': '127.0.0.1',
+        'APP_HOST_TEST': '127.0.0.1',
+        'APP_PORT': str(port),
+    }
+    if mode == 'workers':
+        env['APP_SERVER_WORKERS'] = str(workers)
+    return subprocess.Popen(
+        [sys.executable, 'src/main.py'],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f'Сервер не ответил на {url} за {timeout} с')
+
+
+async def load(url: str, concurrency: int, duration: float) -> list:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+
+        async def worker() -> None:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get(url)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def run_client(url: str, concurrency: int, duration: float) -> list:
+    return asyncio.run(load(url, concurrency, duration))
+
+
+def measure(mode: str, args: argparse.Namespace) -> tuple:
+    port = free_port()
+    server = start_server(mode, port, args.workers)
+    url = f'http://127.0.0.1:{port}{args.path}'
+    try:
+        wait_ready(url)
+        with ProcessPoolExecutor(args.clients) as pool:
+            futures = [
+                pool.submit(run_client, url, args.concurrency, args.duration)
+                for _ in range(args.clients)
+            ]
+            latencies = [value for f in futures for value in f.result()]
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+    return len(latencies) / args.duration, latencies
+
+
+def percentile(values: list, q: int) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--path', default='/api/internal/health')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument(
+        '--modes', nargs='+', choices=MODES, default=list(MODES)
+    )
+    args = parser.parse_args()
+
+    print(f'{"режим":<10} {"запр/с":>10} {"p50, мс":>10} {"p99, мс":>10}')
+    for mode in args.modes:
+        rps, latencies = measure(mode, args)
+        print(
+            f'{mode:<10} {rps:>10.1f} {percentile(latencies, 50):>10.1f} '
+            f'{percentile(latencies, 99):>10.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
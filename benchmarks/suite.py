@@ -0,0 +1,556 @@
+'''
+Нагрузочный прогон приложения целиком, со сравнением с базовой линией.
+
+Приложение работает в этом же процессе, запросы идут через
+ASGITransport httpx, без сети и без docker. Запускается из корня
+проекта при заполненном .env:
+
+    python benchmarks/suite.py --spawn-postgres
+    python benchmarks/suite.py --dsn postgresql+asyncpg://...
+
+С --spawn-postgres во временной директории создается и запускается
+отдельный кластер postgres (initdb и pg_ctl ищутся в PATH или в
+--pg-bin; initdb не запускается от root). С --dsn используется уже
+существующая база, таблицы создаются, если их нет. Redis
+заменяет fakeredis, если он установлен (--redis fake), или не
+используется вовсе (--redis none) - приложение тогда работает
+напрямую с базой. Файлы пишутся во временную директорию.
+
+Сценарии: параллельные загрузки файлов разного размера, скачивание
+"холодное" (кэш метаданных пуст) и "горячее" (одни и те же файлы),
+поиск по большому каталогу, всплеск входов и смесь всего сразу. Для
+каждого выводятся запросы в секунду, МБ/с, p50/p99 задержки и пик
+RSS процесса.
+
+    python benchmarks/suite.py ... --save-baseline
+    python benchmarks/suite.py ... --tolerance 0.25
+
+Первая команда записывает результаты в --baseline, вторая сравнивает
+с ними и завершается с кодом 1, если пропускная способность упала,
+p99 или пик RSS выросли больше чем на tolerance, или были ошибки.
+Базовая линия имеет смысл только для той же машины и тех же
+параметров прогона.
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from httpx import ASGITransport, AsyncClient, Response
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'src'))
+
+DEFAULT_BASELINE = ROOT / 'benchmarks' / 'baselines.json'
+PASSWORD = 'Changeme1!'
+# Размеры загружаемых файлов и их доли в сценарии загрузки
+UPLOAD_SIZES = (
+    (1024, 40),
+    (16 * 1024, 30),
+    (256 * 1024, 20),
+    (1024 * 1024, 8),
+    (4 * 1024 * 1024, 2),
+)
+EXTENSIONS = ('txt', 'pdf', 'png', 'jpg', 'doc', 'csv', 'zip', 'mp3')
+
+SEED_FILES = '''
+INSERT INTO file (fid, name, created, path, size, extension, user_id)
+SELECT
+    md5(:username || n)::uuid,
+    CASE WHEN n % 1000 = 0 THEN 'report-needle-' ELSE 'file-' END
+        || n || '.' || ext,
+    now() - n * interval '1 second',
+    :username || '/catalog/dir' || n % 100 || '/file-' || n || '.' || ext,
+    n % 100000,
+    ext,
+    :uid
+FROM generate_series(1, :rows) AS n,
+    LATERAL (
+        SELECT (ARRAY['txt', 'pdf', 'png', 'jpg', 'doc',
+                      'xls', 'zip', 'mp3', 'mp4', 'csv'])[n % 10 + 1]
+    ) AS e(ext)
+'''
+
+Call = Callable[[], Awaitable[Response]]
+
+
+@dataclass
+class Result:
+    '''Итоги одного сценария.'''
+    name: str
+    requests: int = 0
+    errors: int = 0
+    received: int = 0
+    elapsed: float = 0.0
+    peak_rss: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+    def percentile(self, q: int) -> float:
+        if len(self.latencies) < 2:
+            return sum(self.latencies) * 1000
+        return statistics.quantiles(self.latencies, n=100)[q - 1] * 1000
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'throughput': self.requests / self.elapsed,
+            'mb_per_s': self.received / self.elapsed / 2 ** 20,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'peak_rss': self.peak_rss / 2 ** 20,
+            'errors': self.errors,
+        }
+
+
+def current_rss() -> int:
+    '''Текущий RSS процесса в байтах.'''
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize()
+    except OSError:
+        # Не Linux: только пик за все время работы процесса
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def sample_rss(result: Result) -> None:
+    while True:
+        result.peak_rss = max(result.peak_rss, current_rss())
+        await asyncio.sleep(0.01)
+
+
+async def drive(name: str, calls: List[Call], concurrency: int) -> Result:
+    '''Выполняет calls не более concurrency одновременно и замеряет их.'''
+    result = Result(name=name, peak_rss=current_rss())
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(call: Call) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await call()
+            result.latencies.append(time.perf_counter() - start)
+        result.requests += 1
+        result.received += len(response.content)
+        if response.status_code >= 400:
+            result.errors += 1
+
+    sampler = asyncio.create_task(sample_rss(result))
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(timed(call) for call in calls))
+    finally:
+        result.elapsed = time.perf_counter() - start
+        sampler.cancel()
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def pg_tool(name: str, pg_bin: Optional[str]) -> str:
+    path = (
+        str(Path(pg_bin) / name) if pg_bin else shutil.which(name)
+    )
+    if not path:
+        raise SystemExit(f'{name} не найден, укажите --pg-bin')
+    return path
+
+
+@asynccontextmanager
+async def spawned_postgres(
+    workdir: Path,
+    pg_bin: Optional[str]
+) -> AsyncIterator[str]:
+    '''Запускает временный кластер postgres и возвращает его DSN.'''
+    if os.geteuid() == 0:
+        raise SystemExit('initdb нельзя запускать от root')
+    pgdata = workdir / 'pgdata'
+    port = free_port()
+    subprocess.run(
+        [
+            pg_tool('initdb', pg_bin), '-D', str(pgdata), '-U', 'postgres',
+            '--auth=trust', '--no-sync'
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL
+    )
+    pg_ctl = pg_tool('pg_ctl', pg_bin)
+    options = f'-p {port} -k {workdir} -c fsync=off'
+    subprocess.run(
+        [
+            pg_ctl, '-D', str(pgdata), '-o', options, '-w',
+            '-l', str(workdir / 'postgres.log'), 'start'
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        yield f'postgresql+asyncpg://postgres@127.0.0.1:{port}/postgres'
+    finally:
+        subprocess.run(
+            [pg_ctl, '-D', str(pgdata), '-m', 'fast', 'stop'],
+            stdout=subprocess.DEVNULL
+        )
+
+
+async def create_schema() -> None:
+    '''Создает таблицы, если их нет; без pg_trgm - без индекса по имени.'''
+    from sqlalchemy import text
+
+    from db.models import Base, File
+    from db.session import engine
+
+    async with engine.begin() as conn:
+        try:
+            async with conn.begin_nested():
+                await conn.execute(
+                    text('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                )
+        except Exception as err:
+            print(f'pg_trgm недоступно, поиск по имени без индекса: {err}')
+            File.__table__.indexes = {
+                index for index in File.__table__.indexes
+                if index.name != 'ix_file_name_trgm'
+            }
+        await conn.run_sync(Base.metadata.create_all)
+
+
+def use_redis(mode: str) -> None:
+    import core.redis
+
+    if mode == 'fake':
+        if fakeredis is None:
+            raise SystemExit('fakeredis не установлен, используйте --redis')
+        core.redis.redis_client = fakeredis.FakeAsyncRedis()
+
+
+async def flush_redis() -> None:
+    from redis.exceptions import RedisError
+
+    from core.redis import get_redis
+
+    try:
+        await get_redis().flushdb()
+    except RedisError:
+        pass
+
+
+class Workload:
+    '''Пользователи, их файлы и запросы для сценариев.'''
+
+    def __init__(self, client: AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.random = random.Random(args.seed)
+        # Имена пользователей уникальны для прогона: база с --dsn может
+        # остаться от предыдущего
+        self.prefix = f'bench{uuid.uuid4().hex[:8]}'
+        self.headers: List[Dict[str, str]] = []
+        self.files: List[tuple] = []
+
+    def username(self, number: int) -> str:
+        return f'{self.prefix}-{number}'
+
+    async def register(self) -> None:
+        for number in range(self.args.users):
+            credentials = {
+                'username': self.username(number), 'password': PASSWORD
+            }
+            await self.client.post('/api/auth/register', json=credentials)
+            response = await self.client.post(
+                '/api/auth/token', data=credentials
+            )
+            token = response.json()
+            self.headers.append({
+                'Authorization':
+                    f'{token["token_type"]} {token["access_token"]}'
+            })
+
+    def upload_size(self) -> int:
+        sizes, weights = zip(*UPLOAD_SIZES)
+        return self.random.choices(sizes, weights)[0]
+
+    def upload(self, number: int) -> Call:
+        headers = self.headers[number % len(self.headers)]
+        extension = self.random.choice(EXTENSIONS)
+        path = f'uploads/{number}.{extension}'
+        # Уникальное содержимое: дедупликация не должна подменять запись
+        content = self.random.randbytes(self.upload_size())
+
+        async def call() -> Response:
+            response = await self.client.post(
+                '/api/files/upload',
+                params={'path': path},
+                files={'file': (path.split('/')[-1], content)},
+                headers=headers
+            )
+            if response.status_code == 200:
+                self.files.append((headers, response.json()['fid']))
+            return response
+
+        return call
+
+    def download(self, headers: Dict[str, str], fid: str) -> Call:
+        return lambda: self.client.get(
+            '/api/files/download',
+            params={'file_id': fid},
+            headers=headers
+        )
+
+    def search(self) -> Call:
+        options = self.random.choice([
+            {'query': 'needle'},
+            {'extension': self.random.choice(EXTENSIONS)},
+            {'order_by': '-created', 'limit': 20},
+            {'order_by': 'name', 'limit': 100},
+            {'path': f'{self.username(0)}/catalog/dir1/file-101.txt'},
+        ])
+        return lambda: self.client.post(
+            '/api/files/search', json=options, headers=self.headers[0]
+        )
+
+    def login(self) -> Call:
+        number = self.random.randrange(len(self.headers))
+        credentials = {'username': self.username(number), 'password': PASSWORD}
+        return lambda: self.client.post('/api/auth/token', data=credentials)
+
+    async def seed_catalog(self) -> None:
+        '''Добавляет первому пользователю каталог из --catalog файлов.'''
+        from sqlalchemy import text
+
+        from db.session import engine
+
+        username = self.username(0)
+        async with engine.begin() as conn:
+            uid = (await conn.execute(
+                text('SELECT uid FROM users WHERE username = :username'),
+                {'username': username}
+            )).scalar_one()
+            await conn.execute(
+                text(SEED_FILES),
+                {'username': username, 'uid': uid, 'rows': self.args.catalog}
+            )
+            await conn.execute(text('ANALYZE file'))
+
+
+async def run_scenarios(workload: Workload) -> List[Result]:
+    args = workload.args
+    results = [await drive(
+        'upload',
+        [workload.upload(number) for number in range(args.uploads)],
+        args.concurrency
+    )]
+
+    files = list(workload.files)
+    workload.random.shuffle(files)
+    await flush_redis()
+    results.append(await drive(
+        'download_cold',
+        [workload.download(*file) for file in files],
+        args.concurrency
+    ))
+    hot = files[:5]
+    results.append(await drive(
+        'download_hot',
+        [workload.download(*hot[n % len(hot)]) for n in range(args.downloads)],
+        args.concurrency
+    ))
+
+    await workload.seed_catalog()
+    results.append(await drive(
+        'search',
+        [workload.search() for _ in range(args.searches)],
+        args.concurrency
+    ))
+    results.append(await drive(
+        'login_storm',
+        [workload.login() for _ in range(args.logins)],
+        args.concurrency
+    ))
+
+    mixed = (
+        [workload.upload(args.uploads + n) for n in range(args.uploads // 4)]
+        + [workload.download(*file) for file in files[:args.downloads // 2]]
+        + [workload.search() for _ in range(args.searches // 2)]
+        + [workload.login() for _ in range(args.logins // 4)]
+    )
+    workload.random.shuffle(mixed)
+    results.append(await drive('mixed', mixed, args.concurrency))
+    return results
+
+
+async def run(args: argparse.Namespace) -> List[Result]:
+    # Настройки читаются при импорте модулей приложения: окружение и
+    # рабочая директория (в ней создается data) задаются до импорта
+    os.environ['APP_TESTING'] = 'True'
+    os.environ['APP_POSTGRES_DSN_TEST'] = args.dsn
+    os.chdir(args.workdir)
+    # Логи приложения тоже пишутся относительно рабочей директории
+    (args.workdir / 'logs').mkdir(exist_ok=True)
+
+    from db.session import engine
+    from main import app
+
+    use_redis(args.redis)
+    await create_schema()
+    transport = ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(
+            transport=transport, base_url='http://bench', timeout=None
+        ) as client:
+            workload = Workload(client, args)
+            await workload.register()
+            try:
+                return await run_scenarios(workload)
+            finally:
+                await engine.dispose()
+                os.chdir(ROOT)
+
+
+def report(results: List[Result]) -> None:
+    print(
+        f'{"сценарий":<14} {"запросов":>9} {"ошибок":>7} {"запр/с":>9} '
+        f'{"МБ/с":>8} {"p50, мс":>9} {"p99, мс":>9} {"RSS, МБ":>9}'
+    )
+    for result in results:
+        stats = result.summary()
+        print(
+            f'{result.name:<14} {result.requests:>9} {result.errors:>7} '
+            f'{stats["throughput"]:>9.1f} {stats["mb_per_s"]:>8.1f} '
+            f'{stats["p50"]:>9.1f} {stats["p99"]:>9.1f} '
+            f'{stats["peak_rss"]:>9.1f}'
+        )
+
+
+def params(args: argparse.Namespace) -> Dict[str, int]:
+    '''Параметры, от которых зависят результаты прогона.'''
+    return {
+        name: getattr(args, name) for name in (
+            'users', 'uploads', 'downloads', 'catalog', 'searches',
+            'logins', 'concurrency', 'seed'
+        )
+    }
+
+
+def regressions(
+    results: List[Result],
+    baseline: Dict,
+    tolerance: float
+) -> List[str]:
+    '''Сценарии, которые стали хуже базовой линии больше чем на tolerance.'''
+    found = []
+    for result in results:
+        stats = result.summary()
+        base = baseline['scenarios'].get(result.name)
+        if stats['errors']:
+            found.append(f'{result.name}: ошибок {stats["errors"]}')
+        if base is None:
+            continue
+        if stats['throughput'] < base['throughput'] * (1 - tolerance):
+            found.append(
+                f'{result.name}: запр/с {stats["throughput"]:.1f}, '
+                f'было {base["throughput"]:.1f}'
+            )
+        for key in ('p99', 'peak_rss'):
+            if stats[key] > base[key] * (1 + tolerance):
+                found.append(
+                    f'{result.name}: {key} {stats[key]:.1f}, '
+                    f'было {base[key]:.1f}'
+                )
+    return found
+
+
+def compare(args: argparse.Namespace, results: List[Result]) -> int:
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({
+            'params': params(args),
+            'scenarios': {
+                result.name: result.summary() for result in results
+            },
+        }, indent=2, ensure_ascii=False) + '\n')
+        print(f'Базовая линия записана в {args.baseline}')
+        return 0
+    if not args.baseline.exists():
+        print(f'Нет базовой линии {args.baseline}, сравнение пропущено')
+        return 0
+    baseline = json.loads(args.baseline.read_text())
+    if baseline['params'] != params(args):
+        print(
+            'Базовая линия записана с другими параметрами: '
+            f'{baseline["params"]}'
+        )
+        return 2
+    found = regressions(results, baseline, args.tolerance)
+    for line in found:
+        print(f'РЕГРЕССИЯ {line}')
+    return 1 if found else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    database = parser.add_mutually_exclusive_group(required=True)
+    database.add_argument('--dsn', help='DSN существующей базы')
+    database.add_argument('--spawn-postgres', action='store_true')
+    parser.add_argument('--pg-bin', help='директория initdb и pg_ctl')
+    parser.add_argument(
+        '--redis',
+        choices=('fake', 'server', 'none'),
+        default='fake' if fakeredis else 'none'
+    )
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--uploads', type=int, default=200)
+    parser.add_argument('--downloads', type=int, default=400)
+    parser.add_argument('--catalog', type=int, default=50000)
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    return parser.parse_args()
+
+
+async def main() -> int:
+    args = parse_args()
+    args.baseline = args.baseline.resolve()
+    load_dotenv(ROOT / '.env')
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = Path(workdir)
+        if args.spawn_postgres:
+            async with spawned_postgres(args.workdir, args.pg_bin) as dsn:
+                args.dsn = dsn
+                results = await run(args)
+        else:
+            results = await run(args)
+    report(results)
+    return compare(args, results)
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,78 @@
+'''
+Сравнение пикового потребления памяти при сохранении загруженного файла.
+
+Каждый вариант запускается в отдельном процессе, чтобы ru_maxrss
+отражал только его собственный пик:
+
+    python benchmarks/upload_memory.py --sizes 64 256 1024
+'''
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from utils.services import write_data, write_stream  # noqa: E402
+
+CHUNK = 1024 * 1024
+
+
+def make_spooled_file(size_mb: int) -> tempfile.SpooledTemporaryFile:
+    '''Готовит файл так же, как его получает обработчик от starlette.'''
+    spooled = tempfile.SpooledTemporaryFile(max_size=CHUNK)
+    block = b'x' * CHUNK
+    for _ in range(size_mb):
+        spooled.write(block)
+    spooled.seek(0)
+    return spooled
+
+
+def run_variant(variant: str, size_mb: int) -> None:
+    '''Сохраняет файл выбранным способом и печатает пик RSS в МБ.'''
+    src = make_spooled_file(size_mb)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as tmp:
+        target = Path(tmp) / 'upload.bin'
+        start = time.perf_counter()
+        if variant == 'buffered':
+            write_data(filepath=target, data=src.read())
+        else:
+            write_stream(filepath=target, stream=src, chunk_size=CHUNK)
+        elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'{(peak - baseline) / 1024:.1f} {elapsed:.3f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--variant', choices=['buffered', 'streaming'])
+    parser.add_argument('--size', type=int)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.size)
+        return
+
+    print(
+        f'{"size, MB":>10} {"variant":>10} '
+        f'{"rss delta, MB":>14} {"time, s":>8}'
+    )
+    for size_mb in args.sizes:
+        for variant in ('buffered', 'streaming'):
+            out = subprocess.run(
+                [
+                    sys.executable, __file__,
+                    '--variant', variant, '--size', str(size_mb)
+                ],
+                capture_output=True, text=True, check=True
+            ).stdout.split()
+            print(f'{size_mb:>10} {variant:>10} {out[0]:>14} {out[1]:>8}')
+
+
+if __name__ == '__main__':
+    main()
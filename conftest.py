@@ -0,0 +1,9 @@
+import pytest
+
+from utils.storage import init_storage
+
+
+@pytest.fixture(scope='session', autouse=True)
+def storage_dirs() -> None:
+    '''Директории данных: тесты не запускают lifespan приложения.'''
+    init_storage()
@@ -0,0 +1,57 @@
+"""file_search_indexes
+
+Revision ID: c3f7a1e5d820
+Revises: 9d1a6c7e2b40
+Create Date: 2026-10-18 12:20:31.551873
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f7a1e5d820'
+down_revision: Union[str, None] = '9d1a6c7e2b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CONCURRENTLY не блокирует запись в большую таблицу file,
+    # но не может выполняться внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_file_user_id_created', 'file', ['user_id', 'created'],
+            unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_file_user_id_extension', 'file', ['user_id', 'extension'],
+            unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_file_path', 'file', ['path'], unique=False,
+            postgresql_ops={'path': 'varchar_pattern_ops'},
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_file_name_trgm', 'file', ['name'], unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'},
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    # Расширение pg_trgm не удаляется: им могут пользоваться другие таблицы
+    with op.get_context().autocommit_block():
+        for name in (
+            'ix_file_name_trgm',
+            'ix_file_path',
+            'ix_file_user_id_extension',
+            'ix_file_user_id_created'
+        ):
+            op.drop_index(
+                name, table_name='file', postgresql_concurrently=True
+            )
@@ -1,31 +1,216 @@
 import logging
-from datetime import timedelta
+from fnmatch import fnmatch
 from functools import partial
-from typing import Annotated, List, Optional
-from uuid import UUID
+from pathlib import Path
+from typing import (
+    Annotated,
+    AsyncIterator,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union
+)
+from uuid import UUID, uuid4
 
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile
-from fastapi.responses import FileResponse
+import orjson
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    status,
+    UploadFile
+)
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import Headers
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from core.redis import redis_client
-from core.settings import DATA_DIR, REDIS_TTL
-from db.crud import crud_file
+from core.executors import io_executor
+from core.metrics import DOWNLOAD_BYTES
+from core.settings import app_settings, DATA_DIR
+from db.crud import crud_file, crud_usage
+from db.models import File
 from db.session import get_session
-from schemas.entities import BaseFile, FileCreate, FileFilter
-from schemas.users import BaseUser
+from schemas.entities import (
+    BaseFile,
+    BatchUploadResult,
+    FileCreate,
+    FileFilter,
+    FilePage,
+    FileRecord
+)
+from schemas.users import UserPrincipal
+from utils.archive import ARCHIVE_WRITERS, ArchiveEntry, ArchiveWriter
 from utils.auth import get_current_user
-from utils.services import get_path_name, run_in_executor, write_data
+from utils.cache import file_cache
+from utils.pagination import decode_cursor, encode_cursor
+from utils.responses import (
+    AccelRedirectResponse,
+    DecodedFileResponse,
+    RangeFileResponse,
+    accepts_encoding,
+    content_disposition,
+    http_date,
+    is_not_modified
+)
+from utils.services import (
+    get_path_name,
+    resolve_upload_path,
+    run_in_executor
+)
+from utils.storage import (
+    WrittenFile,
+    file_location,
+    upload_location,
+    write_batch,
+    write_upload
+)
 
 logger = logging.getLogger(__name__)
 
 file_router = APIRouter(prefix='/files', tags=['files'])
 
 
+def cache_control(path: str) -> str:
+    '''Cache-Control для файла path по настройке DOWNLOAD_CACHE_CONTROL.'''
+    # Шаблоны задаются для путей без имени пользователя
+    relative = path.partition('/')[2]
+    for pattern, value in app_settings.DOWNLOAD_CACHE_CONTROL.items():
+        if fnmatch(relative, pattern):
+            return value
+    return app_settings.DOWNLOAD_CACHE_CONTROL_DEFAULT
+
+
+def validator_headers(
+    file: Union[File, FileRecord],
+    coding: Optional[str]
+) -> Dict[str, str]:
+    '''
+    ETag, Last-Modified и Cache-Control файла file.
+
+    Содержимое записи о файле не меняется, поэтому ETag - sha256
+    содержимого, а без дедупликации - fid. coding - Content-Encoding
+    ответа: сжатое и исходное представления различаются ETag.
+    '''
+    tag = file.blob_id or str(file.fid)
+    if coding:
+        tag = f'{tag}-{coding}'
+    headers = {
+        'etag': f'"{tag}"',
+        'last-modified': http_date(file.created),
+        'cache-control': cache_control(file.path),
+    }
+    if file.codec:
+        headers['vary'] = 'Accept-Encoding'
+    return headers
+
+
+def file_response(
+    file: Union[File, FileRecord],
+    request_headers: Headers
+) -> Response:
+    '''
+    Формирует ответ с содержимым файла file.
+
+    Если у клиента актуальная версия (If-None-Match, If-Modified-Since),
+    отвечает 304 по метаданным, не обращаясь к диску. Сжатый на диске
+    файл отдается как есть с Content-Encoding, если клиент принимает
+    кодек, иначе распаковывается во время отправки. При включенном
+    DOWNLOAD_ACCEL_REDIRECT тело файла отдает nginx.
+    '''
+    coding = None
+    if file.codec and accepts_encoding(
+        request_headers.get('accept-encoding'), file.codec
+    ):
+        coding = file.codec
+    headers = validator_headers(file, coding)
+    if is_not_modified(request_headers, headers['etag'], file.created):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers=headers
+        )
+
+    path = file_location(file)
+    if file.codec and not coding:
+        response = DecodedFileResponse(
+            path=DATA_DIR / path,
+            filename=file.name,
+            codec=file.codec,
+            size=int(file.size)
+        )
+    elif app_settings.DOWNLOAD_ACCEL_REDIRECT:
+        response = AccelRedirectResponse(
+            location=app_settings.ACCEL_REDIRECT_LOCATION,
+            path=path,
+            filename=file.name
+        )
+    else:
+        response = RangeFileResponse(path=DATA_DIR / path, filename=file.name)
+    if coding:
+        response.headers['content-encoding'] = coding
+    response.headers.update(headers)
+    return response
+
+
+async def check_quota(
+    db: AsyncSession,
+    user: UserPrincipal,
+    size: int,
+    count: int = 1
+) -> None:
+    '''
+    Проверяет, что count файлов общим размером size не превысят квоты
+    пользователя.
+
+    Читает готовые счетчики из usage, файлы пользователя не перебираются.
+    '''
+    max_files = app_settings.QUOTA_MAX_FILES
+    max_bytes = app_settings.QUOTA_MAX_BYTES
+    if max_files is None and max_bytes is None:
+        return
+    usage = await crud_usage.get(db=db, user_id=user.uid)
+    files_count = usage.files_count if usage else 0
+    files_size = usage.files_size if usage else 0
+    if (
+        (max_files is not None and files_count + count > max_files)
+        or (max_bytes is not None and files_size + size > max_bytes)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail='Превышена квота на число или общий размер файлов.'
+        )
+
+
+async def save_file_record(
+    db: AsyncSession,
+    file_schema: FileCreate,
+    tmp_path: Optional[Path] = None
+) -> File:
+    '''
+    Создает запись о файле и переносит его содержимое в хранилище.
+
+    tmp_path - временный файл с содержимым, если файл хранится как blob.
+    Содержимое переносится до commit записи, при ошибке запись
+    не создается, и обработчик отвечает 500.
+    '''
+    new_file = await crud_file.create(
+        db=db, data_in=file_schema, tmp_path=tmp_path
+    )
+    if not new_file:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Не удалось сохранить файл. Попробуйте позже.'
+        )
+    return new_file
+
+
 @file_router.post(path='/upload', response_model=BaseFile)
 async def upload_file(
     db: Annotated[AsyncSession, Depends(get_session)],
-    current_user: Annotated[BaseUser, Depends(get_current_user)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
     file: UploadFile,
     path: str
 ) -> BaseFile:
@@ -36,43 +221,332 @@ async def upload_file(
             detail='Войдите в личный кабинет для доступа к сайту.'
         )
 
-    data = await file.read()
-
-    USER_DIR = DATA_DIR / current_user.username
-    path_for_user, data_path, filename = get_path_name(path, USER_DIR)
-
-    path_for_user = f'{current_user.username}/{path_for_user}'
+    # run_in_executor возвращает None, если операция на диске не удалась
+    write_error = HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail='Ошибка при сохранении файла, попробуйте позже.'
+    )
+    # Размер известен после разбора формы, до записи в хранилище
+    await check_quota(db=db, user=current_user, size=file.size or 0)
 
-    if not filename:
-        filename = file.filename
-        data_path = data_path / filename
-        path_for_user = f'{path_for_user}/{filename}'
+    dedup = app_settings.STORAGE_DEDUPLICATION
+    fid = uuid4()
+    location = None if dedup else upload_location(fid)
+    # При дедупликации и в раскладке sharded путь пользователя только
+    # логический, директории под него на диске не нужны
+    resolved = await run_in_executor(
+        partial(
+            resolve_upload_path,
+            path=path,
+            username=current_user.username,
+            default_filename=file.filename,
+            create_dirs=not dedup and location is None
+        )
+    )
+    if resolved is None:
+        raise write_error
+    path_for_user, data_path, filename = resolved
+    if location:
+        data_path = DATA_DIR / location
     ext = filename.split('.')[-1]
 
-    await run_in_executor(
-        partial(write_data, filepath=data_path, data=data)
+    # Файл пишется на диск частями, целиком в память он не загружается
+    written = await run_in_executor(
+        partial(
+            write_upload,
+            stream=file.file,
+            filename=filename,
+            data_path=None if dedup else data_path,
+            chunk_size=app_settings.UPLOAD_CHUNK_SIZE
+        )
     )
+    if written is None:
+        raise write_error
 
     file_schema = FileCreate(
+        fid=fid,
         name=filename,
         path=path_for_user,
-        size=file.size,
+        size=written.size,
         extension=ext,
-        user_id=current_user.uid
+        user_id=current_user.uid,
+        blob_id=written.blob_id,
+        codec=written.codec,
+        location=location
     )
 
-    new_file = await crud_file.create(db=db, data_in=file_schema)
-    return new_file
+    return await save_file_record(
+        db=db,
+        file_schema=file_schema,
+        tmp_path=written.path if dedup else None
+    )
+
+
+def check_batch_names(
+    files: List[UploadFile],
+    path_for_user: str
+) -> Tuple[List[BatchUploadResult], List[str]]:
+    '''
+    Проверяет имена файлов пакетной загрузки.
+
+    Возвращает статусы всех файлов и их имена без пути клиента. Файлы,
+    которые нельзя сохранить, сразу получают статус 400.
+    '''
+    # Одна слишком длинная строка сорвала бы вставку всего пакета,
+    # поэтому такие файлы отклоняются заранее
+    columns = File.__table__.c
+    results, names = [], []
+    for file in files:
+        # Имя из multipart может содержать путь на машине клиента
+        name = Path(file.filename or '').name
+        result = BatchUploadResult(
+            filename=file.filename or '',
+            status=status.HTTP_200_OK
+        )
+        if not name:
+            result.status = status.HTTP_400_BAD_REQUEST
+            result.detail = 'Нужно указать имя файла.'
+        elif (
+            len(f'{path_for_user}/{name}') > columns.path.type.length
+            or len(name.split('.')[-1]) > columns.extension.type.length
+        ):
+            result.status = status.HTTP_400_BAD_REQUEST
+            result.detail = 'Слишком длинное имя файла.'
+        results.append(result)
+        names.append(name)
+    return results, names
+
+
+async def save_batch_records(
+    db: AsyncSession,
+    user: UserPrincipal,
+    path_for_user: str,
+    written: Dict[int, WrittenFile],
+    names: List[str],
+    fids: Dict[int, UUID],
+    locations: Dict[int, Optional[str]],
+    results: List[BatchUploadResult]
+) -> None:
+    '''
+    Создает записи о записанных на диск файлах одним запросом,
+    содержимое переносится в хранилище до commit. Статусы пишутся
+    в results.
+
+    fids и locations - заранее выбранные fid файлов и места их
+    содержимого в раскладке sharded.
+    '''
+    indexes = list(written)
+    file_schemas = [
+        FileCreate(
+            fid=fids[index],
+            name=names[index],
+            path=f'{path_for_user}/{names[index]}',
+            size=written[index].size,
+            extension=names[index].split('.')[-1],
+            user_id=user.uid,
+            blob_id=written[index].blob_id,
+            codec=written[index].codec,
+            location=locations[index]
+        )
+        for index in indexes
+    ]
+    new_files = await crud_file.create_multi(
+        db=db,
+        data_in=file_schemas,
+        tmp_paths=[
+            written[index].path if written[index].blob_id else None
+            for index in indexes
+        ]
+    )
+    if new_files is None:
+        for index in indexes:
+            results[index].status = status.HTTP_500_INTERNAL_SERVER_ERROR
+            results[index].detail = 'Не удалось сохранить файл.'
+        return
+    for index, new_file in zip(indexes, new_files):
+        results[index].file = BaseFile.model_validate(
+            new_file, from_attributes=True
+        )
+
+
+@file_router.post(
+    path='/upload/batch',
+    response_model=List[BatchUploadResult]
+)
+async def upload_batch(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    files: List[UploadFile],
+    path: str
+) -> List[BatchUploadResult]:
+    '''
+    Принимает несколько файлов и сохраняет их в директорию path.
+
+    Файлы пишутся на диск одним заданием в пуле потоков, записи о них
+    создаются одним INSERT в одной транзакции. Для каждого файла
+    возвращается свой статус: файл без имени не мешает сохранить
+    остальные.
+    '''
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Войдите в личный кабинет для доступа к сайту.'
+        )
+    if len(files) > app_settings.UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                'Слишком много файлов, максимум '
+                f'{app_settings.UPLOAD_BATCH_MAX_FILES}.'
+            )
+        )
+
+    dedup = app_settings.STORAGE_DEDUPLICATION
+    user_paths = not dedup and app_settings.STORAGE_LAYOUT == 'user'
+    resolved = await run_in_executor(
+        partial(
+            get_path_name,
+            filepath=path,
+            base_dir=DATA_DIR / current_user.username,
+            create_dirs=user_paths
+        )
+    )
+    if resolved is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Ошибка при сохранении файлов, попробуйте позже.'
+        )
+    path_for_user, data_path, filename = resolved
+    if filename:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Для пакетной загрузки нужно указать директорию.'
+        )
+    path_for_user = f'{current_user.username}/{path_for_user}'
+
+    results, names = check_batch_names(files, path_for_user)
+    accepted = [
+        index for index, result in enumerate(results)
+        if result.status == status.HTTP_200_OK
+    ]
+    await check_quota(
+        db=db,
+        user=current_user,
+        size=sum(files[index].size or 0 for index in accepted),
+        count=len(accepted)
+    )
+
+    fids = {index: uuid4() for index in accepted}
+    locations = {
+        index: None if dedup else upload_location(fid)
+        for index, fid in fids.items()
+    }
+    data_paths = None if dedup else [
+        DATA_DIR / locations[index] if locations[index]
+        else data_path / names[index]
+        for index in accepted
+    ]
+    written = await run_in_executor(
+        partial(
+            write_batch,
+            streams=[files[index].file for index in accepted],
+            data_paths=data_paths,
+            filenames=[names[index] for index in accepted],
+            chunk_size=app_settings.UPLOAD_CHUNK_SIZE
+        )
+    )
+    for index, item in zip(accepted, written):
+        if item is None:
+            results[index].status = status.HTTP_500_INTERNAL_SERVER_ERROR
+            results[index].detail = 'Ошибка при сохранении файла.'
+    written = {
+        index: item for index, item in zip(accepted, written) if item
+    }
+    if written:
+        await save_batch_records(
+            db=db,
+            user=current_user,
+            path_for_user=path_for_user,
+            written=written,
+            names=names,
+            fids=fids,
+            locations=locations,
+            results=results
+        )
+    return results
+
+
+@file_router.get(path='/archive', response_class=StreamingResponse)
+async def download_archive(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    path: str = '',
+    format: Literal['zip', 'tar'] = 'zip'
+) -> StreamingResponse:
+    '''
+    Отдает директорию path со всеми вложенными файлами одним архивом.
+
+    Архив собирается во время отправки, без временных файлов. В ZIP
+    файлы из COMPRESSED_EXTENSIONS не сжимаются, tar не сжимается
+    целиком. Пустой path - все файлы пользователя.
+    '''
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Войдите в личный кабинет для доступа к сайту.'
+        )
+    directory = '/'.join(part for part in path.split('/') if part)
+    prefix = f'{current_user.username}/'
+    if directory:
+        prefix = f'{prefix}{directory}/'
+    filters = {
+        'user_id': current_user.uid,
+        'prefix': prefix,
+        'order_by': 'path',
+    }
+    # Статус ответа нельзя поменять после начала архива, поэтому
+    # пустая директория проверяется заранее
+    first = await crud_file.get_by_filters(
+        db=db, options=filters | {'limit': 1}
+    )
+    if not first:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='В директории нет файлов.'
+        )
+
+    writer = ARCHIVE_WRITERS[format](app_settings.ARCHIVE_CHUNK_SIZE)
+    batches = crud_file.stream_by_filters(
+        options=filters,
+        batch_size=app_settings.SEARCH_STREAM_BATCH_SIZE
+    )
+    # Архив называется по последней директории пути
+    filename = f'{directory.split("/")[-1] or current_user.username}.{format}'
+    return StreamingResponse(
+        iter_archive(writer=writer, batches=batches, root=prefix),
+        media_type=writer.media_type,
+        headers={'Content-Disposition': content_disposition(filename)}
+    )
 
 
-@file_router.get(path='/download', response_class=FileResponse)
+@file_router.get(path='/download', response_class=RangeFileResponse)
 async def download_file(
     db: Annotated[AsyncSession, Depends(get_session)],
-    current_user: Annotated[BaseUser, Depends(get_current_user)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    request: Request,
     path: Optional[str] = None,
     file_id: Optional[UUID] = None
-) -> FileResponse:
-    '''Получает путь до файла или id файла и переадресовывает на нужный url.'''
+) -> RangeFileResponse:
+    '''
+    Отдает файл по пути или id.
+
+    Поддерживает заголовки Range и If-Range для докачки и перемотки,
+    If-None-Match и If-Modified-Since для повторной синхронизации.
+    Файл, сжатый на диске, отдается сжатым (Content-Encoding), если
+    клиент принимает этот кодек, иначе распаковывается на лету.
+    При включенном DOWNLOAD_ACCEL_REDIRECT только проверяет доступ,
+    а сам файл отдает nginx.
+    '''
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -84,62 +558,210 @@ async def download_file(
         detail='Файл не найден в базе, проверьте введенные данные.'
     )
 
+    if not path and not file_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Введите путь к файлу или его id.'
+        )
+
     if path:
-        file_name = await redis_client.get(path)
-        logger.info(f"Ping successful: {await redis_client.ping()}")
-        logger.info(file_name)
-        await redis_client.aclose()
-        if not file_name:
-            file = await crud_file.get_by_path(db=db, path=path)
-            if not file:
-                raise file_not_found_error
-
-            await redis_client.setex(
-                name=path,
-                time=timedelta(days=REDIS_TTL),
-                value=file.name
-            )
-            await redis_client.aclose()
-            file_name = file.name
-
-        file_url = f'{DATA_DIR}/{path}'
-        return FileResponse(path=file_url, filename=file_name)
-
-    elif file_id:
-        file_name = await redis_client.get(file_id)
-        logger.info(f"Ping successful: {await redis_client.ping()}")
-        logger.info(file_name)
-        await redis_client.aclose()
-        if not file_name:
-            file = await crud_file.get(db=db, fid=file_id)
-            if not file:
-                raise file_not_found_error
-
-            await redis_client.setex(
-                name=file_id,
-                time=timedelta(days=REDIS_TTL),
-                value=file.name
-            )
-            await redis_client.aclose()
+        file = await file_cache.get_or_load(
+            key=file_cache.path_key(path),
+            loader=partial(crud_file.get_by_path, db=db, path=path)
+        )
+    else:
+        file = await file_cache.get_or_load(
+            key=file_cache.id_key(file_id),
+            loader=partial(crud_file.get, db=db, fid=file_id)
+        )
+    if not file:
+        raise file_not_found_error
 
-        file_url = f'{DATA_DIR}/{file.path}'
-        return FileResponse(path=file_url, filename=file.name)
+    return file_response(file=file, request_headers=request.headers)
 
-    raise HTTPException(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        detail='Введите путь к файлу или его id.'
+
+def search_filters(options: FileFilter, user: UserPrincipal) -> Dict:
+    '''Собирает фильтры поиска для crud_file из параметров запроса.'''
+    ordering = options.order_by or 'created'
+    filters = {
+        k: v for k, v in options.model_dump(exclude={'cursor'}).items() if v
+    }
+    filters.update({'user_id': user.uid, 'order_by': ordering})
+    if options.cursor:
+        filters['after'] = decode_cursor(options.cursor, ordering)
+    return filters
+
+
+async def search_page(
+    db: AsyncSession,
+    options: FileFilter,
+    user: UserPrincipal
+) -> FilePage:
+    '''Возвращает страницу поиска и курсор следующей страницы.'''
+    ordering = options.order_by or 'created'
+    limit = min(
+        options.limit or app_settings.SEARCH_PAGE_SIZE,
+        app_settings.SEARCH_MAX_PAGE_SIZE
+    )
+    filters = search_filters(options=options, user=user)
+    # Лишняя запись показывает, есть ли следующая страница
+    filters['limit'] = limit + 1
+    logger.info(filters)
+    files = await crud_file.get_by_filters(db=db, options=filters)
+
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        next_cursor = encode_cursor(ordering, files[-1])
+    return FilePage.model_validate(
+        {'items': files, 'next_cursor': next_cursor},
+        from_attributes=True
+    )
+
+
+def dump_file(file: File) -> bytes:
+    '''Сериализует запись о файле в JSON без промежуточной модели.'''
+    return orjson.dumps(
+        {field: getattr(file, field) for field in BaseFile.model_fields},
+        # UUID из asyncpg - не uuid.UUID, orjson сам его не сериализует
+        default=str
     )
 
 
-@file_router.post(path='/search', response_model=List[BaseFile])
+async def iter_ndjson(
+    batches: AsyncIterator[List[File]]
+) -> AsyncIterator[bytes]:
+    '''Отдает файлы по одному JSON-объекту на строку, пачка за пачкой.'''
+    async for batch in batches:
+        yield b''.join(dump_file(file) + b'\n' for file in batch)
+
+
+async def iter_json_array(
+    batches: AsyncIterator[List[File]]
+) -> AsyncIterator[bytes]:
+    '''Отдает файлы одним JSON-массивом, не собирая его в памяти.'''
+    separator = b'['
+    async for batch in batches:
+        if batch:
+            yield separator + b','.join(dump_file(file) for file in batch)
+            separator = b','
+    yield b'[]' if separator == b'[' else b']'
+
+
+async def iter_archive(
+    writer: ArchiveWriter,
+    batches: AsyncIterator[List[File]],
+    root: str
+) -> AsyncIterator[bytes]:
+    '''
+    Отдает архив с файлами из batches, собирая его на лету.
+
+    Следующая часть архива читается с диска только после того, как
+    предыдущая отправлена: send в StreamingResponse ждет, пока сервер
+    освободит буфер сокета, поэтому медленный клиент замедляет сборку
+    архива, а не копит его в памяти. Имена в архиве - пути без root.
+    '''
+    stored = set(app_settings.COMPRESSED_EXTENSIONS)
+    async for batch in batches:
+        entries = writer.write_entries([
+            ArchiveEntry(
+                name=file.path[len(root):],
+                path=DATA_DIR / file_location(file),
+                mtime=file.created,
+                compress=(file.extension or '').lower() not in stored,
+                codec=file.codec,
+                size=int(file.size or 0)
+            )
+            for file in batch
+        ])
+        # Ошибка чтения обрывает ответ: недописанный архив клиент
+        # должен увидеть как ошибку, а не как успешную загрузку
+        while (chunk := await io_executor.run(partial(next, entries, None))):
+            yield chunk
+            DOWNLOAD_BYTES.labels('archive').inc(len(chunk))
+    chunk = await io_executor.run(writer.close)
+    yield chunk
+    DOWNLOAD_BYTES.labels('archive').inc(len(chunk))
+
+
+@file_router.post(path='/search', response_model=FilePage)
 async def file_search(
     db: Annotated[AsyncSession, Depends(get_session)],
-    current_user: Annotated[BaseUser, Depends(get_current_user)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
     options: Optional[FileFilter] = None
-) -> List[BaseFile]:
-    '''Возвращает список файлов по заданным параметрам.'''
-    filters = {k: v for k, v in options.model_dump().items() if v}
-    filters.update({'user_id': current_user.uid})
+) -> FilePage:
+    '''
+    Возвращает страницу файлов по заданным параметрам.
+
+    Следующая страница запрашивается с теми же параметрами и cursor
+    из next_cursor. Если next_cursor пустой, страница последняя.
+    '''
+    return await search_page(
+        db=db,
+        options=options or FileFilter(),
+        user=current_user
+    )
+
+
+@file_router.post(path='/search/stream', response_class=StreamingResponse)
+async def file_search_stream(
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    options: Optional[FileFilter] = None
+) -> StreamingResponse:
+    '''
+    Возвращает все найденные файлы потоком NDJSON.
+
+    Строки читаются из базы keyset-пачками, поэтому память не растет
+    с числом файлов. limit не ограничен размером
+    страницы, cursor позволяет продолжить оборванную выдачу.
+    '''
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Войдите в личный кабинет для доступа к сайту.'
+        )
+    filters = search_filters(
+        options=options or FileFilter(), user=current_user
+    )
     logger.info(filters)
-    result = await crud_file.get_by_filters(db=db, options=filters)
-    return result
+    batches = crud_file.stream_by_filters(
+        options=filters,
+        batch_size=app_settings.SEARCH_STREAM_BATCH_SIZE
+    )
+    return StreamingResponse(
+        iter_ndjson(batches),
+        media_type='application/x-ndjson'
+    )
+
+
+@file_router.post(path='/export', response_class=StreamingResponse)
+async def file_export(
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    options: Optional[FileFilter] = None,
+    format: Literal['json', 'ndjson'] = 'json'
+) -> StreamingResponse:
+    '''Выгружает все найденные файлы вложением JSON или NDJSON.'''
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Войдите в личный кабинет для доступа к сайту.'
+        )
+    filters = search_filters(
+        options=options or FileFilter(), user=current_user
+    )
+    logger.info(filters)
+    batches = crud_file.stream_by_filters(
+        options=filters,
+        batch_size=app_settings.SEARCH_STREAM_BATCH_SIZE
+    )
+    if format == 'ndjson':
+        content, media_type = iter_ndjson(batches), 'application/x-ndjson'
+    else:
+        content, media_type = iter_json_array(batches), 'application/json'
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="files.{format}"'
+        }
+    )
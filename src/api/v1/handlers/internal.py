@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import Any, Dict
+
+from fastapi import APIRouter, Request, status
+from fastapi.responses import ORJSONResponse
+
+from core.executors import executors
+from core.settings import app_settings
+from db.session import ping_database, pool_stats
+from utils.cache import file_cache, principal_cache
+
+logger = logging.getLogger(__name__)
+
+# Снаружи закрыт в nginx, доступен только внутри сети сервисов
+internal_router = APIRouter(
+    prefix='/internal',
+    tags=['internal'],
+    include_in_schema=False
+)
+
+
+@internal_router.get(path='/stats')
+async def service_stats() -> Dict[str, Any]:
+    '''Возвращает метрики общих ресурсов процесса.'''
+    return {
+        'executors': {
+            name: executor.stats() for name, executor in executors.items()
+        },
+        'db_pool': pool_stats.stats(),
+        'file_cache': file_cache.stats(),
+        'principal_cache': principal_cache.stats(),
+    }
+
+
+@internal_router.get(path='/health')
+async def service_health() -> ORJSONResponse:
+    '''Проверяет соединение с базой, 503 если база не отвечает.'''
+    try:
+        latency = await asyncio.wait_for(
+            ping_database(),
+            timeout=app_settings.DB_POOL_TIMEOUT
+            + app_settings.DB_CONNECT_TIMEOUT
+        )
+    except Exception as err:
+        logger.error('Database health check failed: %r', err)
+        return ORJSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={'status': 'unavailable', 'database': repr(err)}
+        )
+    return ORJSONResponse(
+        content={'status': 'ok', 'database_latency': latency}
+    )
+
+
+@internal_router.get(path='/ready')
+async def service_ready(request: Request) -> ORJSONResponse:
+    '''
+    Готов ли процесс принимать запросы: 503, пока не закончен прогрев,
+    затем проверка базы, как в /health.
+    '''
+    if not getattr(request.app.state, 'ready', False):
+        return ORJSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={'status': 'warming'}
+        )
+    return await service_health()
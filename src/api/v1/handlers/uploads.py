@@ -0,0 +1,285 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Annotated, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from fastapi import APIRouter, Depends, HTTPException, Path, status, UploadFile
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.settings import app_settings, DATA_DIR, UPLOAD_TMP_DIR
+from db.crud import crud_upload_session
+from db.models import UploadSession
+from db.session import get_session
+from schemas.entities import BaseFile, FileCreate
+from schemas.uploads import UploadPart, UploadSessionCreate, UploadSessionGet
+from schemas.users import UserPrincipal
+from utils.auth import get_current_user
+from utils.services import resolve_upload_path, run_in_executor
+from utils.storage import (
+    assemble_upload,
+    hash_file,
+    hash_parts,
+    list_parts,
+    remove_session_parts,
+    upload_location,
+    write_part
+)
+from .files import check_quota, save_file_record
+
+logger = logging.getLogger(__name__)
+
+upload_router = APIRouter(prefix='/files/uploads', tags=['uploads'])
+
+
+async def get_user_upload(
+    db: AsyncSession,
+    current_user: UserPrincipal,
+    sid: UUID
+) -> UploadSession:
+    '''
+    Возвращает загрузку sid, если она принадлежит пользователю.
+
+    Просроченная загрузка, которую еще не удалила периодическая
+    очистка, считается ненайденной.
+    '''
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Войдите в личный кабинет для доступа к сайту.'
+        )
+    upload = await crud_upload_session.get(db=db, sid=sid)
+    if (
+        not upload
+        or upload.user_id != current_user.uid
+        or upload.expires <= datetime.now(timezone.utc)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Загрузка не найдена или уже завершена.'
+        )
+    return upload
+
+
+@upload_router.post(path='', response_model=UploadSessionGet)
+async def create_upload(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    path: str,
+    filename: Optional[str] = None
+) -> UploadSessionGet:
+    '''
+    Начинает загрузку файла по частям.
+
+    Если в path нет имени файла, оно берется из filename.
+    '''
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Войдите в личный кабинет для доступа к сайту.'
+        )
+
+    _, _, filename = resolve_upload_path(
+        path=path,
+        username=current_user.username,
+        default_filename=filename,
+        create_dirs=False
+    )
+    upload = await crud_upload_session.create(
+        db=db,
+        data_in=UploadSessionCreate(
+            path=path,
+            filename=filename,
+            user_id=current_user.uid,
+            expires=datetime.utcnow() + timedelta(
+                hours=app_settings.UPLOAD_SESSION_TTL_HOURS
+            )
+        )
+    )
+    if not upload:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Не удалось начать загрузку. Попробуйте позже.'
+        )
+    return UploadSessionGet.model_validate(upload)
+
+
+@upload_router.put(path='/{sid}/parts/{number}', response_model=UploadPart)
+async def upload_part(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    sid: UUID,
+    number: Annotated[int, Path(ge=1, le=app_settings.UPLOAD_MAX_PARTS)],
+    file: UploadFile
+) -> UploadPart:
+    '''
+    Принимает часть файла с номером number.
+
+    Части можно отправлять параллельно и в любом порядке, повторная
+    отправка части заменяет полученную ранее.
+    '''
+    await get_user_upload(db=db, current_user=current_user, sid=sid)
+    size = await run_in_executor(
+        partial(
+            write_part,
+            sid=sid,
+            number=number,
+            stream=file.file,
+            chunk_size=app_settings.UPLOAD_CHUNK_SIZE
+        )
+    )
+    return UploadPart(number=number, size=size)
+
+
+@upload_router.get(path='/{sid}', response_model=UploadSessionGet)
+async def upload_status(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    sid: UUID
+) -> UploadSessionGet:
+    '''Возвращает загрузку и список уже полученных частей.'''
+    upload = await get_user_upload(db=db, current_user=current_user, sid=sid)
+    parts = await run_in_executor(partial(list_parts, sid=sid))
+    result = UploadSessionGet.model_validate(upload)
+    result.parts = [UploadPart(number=n, size=size) for n, size in parts]
+    return result
+
+
+async def check_parts(
+    sid: UUID,
+    parts: List[Tuple[int, int]],
+    size: Optional[int],
+    sha256: Optional[str]
+) -> None:
+    '''
+    Проверяет, что части 1..N получены и складываются в файл размером
+    size с хэшем sha256, если они указаны.
+    '''
+    numbers = [n for n, _ in parts]
+    missing = sorted(set(range(1, max(numbers, default=0) + 1)) - set(numbers))
+    if not numbers or missing:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Не хватает частей файла: {missing or [1]}.'
+        )
+    if size is not None and size != sum(part for _, part in parts):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Размер полученных частей не совпадает с размером файла.'
+        )
+    if sha256 is None:
+        return
+    digest = await run_in_executor(
+        partial(
+            hash_parts,
+            sid=sid,
+            numbers=numbers,
+            chunk_size=app_settings.UPLOAD_CHUNK_SIZE
+        ),
+        executor='cpu'
+    )
+    if digest != sha256.lower():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='sha256 полученных частей не совпадает с sha256 файла.'
+        )
+
+
+@upload_router.post(path='/{sid}/complete', response_model=BaseFile)
+async def complete_upload(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    sid: UUID,
+    size: Optional[int] = None,
+    sha256: Optional[str] = None
+) -> BaseFile:
+    '''
+    Собирает файл из частей 1..N и сохраняет его как обычную загрузку.
+
+    size и sha256 - ожидаемые размер и хэш файла. Если части с ними
+    не совпадают, файл не собирается, а неверные части можно отправить
+    заново.
+    '''
+    upload = await get_user_upload(db=db, current_user=current_user, sid=sid)
+    parts = await run_in_executor(partial(list_parts, sid=sid))
+    await check_parts(sid=sid, parts=parts, size=size, sha256=sha256)
+    numbers = [n for n, _ in parts]
+    await check_quota(
+        db=db,
+        user=current_user,
+        size=sum(size for _, size in parts)
+    )
+
+    dedup = app_settings.STORAGE_DEDUPLICATION
+    fid = uuid4()
+    location = None if dedup else upload_location(fid)
+    path_for_user, data_path, filename = await run_in_executor(
+        partial(
+            resolve_upload_path,
+            path=upload.path,
+            username=current_user.username,
+            default_filename=upload.filename,
+            create_dirs=not dedup and location is None
+        )
+    )
+    if dedup:
+        target = UPLOAD_TMP_DIR / uuid4().hex
+    else:
+        target = DATA_DIR / location if location else data_path
+    size, blob_id, codec = await run_in_executor(
+        partial(
+            assemble_upload,
+            sid=sid,
+            target=target,
+            numbers=numbers,
+            filename=filename,
+            chunk_size=app_settings.UPLOAD_CHUNK_SIZE
+        )
+    )
+
+    if dedup and blob_id is None and sha256:
+        # Хэш частей уже проверен
+        blob_id = sha256.lower()
+    elif dedup and blob_id is None:
+        # sha256 целого файла не складывается из хэшей частей,
+        # поэтому собранный файл хэшируется отдельно
+        blob_id = await run_in_executor(
+            partial(
+                hash_file,
+                path=target,
+                chunk_size=app_settings.UPLOAD_CHUNK_SIZE
+            ),
+            executor='cpu'
+        )
+
+    new_file = await save_file_record(
+        db=db,
+        file_schema=FileCreate(
+            fid=fid,
+            name=filename,
+            path=path_for_user,
+            size=size,
+            extension=filename.split('.')[-1],
+            user_id=current_user.uid,
+            blob_id=blob_id if dedup else None,
+            codec=codec,
+            location=location
+        ),
+        tmp_path=target if dedup else None
+    )
+    await crud_upload_session.delete(db=db, db_obj=upload)
+    await run_in_executor(partial(remove_session_parts, sid=sid))
+    logger.info('Upload %s completed: %s', sid, path_for_user)
+    return new_file
+
+
+@upload_router.delete(path='/{sid}', status_code=status.HTTP_204_NO_CONTENT)
+async def abort_upload(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    sid: UUID
+) -> None:
+    '''Отменяет загрузку и удаляет полученные части.'''
+    upload = await get_user_upload(db=db, current_user=current_user, sid=sid)
+    await crud_upload_session.delete(db=db, db_obj=upload)
+    await run_in_executor(partial(remove_session_parts, sid=sid))
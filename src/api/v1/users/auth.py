@@ -1,14 +1,17 @@
 import logging
-from typing import Annotated
+from functools import partial
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from api.v1.handlers.files import search_page
 from db.session import get_session
-from db.crud import crud_user
+from db.crud import AlreadyExistsError, crud_usage, crud_user
 from core.settings import ACCESS_TOKEN_EXPIRES
-from schemas.users import BaseUser, UserGet, UserCreate, Token
+from schemas.entities import FileFilter, FileOrdering
+from schemas.users import UserFiles, UserGet, UserCreate, UserPrincipal, Token
 from utils.auth import (
     authenticate_user,
     create_access_token,
@@ -16,6 +19,7 @@ from utils.auth import (
     get_current_user,
     validate_password
 )
+from utils.services import run_in_executor
 
 logger = logging.getLogger(__name__)
 
@@ -46,14 +50,14 @@ async def login(
         data={'sub': user.username},
         expires_delta=ACCESS_TOKEN_EXPIRES
     )
-    logger.info(f'Пользователь {user.username} авторизован.')
+    logger.info('Пользователь %s авторизован.', user.username)
     return Token(access_token=access_token, token_type='Bearer')
 
 
 @auth_router.post('/register', response_model=UserGet)
 async def create_user(
     db: Annotated[AsyncSession, Depends(get_session)],
-    current_user: Annotated[BaseUser, Depends(get_current_user)],
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
     data: UserCreate
 ) -> UserGet:
     '''Создание пользователя.'''
@@ -66,8 +70,17 @@ async def create_user(
             )
         )
 
-    user_in_db = await crud_user.get_by_username(db=db, username=data.username)
-    if user_in_db:
+    logger.info('Creating user %s', data.username)
+    validate_password(data.password)
+    hashed_pwd = await run_in_executor(
+        partial(hash_password, data.password),
+        executor='password'
+    )
+    data.password = hashed_pwd
+    # Занятое имя проверяет уникальный индекс, без отдельного SELECT
+    try:
+        new_user = await crud_user.create(db=db, data_in=data)
+    except AlreadyExistsError:
         logger.error('User exists, cant create.')
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -76,25 +89,55 @@ async def create_user(
                 'другое имя.'
             )
         )
-
-    logger.info(f'Creating user {data.username}')
-    validate_password(data.password)
-    hashed_pwd = hash_password(data.password)
-    data.password = hashed_pwd
-    new_user = await crud_user.create(db=db, data_in=data)
     if not new_user:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail='Не удалось создать пользователя. Попробуйте позже.'
         )
-    logger.info(f'User created {data.username}')
+    logger.info('User created %s', data.username)
     return new_user
 
 
-@auth_router.get(path='/user/files', response_model=UserGet)
+@auth_router.get(path='/user/files', response_model=UserFiles)
 async def user_status(
     db: Annotated[AsyncSession, Depends(get_session)],
-    current_user: Annotated[BaseUser, Depends(get_current_user)]
-) -> UserGet:
-    '''Получить информацию о пользователе.'''
-    return current_user
+    current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+    order_by: Optional[FileOrdering] = None,
+    limit: Annotated[Optional[int], Query(ge=1)] = None,
+    cursor: Optional[str] = None
+) -> UserFiles:
+    '''
+    Получить информацию о пользователе.
+
+    Возвращает число и общий размер файлов, в том числе по расширениям,
+    и страницу списка файлов. Следующая страница запрашивается с cursor
+    из files.next_cursor.
+    '''
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Войдите в личный кабинет для доступа к сайту.'
+        )
+    extensions = await crud_usage.get_extensions(
+        db=db, user_id=current_user.uid
+    )
+    if extensions is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Не удалось получить список файлов. Попробуйте позже.'
+        )
+    # Счетчики появляются с первым загруженным файлом
+    usage = await crud_usage.get(db=db, user_id=current_user.uid)
+    files = await search_page(
+        db=db,
+        options=FileFilter(order_by=order_by, limit=limit, cursor=cursor),
+        user=current_user
+    )
+    return UserFiles(
+        uid=current_user.uid,
+        username=current_user.username,
+        files_count=usage.files_count if usage else 0,
+        files_size=usage.files_size if usage else 0,
+        extensions=extensions,
+        files=files
+    )
@@ -0,0 +1,40 @@
+'''
+Пересчет счетчиков места, занятого пользователями.
+
+Запускается из корня проекта при заполненном .env:
+
+    python src/commands/reconcile_usage.py
+
+Счетчики обновляются вместе с файлами, пересчет нужен только после
+ручных правок таблицы file или при подозрении на расхождение. Таблицы
+usage и usage_extension заполняются заново одним INSERT ... SELECT,
+загрузки на время пересчета ждут его завершения.
+'''
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.logger import setup_logging  # noqa: E402
+from db.crud import crud_usage  # noqa: E402
+from db.session import async_session, engine  # noqa: E402
+
+
+async def main() -> None:
+    argparse.ArgumentParser(description=__doc__).parse_args()
+    setup_logging()
+    start = time.perf_counter()
+    async with async_session() as db:
+        users = await crud_usage.rebuild(db=db)
+    await engine.dispose()
+    if users is None:
+        sys.exit('Не удалось пересчитать счетчики, подробности в логе.')
+    print(f'Пересчитаны счетчики {users} пользователей '
+          f'за {time.perf_counter() - start:.1f} с')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
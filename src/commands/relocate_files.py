@@ -0,0 +1,145 @@
+'''
+Перенос содержимого файлов из путей пользователей в раскладку sharded.
+
+Запускается из корня проекта при заполненном .env с
+APP_STORAGE_LAYOUT=sharded (с этой настройкой уже должен работать
+сервер, чтобы новые загрузки не попадали в старые пути):
+
+    python src/commands/relocate_files.py --batch-size 1000
+
+Перенос идет без остановки сервиса, пачками по batch-size файлов
+по возрастанию fid. Для каждой пачки:
+
+1. содержимое получает жесткую ссылку data/.files/ab/cd/<fid>, старый
+   путь продолжает работать;
+2. места файлов записываются одним UPDATE, записи сбрасываются из кэша;
+3. через grace секунд (за это время завершаются запросы, прочитавшие
+   запись до UPDATE) кэш сбрасывается еще раз, и старые пути, по
+   которым больше не читается ни один файл, удаляются вместе
+   с опустевшими директориями.
+
+Прерванный перенос можно запустить заново: уже перенесенные файлы
+пропускаются, оставшиеся ссылки переиспользуются.
+'''
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.logger import setup_logging  # noqa: E402
+from core.redis import close_redis  # noqa: E402
+from core.settings import app_settings  # noqa: E402
+from db.crud import crud_file  # noqa: E402
+from db.models import File  # noqa: E402
+from db.session import async_session, engine  # noqa: E402
+from utils.cache import file_cache  # noqa: E402
+from utils.storage import (  # noqa: E402
+    link_location,
+    remove_file,
+    remove_user_paths,
+    sharded_relpath
+)
+
+logger = logging.getLogger(__name__)
+
+
+def link_batch(files: List[File]) -> Tuple[Dict[UUID, str], List[str]]:
+    '''
+    Создает ссылки на содержимое файлов пачки в раскладке sharded.
+
+    Возвращает места файлов, которые удалось связать, и пути, по
+    которым содержимого на диске не нашлось.
+    '''
+    locations, missing = {}, []
+    for file in files:
+        location = sharded_relpath(file.fid)
+        if link_location(file.path, location):
+            locations[file.fid] = location
+        else:
+            missing.append(file.path)
+    return locations, missing
+
+
+async def relocate_batch(
+    files: List[File],
+    grace: float
+) -> Optional[Tuple[int, int]]:
+    '''
+    Переносит пачку файлов. Возвращает число перенесенных файлов и
+    файлов без содержимого на диске или None при ошибке базы.
+    '''
+    locations, missing = await asyncio.to_thread(link_batch, files)
+    for path in missing:
+        logger.warning('File content not found: %s', path)
+    if not locations:
+        return 0, len(missing)
+    async with async_session() as db:
+        moved = await crud_file.set_locations(db=db, locations=locations)
+    if moved is None:
+        return None
+    # Ссылки файлов, удаленных во время переноса, не нужны
+    for fid in set(locations) - {file.fid for file in moved}:
+        await asyncio.to_thread(remove_file, locations[fid])
+    await asyncio.sleep(grace)
+    await file_cache.invalidate(moved)
+    async with async_session() as db:
+        kept = await crud_file.get_unplaced_paths(
+            db=db, paths=list({file.path for file in moved})
+        )
+    if kept is None:
+        return None
+    await asyncio.to_thread(
+        remove_user_paths, {file.path for file in moved} - kept
+    )
+    return len(moved), len(missing)
+
+
+async def relocate(args: argparse.Namespace) -> Tuple[int, int]:
+    '''Переносит все файлы пачками, возвращает итоговые счетчики.'''
+    after, moved, missing = None, 0, 0
+    while True:
+        async with async_session() as db:
+            files = await crud_file.get_unplaced(
+                db=db, after=after, limit=args.batch_size
+            )
+        if files is None:
+            sys.exit('Не удалось получить файлы, подробности в логе.')
+        if not files:
+            return moved, missing
+        result = await relocate_batch(files, args.grace)
+        if result is None:
+            sys.exit('Не удалось записать места файлов, подробности в логе.')
+        moved, missing = moved + result[0], missing + result[1]
+        after = files[-1].fid
+        print(f'Перенесено {moved}, без содержимого {missing}')
+        await asyncio.sleep(args.pause)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    # Пауза между пачками, секунды: снижает нагрузку на диск и базу
+    parser.add_argument('--pause', type=float, default=0.0)
+    parser.add_argument('--grace', type=float, default=2.0)
+    args = parser.parse_args()
+    if app_settings.STORAGE_LAYOUT != 'sharded':
+        sys.exit('Перед переносом включите APP_STORAGE_LAYOUT=sharded.')
+    setup_logging()
+    start = time.perf_counter()
+    try:
+        moved, missing = await relocate(args)
+    finally:
+        await close_redis()
+        await engine.dispose()
+    print(f'Перенесено {moved} файлов за {time.perf_counter() - start:.1f} с, '
+          f'без содержимого на диске: {missing}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
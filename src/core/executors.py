@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .settings import app_settings
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorOverloaded(Exception):
+    '''Задача не дождалась места в пуле за отведенное время.'''
+
+
+def _timed_call(func: Callable, submitted: float) -> Tuple[float, Any]:
+    '''Выполняет func в процессе пула и возвращает время ожидания.'''
+    return time.time() - submitted, func()
+
+
+class InstrumentedExecutor:
+    '''
+    Долгоживущий пул потоков или процессов с ограниченным числом воркеров.
+
+    Считает глубину очереди, число активных задач и время, которое
+    задача провела в очереди до начала выполнения. Если задан
+    max_concurrency, в пул одновременно попадает не больше задач,
+    остальные ждут в цикле событий не дольше queue_timeout секунд,
+    после чего получают ExecutorOverloaded.
+    В пул процессов передаются только функции, которые можно
+    сериализовать pickle.
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        processes: bool = False,
+        max_concurrency: Optional[int] = None,
+        queue_timeout: Optional[float] = None
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.processes = processes
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._pool is not None
+
+    def start(self) -> None:
+        '''
+        Создает пул, если он еще не создан.
+
+        Вызывается в цикле событий: семафор max_concurrency создается
+        здесь, а не при импорте, потому что на python 3.9
+        asyncio.Semaphore привязывается к циклу, текущему при создании.
+        '''
+        with self._lock:
+            if self._pool is None and self.max_concurrency:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            if self._pool is None and self.processes:
+                # spawn, а не fork: к этому моменту в процессе уже
+                # работают потоки пулов и открыты соединения
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            elif self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f'{self.name}-executor'
+                )
+                logger.info(
+                    'Executor %s started, max_workers=%s',
+                    self.name,
+                    self.max_workers
+                )
+
+    def shutdown(self, wait: bool = True) -> None:
+        '''Останавливает пул, дожидаясь выполнения начатых задач.'''
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=not wait)
+            logger.info('Executor %s stopped: %s', self.name, self.stats())
+
+    def _instrument(self, func: Callable, submitted: float) -> Callable:
+        def runner() -> Any:
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+            try:
+                return func()
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+        return runner
+
+    def _on_done(self, future: Future) -> None:
+        # Задача отменена, пока стояла в очереди, и так и не началась
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def _on_process_done(self, future: Future) -> None:
+        # Начало задачи в другом процессе не видно, поэтому счетчики
+        # обновляются по факту завершения
+        waited = None
+        if not future.cancelled() and future.exception() is None:
+            waited = future.result()[0]
+        with self._lock:
+            self.queued -= 1
+            if waited is not None:
+                self.completed += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+    async def _submit(self, func: Callable) -> Any:
+        if self._pool is None:
+            self.start()
+        with self._lock:
+            self.queued += 1
+        if self.processes:
+            future = self._pool.submit(partial(_timed_call, func, time.time()))
+            future.add_done_callback(self._on_process_done)
+            return (await asyncio.wrap_future(future))[1]
+        future = self._pool.submit(
+            self._instrument(func, time.perf_counter())
+        )
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    async def run(self, func: Callable) -> Any:
+        '''Выполняет блокирующую функцию в пуле и возвращает результат.'''
+        if self._pool is None:
+            self.start()
+        semaphore = self._semaphore
+        if semaphore is None:
+            return await self._submit(func)
+        try:
+            await asyncio.wait_for(
+                semaphore.acquire(), timeout=self.queue_timeout
+            )
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorOverloaded(
+                f'Executor {self.name} is overloaded'
+            ) from None
+        try:
+            return await self._submit(func)
+        finally:
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        '''Возвращает текущие метрики пула.'''
+        with self._lock:
+            started = self.completed + self.active
+            return {
+                'max_workers': self.max_workers,
+                'queued': self.queued,
+                'active': self.active,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'wait_time_avg': (
+                    self.wait_time_total / started if started else 0.0
+                ),
+                'wait_time_max': self.wait_time_max,
+            }
+
+
+# Дисковые операции: запись и чтение файлов, создание директорий
+io_executor = InstrumentedExecutor(
+    name='io',
+    max_workers=app_settings.IO_EXECUTOR_WORKERS
+)
+# Операции, нагружающие процессор: хэширование данных
+cpu_executor = InstrumentedExecutor(
+    name='cpu',
+    max_workers=app_settings.CPU_EXECUTOR_WORKERS
+)
+# bcrypt: в отдельных процессах всплеск входов не отнимает процессор
+# и GIL у цикла событий
+password_executor = InstrumentedExecutor(
+    name='password',
+    max_workers=app_settings.PASSWORD_HASH_WORKERS,
+    processes=True,
+    max_concurrency=app_settings.PASSWORD_HASH_CONCURRENCY,
+    queue_timeout=app_settings.PASSWORD_HASH_QUEUE_TIMEOUT
+)
+
+executors: Dict[str, InstrumentedExecutor] = {
+    io_executor.name: io_executor,
+    cpu_executor.name: cpu_executor,
+    password_executor.name: password_executor,
+}
+
+
+def start_executors() -> None:
+    '''Запускает все пулы приложения.'''
+    for executor in executors.values():
+        executor.start()
+
+
+async def shutdown_executors() -> None:
+    '''Останавливает все пулы, не блокируя цикл событий.'''
+    for executor in executors.values():
+        await asyncio.to_thread(executor.shutdown)
@@ -1,37 +1,188 @@
+import copy
+import logging
+import random
+from datetime import datetime, timezone
+from logging import config
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Dict, Optional
+
+import orjson
+
+from .settings import app_settings
+
 LOG_HANDLER = ['console',]
 LOG_FORMAT_VERBOSE = (
     '%(asctime)s - %(name)s - %(levelname)s: '
     '%(funcName)s - %(lineno)d - %(message)s'
 )
 
-LOGGING_CONFIG = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': LOG_FORMAT_VERBOSE,
-        },
-    },
-    'handlers': {
+
+class JsonFormatter(logging.Formatter):
+    '''Форматирует запись одним JSON-объектом в строку.'''
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'func': record.funcName,
+            'line': record.lineno,
+            'process': record.process,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Пропускает долю записей ниже WARNING от логеров из rates.
+
+    rates - доли по именам логеров, действуют и на дочерние логеры.
+    Предупреждения и ошибки проходят всегда.
+    '''
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, Optional[float]] = {}
+
+    def rate(self, name: str) -> Optional[float]:
+        if name not in self._cache:
+            prefix = name
+            while prefix and prefix not in self.rates:
+                prefix = prefix.rpartition('.')[0]
+            self._cache[name] = self.rates.get(prefix)
+        return self._cache[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate is None or random.random() < rate
+
+
+class LogQueueHandler(QueueHandler):
+    '''
+    QueueHandler, который оставляет форматирование потоку записи.
+
+    В очередь кладется копия записи с готовым текстом сообщения
+    (аргументы могут измениться после вызова логера) и текстом
+    исключения. Время, уровень и остальные поля форматирует обработчик
+    в потоке QueueListener.
+    '''
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+
+def logging_config() -> Dict[str, Any]:
+    '''Конфиг логов для dictConfig из настроек APP_LOG_*.'''
+    handlers = {
         'console': {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'formatter': app_settings.LOG_FORMAT,
         },
         'filehandler': {
             'level': 'INFO',
             'class': 'logging.handlers.RotatingFileHandler',
-            'formatter': 'verbose',
+            'formatter': app_settings.LOG_FORMAT,
             'filename': 'logs/storage_log.log',
             'mode': 'a',
             'backupCount': 3,
             'maxBytes': 10000,
             'encoding': 'utf-8',
         },
-    },
-    'root': {
-        'level': 'DEBUG',
-        'formatter': LOG_FORMAT_VERBOSE,
-        'handlers': LOG_HANDLER,
-    },
-}
+    }
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'text': {
+                'format': LOG_FORMAT_VERBOSE,
+            },
+            'json': {
+                '()': JsonFormatter,
+            },
+        },
+        # Незадействованные обработчики не создаются: файловому
+        # нужна существующая директория logs
+        'handlers': {name: handlers[name] for name in LOG_HANDLER},
+        'root': {
+            'level': app_settings.LOG_LEVEL,
+            'handlers': LOG_HANDLER,
+        },
+        'loggers': {
+            name: {'level': level}
+            for name, level in app_settings.LOG_LEVELS.items()
+        },
+    }
+
+
+def setup_logging() -> None:
+    '''
+    Применяет logging_config().
+
+    Сервер настраивает логи сам (log_config в uvicorn.run), функция
+    нужна отдельным скриптам и командам.
+    '''
+    config.dictConfig(logging_config())
+
+
+_listener: Optional[QueueListener] = None
+
+
+def start_log_queue() -> None:
+    '''
+    Переносит обработчики корневого логера в отдельный поток.
+
+    Вместо них к логеру подключается LogQueueHandler: в цикле событий
+    запись только формирует сообщение и кладется в очередь, форматирует
+    и пишет ее поток QueueListener. Записи, отброшенные LOG_SAMPLING,
+    не формируются вовсе.
+    '''
+    global _listener
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    queue_handler = LogQueueHandler(SimpleQueue())
+    if app_settings.LOG_SAMPLING:
+        queue_handler.addFilter(SamplingFilter(app_settings.LOG_SAMPLING))
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    _listener = QueueListener(
+        queue_handler.queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def stop_log_queue() -> None:
+    '''Дописывает записи из очереди и возвращает обработчики логеру.'''
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
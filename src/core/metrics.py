@@ -0,0 +1,234 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Union
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.multiprocess import (
+    MultiProcessCollector,
+    mark_process_dead
+)
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Границы корзин для времени ответа и запросов к базе и Redis, секунды
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    5.0, 10.0, 30.0
+)
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'Время обработки запроса до отправки всего ответа',
+    ['method', 'route', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress',
+    'Запросы, которые обрабатываются сейчас',
+    ['method', 'route'],
+    multiprocess_mode='livesum'
+)
+UPLOAD_BYTES = Counter(
+    'storage_upload_bytes',
+    'Байт загруженных файлов, до сжатия'
+)
+DOWNLOAD_BYTES = Counter(
+    'storage_download_bytes',
+    'Байт отправленных клиентам файлов и архивов',
+    ['response']
+)
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds',
+    'Время выполнения SQL-запроса',
+    ['operation'],
+    buckets=LATENCY_BUCKETS
+)
+REDIS_COMMAND_DURATION = Histogram(
+    'redis_command_duration_seconds',
+    'Время выполнения команды Redis',
+    ['command'],
+    buckets=LATENCY_BUCKETS
+)
+
+# Запросы, не подошедшие ни к одному маршруту, собираются под одной
+# меткой: иначе произвольные пути раздували бы число рядов
+UNMATCHED_ROUTE = 'unmatched'
+
+
+class StatsCollector:
+    '''
+    Отдает в Prometheus метрики из методов stats() ресурсов процесса.
+
+    sources возвращает словари stats() по значению метки label. Поля
+    из counters отдаются как счетчики, остальные числовые - как gauge.
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        label: str,
+        sources: Callable[[], Dict[str, Dict[str, Any]]],
+        counters: Iterable[str] = ()
+    ):
+        self.name = name
+        self.label = label
+        self.sources = sources
+        self.counters = set(counters)
+
+    def collect(
+        self
+    ) -> Iterator[Union[GaugeMetricFamily, CounterMetricFamily]]:
+        # С несколькими воркерами значения одного процесса помечаются
+        # его pid: счетчики разных воркеров не должны смешиваться
+        labels, extra = [self.label], []
+        if multiprocess_mode():
+            labels, extra = labels + ['pid'], [str(os.getpid())]
+        families = {}
+        for value, stats in self.sources().items():
+            for key, number in stats.items():
+                if not isinstance(number, (int, float)):
+                    continue
+                if key not in families:
+                    metric_class = (
+                        CounterMetricFamily if key in self.counters
+                        else GaugeMetricFamily
+                    )
+                    families[key] = metric_class(
+                        f'{self.name}_{key}', '', labels=labels
+                    )
+                families[key].add_metric([value] + extra, number)
+        yield from families.values()
+
+
+_collectors: Dict[str, StatsCollector] = {}
+
+
+def register_collector(collector: StatsCollector) -> None:
+    '''
+    Регистрирует сборщик метрик процесса в общем реестре.
+
+    Повторная регистрация с тем же именем пропускается: в процессе
+    воркера uvicorn модуль main импортируется дважды (как __mp_main__
+    и по строке 'main:app').
+    '''
+    if collector.name in _collectors:
+        return
+    REGISTRY.register(collector)
+    _collectors[collector.name] = collector
+
+
+def multiprocess_mode() -> bool:
+    return 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+
+@contextmanager
+def multiprocess_metrics() -> Iterator[None]:
+    '''
+    Общая директория метрик на время работы нескольких воркеров.
+
+    Входить нужно в родительском процессе до их запуска: воркеры
+    наследуют PROMETHEUS_MULTIPROC_DIR и пишут метрики в файлы в ней.
+    Файлы прошлого запуска удаляются, иначе счетчики продолжились бы
+    с прежних значений. Если переменная не задана, создается временная
+    директория, она удаляется при выходе.
+    '''
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory is not None:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        for path in Path(directory).glob('*.db'):
+            path.unlink()
+        yield
+        return
+    with tempfile.TemporaryDirectory(prefix='prometheus-') as directory:
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = directory
+        try:
+            yield
+        finally:
+            del os.environ['PROMETHEUS_MULTIPROC_DIR']
+
+
+def mark_worker_stopped() -> None:
+    '''Убирает gauge остановленного воркера из общих метрик.'''
+    if multiprocess_mode():
+        mark_process_dead(os.getpid())
+
+
+def metrics_payload() -> bytes:
+    '''
+    Метрики в текстовом формате Prometheus.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR (несколько воркеров),
+    гистограммы и счетчики собираются со всех воркеров, а метрики
+    StatsCollector - только того воркера, который отвечает, с меткой
+    pid.
+    '''
+    if not multiprocess_mode():
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    for collector in _collectors.values():
+        registry.register(collector)
+    return generate_latest(registry)
+
+
+def route_name(app: ASGIApp, scope: Scope) -> str:
+    '''Шаблон пути маршрута, к которому относится запрос.'''
+    for route in getattr(app, 'routes', ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    '''
+    ASGI-middleware: время ответа и число запросов в обработке по
+    маршрутам.
+
+    Время считается до отправки последнего байта тела, поэтому
+    потоковые ответы учитываются целиком.
+    '''
+
+    def __init__(self, app: ASGIApp, router: ASGIApp):
+        self.app = app
+        self.router = router
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        method = scope['method']
+        route = route_name(self.router, scope)
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            HTTP_REQUEST_DURATION.labels(
+                method, route, str(status_code)
+            ).observe(time.perf_counter() - start)
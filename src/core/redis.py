@@ -1,5 +1,8 @@
-from redis.asyncio import Redis
+from typing import Any, Optional
 
+from redis.asyncio import BlockingConnectionPool, Redis
+
+from .metrics import REDIS_COMMAND_DURATION
 from .settings import app_settings
 
 HOST = (
@@ -8,9 +11,47 @@ HOST = (
     else app_settings.REDIS_HOST
 )
 
-redis_client = Redis(
-    host=HOST,
-    port=app_settings.REDIS_PORT,
-    decode_responses=True,
-    protocol=3
-)
+
+class InstrumentedRedis(Redis):
+    '''Клиент Redis, который записывает время выполнения команд.'''
+
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        command = str(args[0]).lower()
+        with REDIS_COMMAND_DURATION.labels(command).time():
+            return await super().execute_command(*args, **options)
+
+
+redis_client: Optional[Redis] = None
+
+
+def init_redis() -> Redis:
+    '''Создает клиент Redis с общим пулом соединений.'''
+    global redis_client
+    if redis_client is None:
+        pool = BlockingConnectionPool(
+            host=HOST,
+            port=app_settings.REDIS_PORT,
+            protocol=3,
+            max_connections=app_settings.REDIS_MAX_CONNECTIONS,
+            timeout=app_settings.REDIS_POOL_TIMEOUT
+        )
+        redis_client = InstrumentedRedis(connection_pool=pool)
+    return redis_client
+
+
+def get_redis() -> Redis:
+    '''
+    Возвращает общий клиент Redis.
+
+    Обычно клиент создается при старте приложения, но если lifespan не
+    запускался (например, в тестах), он будет создан при первом вызове.
+    '''
+    return redis_client or init_redis()
+
+
+async def close_redis() -> None:
+    '''Закрывает все соединения пула.'''
+    global redis_client
+    if redis_client is not None:
+        client, redis_client = redis_client, None
+        await client.connection_pool.aclose()
@@ -1,13 +1,11 @@
+import os
 from pathlib import Path
 from datetime import timedelta
-from logging import config
+from typing import Dict, List, Literal, Optional
 
 from fastapi.security.oauth2 import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-from .logger import LOGGING_CONFIG
-
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
@@ -21,6 +19,26 @@ class Settings(BaseSettings):
     HOST: str
     HOST_TEST: str
     PORT: int
+    # Число процессов uvicorn, 0 - по числу ядер
+    SERVER_WORKERS: int = 0
+    # Перезапуск при изменении кода, только для разработки: с ним
+    # работает один процесс
+    SERVER_RELOAD: bool = False
+    # Цикл событий и парсер HTTP: auto выбирает uvloop и httptools,
+    # если они установлены
+    SERVER_LOOP: Literal['auto', 'asyncio', 'uvloop'] = 'auto'
+    SERVER_HTTP: Literal['auto', 'h11', 'httptools'] = 'auto'
+    # Очередь еще не принятых соединений
+    SERVER_BACKLOG: int = 2048
+    # Сколько держать открытым keep-alive соединение без запросов,
+    # секунды. Должно быть больше keepalive_timeout upstream в nginx
+    SERVER_KEEPALIVE_TIMEOUT: int = 75
+    # Сколько после SIGTERM ждать завершения начатых запросов (например,
+    # загрузок) до принудительной остановки, секунды
+    SERVER_GRACEFUL_TIMEOUT: int = 60
+    # Максимум одновременных соединений на процесс, сверх - ответ 503,
+    # None - без ограничения
+    SERVER_LIMIT_CONCURRENCY: Optional[int] = None
     ACCESS_TOKEN_EXPIRE_DAYS: int
     # для получения секретного ключа в командной строке зпустите команду:
     # openssl rand -hex 32
@@ -28,24 +46,141 @@ class Settings(BaseSettings):
     CRYPTO_ALGORITHM: str
     POSTGRES_DSN: str
     POSTGRES_DSN_TEST: str
+    # Пул соединений с базой на процесс (воркер): постоянные соединения
+    # и сколько можно открыть сверх них при всплеске
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    # Сколько ждать свободного соединения из пула до ошибки (503), секунды
+    DB_POOL_TIMEOUT: float = 5.0
+    # Через сколько секунд переоткрывать соединение, -1 - не переоткрывать
+    DB_POOL_RECYCLE: int = 1800
+    # Проверять соединение перед выдачей из пула
+    DB_POOL_PRE_PING: bool = True
+    # Таймаут подключения к базе и выполнения запроса, секунды
+    DB_CONNECT_TIMEOUT: float = 5.0
+    DB_COMMAND_TIMEOUT: Optional[float] = 60.0
+    # Кэш подготовленных запросов на соединение, 0 - выключен
+    # (нужно за pgbouncer в режиме transaction)
+    DB_STATEMENT_CACHE_SIZE: int = 100
     ALLOWED_ORIGINS: str
     REDIS_HOST: str
     REDIS_PORT: int
     REDIS_HOST_TEST: str
+    # Максимум соединений с Redis на процесс
+    REDIS_MAX_CONNECTIONS: int = 50
+    # Сколько ждать свободного соединения из пула, секунды
+    REDIS_POOL_TIMEOUT: int = 5
+    # Кэш авторизованных пользователей: время жизни записи, секунды
+    PRINCIPAL_CACHE_TTL: int = 60
+    # Максимум пользователей в кэше процесса
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    # Дополнительно хранить пользователей в Redis, общем для всех воркеров
+    PRINCIPAL_CACHE_REDIS: bool = False
+    # Размер страницы поиска файлов по умолчанию и максимальный
+    SEARCH_PAGE_SIZE: int = 100
+    SEARCH_MAX_PAGE_SIZE: int = 1000
+    # Сколько строк читать из базы за раз при потоковой выдаче поиска
+    SEARCH_STREAM_BATCH_SIZE: int = 1000
+    # Квоты на пользователя: число файлов и общий размер в байтах,
+    # None - без ограничения
+    QUOTA_MAX_FILES: Optional[int] = None
+    QUOTA_MAX_BYTES: Optional[int] = None
     TESTING: bool
+    # Размер части файла при потоковой записи на диск, байт
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    # Максимум файлов в одной пакетной загрузке, не больше лимита
+    # multipart-парсера starlette (1000)
+    UPLOAD_BATCH_MAX_FILES: int = 1000
+    # Сколько байт загружаемого файла держится в памяти до сброса во
+    # временный файл на диске
+    UPLOAD_SPOOL_MAX_SIZE: int = 1024 * 1024
+    # Число потоков для дисковых операций
+    IO_EXECUTOR_WORKERS: int = 32
+    # Число потоков для операций, нагружающих процессор
+    CPU_EXECUTOR_WORKERS: int = os.cpu_count() or 1
+    # Число процессов для bcrypt при входе и регистрации
+    PASSWORD_HASH_WORKERS: int = os.cpu_count() or 1
+    # Сколько паролей может проверяться одновременно, остальные ждут
+    PASSWORD_HASH_CONCURRENCY: int = os.cpu_count() or 1
+    # Сколько секунд ждать очереди на проверку пароля до ответа 503
+    PASSWORD_HASH_QUEUE_TIMEOUT: float = 3.0
+    # Отдавать файлы через nginx (X-Accel-Redirect) вместо python-воркера
+    DOWNLOAD_ACCEL_REDIRECT: bool = False
+    # internal location nginx, из которого отдаются файлы DATA_DIR
+    ACCEL_REDIRECT_LOCATION: str = '/protected/'
+    # Cache-Control при скачивании: шаблоны fnmatch пути файла без имени
+    # пользователя и значения, подходит первый. Например,
+    # {"photos/*": "private, max-age=86400"}
+    DOWNLOAD_CACHE_CONTROL: Dict[str, str] = {}
+    # Cache-Control остальных файлов: кэшировать можно, но перед
+    # использованием проверять по ETag
+    DOWNLOAD_CACHE_CONTROL_DEFAULT: str = 'private, no-cache'
+    # Хранить одинаковое содержимое файлов один раз (по sha256)
+    STORAGE_DEDUPLICATION: bool = True
+    # Где хранить содержимое файлов без дедупликации: user - по путям
+    # пользователей (data/<username>/<путь>), sharded - по fid
+    # в data/.files/ab/cd/<fid>. Уже загруженные файлы переносит
+    # src/commands/relocate_files.py
+    STORAGE_LAYOUT: Literal['user', 'sharded'] = 'user'
+    # Сколько байт архива директории собирать перед отправкой клиенту
+    ARCHIVE_CHUNK_SIZE: int = 1024 * 1024
+    # Расширения уже сжатых форматов: в ZIP они кладутся без сжатия,
+    # на диске не сжимаются
+    COMPRESSED_EXTENSIONS: List[str] = [
+        '7z', 'avi', 'bz2', 'docx', 'gif', 'gz', 'jpeg', 'jpg', 'mkv',
+        'mov', 'mp3', 'mp4', 'pdf', 'png', 'pptx', 'rar', 'webp', 'xlsx',
+        'xz', 'zip', 'zst',
+    ]
+    # Сжатие содержимого файлов на диске: 'gzip', 'zstd' (нужен пакет
+    # zstandard) или None - хранить как загружено
+    STORAGE_CODEC: Optional[Literal['gzip', 'zstd']] = None
+    # Уровень сжатия, None - по умолчанию для кодека
+    STORAGE_CODEC_LEVEL: Optional[int] = None
+    # Текстовые форматы, которые сжимаются без пробы
+    STORAGE_CODEC_EXTENSIONS: List[str] = [
+        'css', 'csv', 'htm', 'html', 'js', 'json', 'log', 'md', 'ndjson',
+        'sql', 'svg', 'tsv', 'txt', 'xml', 'yaml', 'yml',
+    ]
+    # Остальные файлы сжимаются, если начало файла (STORAGE_CODEC_SAMPLE
+    # байт) сжимается хотя бы до этой доли исходного размера
+    STORAGE_CODEC_MAX_RATIO: float = 0.9
+    STORAGE_CODEC_SAMPLE: int = 64 * 1024
+    # Время жизни незавершенной загрузки по частям, часы
+    UPLOAD_SESSION_TTL_HOURS: int = 24
+    # Максимальное число частей в одной загрузке
+    UPLOAD_MAX_PARTS: int = 10000
+    # Как часто удалять просроченные загрузки, секунды
+    UPLOAD_SESSION_GC_INTERVAL: int = 600
+    # Уровень логов: общий и для отдельных логеров (с дочерними),
+    # например {"db.crud": "WARNING", "uvicorn.access": "INFO"}
+    LOG_LEVEL: str = 'INFO'
+    LOG_LEVELS: Dict[str, str] = {
+        'sqlalchemy': 'WARNING',
+        'db.pool': 'WARNING',
+    }
+    # Формат логов: text - строки для чтения, json - JSON-объект
+    # на строку
+    LOG_FORMAT: Literal['text', 'json'] = 'text'
+    # Какая доля записей ниже WARNING от логера попадает в лог, например
+    # {"db.crud": 0.01, "uvicorn.access": 0.1}. Предупреждения и ошибки
+    # пишутся всегда
+    LOG_SAMPLING: Dict[str, float] = {}
+    # Прогрев при старте процесса: сколько соединений с базой (не больше
+    # DB_POOL_SIZE) и с Redis открыть заранее
+    WARMUP_DB_CONNECTIONS: int = 2
+    WARMUP_REDIS_CONNECTIONS: int = 2
+    # Сколько последних загруженных файлов положить в кэш метаданных,
+    # 0 - не загружать
+    WARMUP_CACHE_FILES: int = 0
+    # Максимальное время одного шага прогрева, секунды
+    WARMUP_TIMEOUT: float = 30.0
 
 
 app_settings = Settings()
 
-# Конфиг логера
-config.dictConfig(LOGGING_CONFIG)
-
 # Схема авторизации пользователей
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/api/auth/token', auto_error=False)
 
-# Схема шифрования пароля пользователя
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
-
 # Время действия токена авторизации
 ACCESS_TOKEN_EXPIRES = timedelta(
     days=app_settings.ACCESS_TOKEN_EXPIRE_DAYS
@@ -65,11 +200,21 @@ APP_HOST = (
 )
 
 
-# Корневая директория
+# Корневая директория. Директории данных создает init_storage
+# при старте приложения
 BASE_DIR = Path().resolve()
 DATA_DIR = BASE_DIR / 'data'
-DATA_DIR.mkdir(exist_ok=True)
+# Содержимое файлов, разложенное по sha256: .blobs/ab/cd/<sha256>
+BLOB_DIR = DATA_DIR / '.blobs'
+# Содержимое файлов без дедупликации в раскладке sharded:
+# .files/ab/cd/<fid>
+FILES_DIR = DATA_DIR / '.files'
+# Временные файлы загрузок, должны лежать на одной ФС с BLOB_DIR
+UPLOAD_TMP_DIR = DATA_DIR / '.tmp'
+# Части файлов из незавершенных загрузок: .tmp/sessions/<sid>/<номер части>
+UPLOAD_SESSIONS_DIR = UPLOAD_TMP_DIR / 'sessions'
 BASE_URL = f'http://{APP_HOST}:{app_settings.PORT}'
 
 # Redis settings
 REDIS_TTL = 1  # TTL в днях
+REDIS_NEGATIVE_TTL = 30  # TTL отметки об отсутствии файла, в секундах
@@ -1,6 +1,17 @@
-from .entities import crud_file, crud_user
+from .base import AlreadyExistsError
+from .entities import (
+    crud_blob,
+    crud_file,
+    crud_upload_session,
+    crud_usage,
+    crud_user
+)
 
 __all__ = [
+    AlreadyExistsError,
+    crud_blob,
     crud_file,
+    crud_upload_session,
+    crud_usage,
     crud_user
 ]
@@ -1,8 +1,9 @@
 import logging
-from typing import Generic, List, Optional, TypeVar
+from typing import Any, Generic, List, Optional, TypeVar
 
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import inspect, select
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import Base
@@ -14,6 +15,10 @@ CreateType = TypeVar('CreateType', bound=BaseModel)
 UpdateType = TypeVar('UpdateType', bound=BaseModel)
 
 
+class AlreadyExistsError(Exception):
+    '''Объект нарушает ограничение уникальности.'''
+
+
 class BaseManager(Generic[ModelType, CreateType, UpdateType]):
     '''Базовая реализация менеджера.'''
 
@@ -28,16 +33,31 @@ class BaseManager(Generic[ModelType, CreateType, UpdateType]):
         self,
         db: AsyncSession,
         limit: Optional[int] = 10,
-        offset: Optional[int] = 0
+        offset: Optional[int] = 0,
+        after: Optional[Any] = None
     ) -> List[ModelType]:
-        '''Возвращает список всех объектов с заданными параметрами.'''
+        '''
+        Возвращает список всех объектов с заданными параметрами.
+
+        Объекты упорядочены по первичному ключу. after - ключ последнего
+        объекта предыдущей страницы: следующая страница читается по
+        индексу ключа сразу после него, без OFFSET, за одно и то же время
+        на любой глубине. offset оставлен для совместимости.
+        '''
         try:
-            stmt = select(self._model).offset(offset).limit(limit)
+            primary_key = inspect(self._model).primary_key[0]
+            stmt = select(self._model).order_by(primary_key).limit(limit)
+            if after is not None:
+                stmt = stmt.where(primary_key > after)
+            elif offset:
+                stmt = stmt.offset(offset)
             result = await db.execute(stmt)
-            logger.info(f'Выполнен запрос объектов {self.__class__.__name__}')
+            logger.info('Выполнен запрос объектов %s', self.__class__.__name__)
             return result.scalars().all()
+        except PoolTimeoutError:
+            raise
         except Exception as err:
-            logger.error(f'Error getting multi objs {err}', exc_info=True)
+            logger.error('Error getting multi objs %s', err, exc_info=True)
 
     async def create(
         self,
@@ -51,11 +71,11 @@ class BaseManager(Generic[ModelType, CreateType, UpdateType]):
             obj = self._model(**data)
             db.add(obj)
             await db.commit()
-            logger.info(f'Создан объект {self.__class__.__name__}')
+            logger.info('Создан объект %s', self.__class__.__name__)
             await db.refresh(obj)
             return obj
         except Exception as err:
-            logger.error(f'Error creating obj {err}', exc_info=True)
+            logger.error('Error creating obj %s', err, exc_info=True)
 
     async def update(
         self,
@@ -71,7 +91,7 @@ class BaseManager(Generic[ModelType, CreateType, UpdateType]):
         try:
             await db.delete(db_obj)
             await db.commit()
-            logger.info(f'Объект {self.__class__.__name__} удален из бд.')
+            logger.info('Объект %s удален из бд.', self.__class__.__name__)
             return True
         except Exception as err:
-            logger.error(f'Error deleting obj {err}', exc_info=True)
+            logger.error('Error deleting obj %s', err, exc_info=True)
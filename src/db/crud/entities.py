@@ -1,37 +1,187 @@
 import logging
-from typing import Dict, List
+from collections import Counter, defaultdict
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+from uuid import UUID
 
-from sqlalchemy import select, update
+from sqlalchemy import (
+    BigInteger,
+    Select,
+    String,
+    Uuid,
+    column,
+    delete,
+    func,
+    select,
+    text,
+    tuple_,
+    update,
+    values
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import User, File
-from schemas.entities import FileCreate, FileUpdate
-from schemas.users import UserCreate, UserUpdate
-from .base import BaseManager
+from core.executors import io_executor
+from db.models import (
+    Blob,
+    File,
+    UploadSession,
+    Usage,
+    UsageExtension,
+    User
+)
+from db.session import async_session
+from schemas.entities import BlobCreate, FileCreate, FileUpdate, UsageCreate
+from schemas.uploads import UploadSessionCreate
+from schemas.users import UserCreate, UserPrincipal, UserUpdate
+from utils.cache import file_cache, principal_cache
+from utils.storage import remove_blob, remove_file, store_blobs
+from .base import AlreadyExistsError, BaseManager
 
 logger = logging.getLogger(__name__)
 
 
+def usage_delta(file: File, sign: int) -> UsageCreate:
+    '''Изменение счетчиков при добавлении (sign=1) или удалении файла.'''
+    return UsageCreate(
+        user_id=file.user_id,
+        extension=file.extension or '',
+        files_count=sign,
+        files_size=sign * int(file.size or 0)
+    )
+
+
+async def place_blobs(
+    data_in: List[FileCreate],
+    tmp_paths: List[Optional[Path]],
+    codecs: Dict[str, Optional[str]]
+) -> None:
+    '''
+    Переносит временные файлы с содержимым файлов data_in в хранилище.
+
+    codecs - кодеки из записей blob: содержимое, уже сохраненное другим
+    кодеком, не переносится, и его временный файл удаляется.
+    '''
+    stored, dropped = [], []
+    for item, tmp_path in zip(data_in, tmp_paths):
+        if tmp_path is None:
+            continue
+        blob = (tmp_path, item.blob_id, item.codec)
+        if codecs[item.blob_id] == item.codec:
+            stored.append(blob)
+        else:
+            dropped.append(blob)
+    for blobs, keep in ((stored, True), (dropped, False)):
+        if blobs:
+            await io_executor.run(partial(store_blobs, blobs=blobs, keep=keep))
+
+
+async def discard_blobs(tmp_paths: List[Optional[Path]]) -> None:
+    '''Удаляет временные файлы содержимого, которое не сохранено.'''
+    blobs = [(path, '', None) for path in tmp_paths if path is not None]
+    if not blobs:
+        return
+    try:
+        await io_executor.run(partial(store_blobs, blobs=blobs, keep=False))
+    except Exception as err:
+        logger.error('Error removing temporary files %s', err, exc_info=True)
+
+
+def like_escape(value: str) -> str:
+    '''Экранирует в value спецсимволы LIKE % и _.'''
+    # Экранирование через '/', как в autoescape у sqlalchemy: обратная
+    # косая черта в литерале ESCAPE зависит от standard_conforming_strings
+    return value.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+
+def like_pattern(value: str) -> str:
+    '''Шаблон LIKE для поиска подстроки value без спецсимволов % и _.'''
+    return f'%{like_escape(value)}%'
+
+
+def like_prefix(value: str) -> str:
+    '''Шаблон LIKE для строк, начинающихся с value.'''
+    return f'{like_escape(value)}%'
+
+
 class UserManager(BaseManager[User, UserCreate, UserUpdate]):
     async def get(self, db: AsyncSession, uid: str) -> User:
         '''Ищет объект в базе по uid и возвращает его.'''
         try:
             stmt = select(self._model).where(self._model.uid == uid)
             obj = await db.execute(stmt)
-            logger.info(f'Запрошен объект User {uid}')
+            logger.info('Запрошен объект User %s', uid)
             return obj.scalar_one_or_none()
+        except PoolTimeoutError:
+            raise
         except Exception as err:
-            logger.error(f'Error getting by uid {err}', exc_info=True)
+            logger.error('Error getting by uid %s', err, exc_info=True)
 
     async def get_by_username(self, db: AsyncSession, username: str) -> User:
         '''Ищет объект в базе по username и возвращает его.'''
         try:
             stmt = select(self._model).where(self._model.username == username)
             obj = await db.execute(stmt)
-            logger.info(f'Запрошен объект User {username}')
+            logger.info('Запрошен объект User %s', username)
             return obj.scalar_one_or_none()
+        except PoolTimeoutError:
+            raise
         except Exception as err:
-            logger.error(f'Error getting by username {err}', exc_info=True)
+            logger.error('Error getting by username %s', err, exc_info=True)
+
+    async def get_principal(
+        self,
+        db: AsyncSession,
+        username: str
+    ) -> UserPrincipal:
+        '''Возвращает uid и username пользователя без загрузки его файлов.'''
+        try:
+            stmt = (
+                select(self._model.uid, self._model.username).
+                where(self._model.username == username)
+            )
+            row = (await db.execute(stmt)).one_or_none()
+            logger.info('Запрошен пользователь %s', username)
+            return UserPrincipal.model_validate(row) if row else None
+        except PoolTimeoutError:
+            # Исчерпанный пул - не отсутствие пользователя: вместо 401
+            # запрос получит 503 из обработчика в main
+            raise
+        except Exception as err:
+            logger.error('Error getting principal %s', err, exc_info=True)
+
+    async def create(
+        self,
+        db: AsyncSession,
+        data_in: UserCreate,
+        **kwargs
+    ) -> User:
+        '''
+        Создает пользователя одним запросом INSERT ... ON CONFLICT.
+
+        Уникальность username проверяет база, если имя занято, вызывается
+        AlreadyExistsError.
+        '''
+        try:
+            stmt = (
+                insert(self._model).
+                values(**data_in.model_dump()).
+                on_conflict_do_nothing(index_elements=[self._model.username]).
+                returning(self._model)
+            )
+            user = (await db.scalars(stmt)).one_or_none()
+            await db.commit()
+        except Exception as err:
+            await db.rollback()
+            logger.error('Error creating user %s', err, exc_info=True)
+            return None
+        if user is None:
+            raise AlreadyExistsError(data_in.username)
+        logger.info('Создан объект User %s', user.username)
+        return user
 
     async def update(
         self,
@@ -41,6 +191,7 @@ class UserManager(BaseManager[User, UserCreate, UserUpdate]):
     ) -> User:
         '''Обновляет объект в базе и возвращает его.'''
         try:
+            old_username = db_obj.username
             data = data_in.model_dump()
             stmt = (
                 update(self._model).
@@ -50,32 +201,621 @@ class UserManager(BaseManager[User, UserCreate, UserUpdate]):
             await db.execute(stmt)
             await db.commit()
             await db.refresh(db_obj)
-            logger.info(f'Обновлен объект User {db_obj.username}')
+            await principal_cache.invalidate(old_username, db_obj.username)
+            logger.info('Обновлен объект User %s', db_obj.username)
             return db_obj
         except Exception as err:
-            logger.error(f'Error updating user {err}', exc_info=True)
+            logger.error('Error updating user %s', err, exc_info=True)
+
+    async def delete(self, db: AsyncSession, db_obj: User) -> bool:
+        '''
+        Удаляет пользователя и сбрасывает его и его файлы из кэша.
+
+        Файлы и счетчики пользователя удаляет база (ondelete='CASCADE'),
+        ссылки его файлов на содержимое снимаются в той же транзакции.
+        После commit с диска удаляется содержимое без ссылок и файлы
+        раскладки sharded.
+        '''
+        try:
+            files = File.__table__
+            refs = (
+                select(files.c.blob_id, func.count().label('refs')).
+                where(
+                    files.c.user_id == db_obj.uid,
+                    files.c.blob_id.is_not(None)
+                ).
+                group_by(files.c.blob_id).
+                subquery()
+            )
+            released = await db.execute(
+                update(Blob).
+                where(Blob.sha256 == refs.c.blob_id).
+                values(refcount=Blob.refcount - refs.c.refs).
+                returning(Blob.sha256, Blob.refcount).
+                execution_options(synchronize_session=False)
+            )
+            unused = [
+                sha256 for sha256, refcount in released if refcount <= 0
+            ]
+            owned = (await db.execute(
+                select(files.c.fid, files.c.path, files.c.location).
+                where(files.c.user_id == db_obj.uid)
+            )).all()
+            await db.delete(db_obj)
+            await db.commit()
+            logger.info('Объект User %s удален из бд.', db_obj.username)
+        except Exception as err:
+            await db.rollback()
+            logger.error('Error deleting user %s', err, exc_info=True)
+            return False
+        await principal_cache.invalidate(db_obj.username)
+        await file_cache.invalidate(owned)
+        if unused:
+            await crud_blob.remove_unused(db=db, sha256s=unused)
+        for file in owned:
+            if file.location:
+                await io_executor.run(partial(remove_file, file.location))
+        return True
+
+
+class BlobManager(BaseManager[Blob, BlobCreate, BlobCreate]):
+    async def acquire(
+        self,
+        db: AsyncSession,
+        sha256: str,
+        size: int,
+        codec: Optional[str] = None
+    ) -> Optional[str]:
+        '''
+        Добавляет ссылку на содержимое, создавая запись при необходимости.
+
+        codec записывается только в новую запись. Не делает commit,
+        возвращает кодек, которым содержимое хранится на диске. Строка
+        blob заблокирована до конца транзакции.
+        '''
+        stmt = (
+            insert(self._model).
+            values(sha256=sha256, size=size, refcount=1, codec=codec).
+            on_conflict_do_update(
+                index_elements=[self._model.sha256],
+                set_={'refcount': self._model.refcount + 1}
+            ).
+            returning(self._model.codec)
+        )
+        return (await db.execute(stmt)).scalar_one()
+
+    async def acquire_many(
+        self,
+        db: AsyncSession,
+        data_in: List[BlobCreate]
+    ) -> Dict[str, Optional[str]]:
+        '''
+        Добавляет по ссылке на содержимое для каждого элемента data_in.
+
+        Повторы одного sha256 складываются в одну строку запроса.
+        Не делает commit, возвращает кодеки содержимого по sha256.
+        '''
+        refs = Counter(blob.sha256 for blob in data_in)
+        if not refs:
+            return {}
+        # Строка новой записи берется из первого повтора
+        blobs = {blob.sha256: blob for blob in reversed(data_in)}
+        stmt = insert(self._model).values([
+            {
+                'sha256': sha256,
+                'size': blobs[sha256].size,
+                'refcount': refcount,
+                'codec': blobs[sha256].codec
+            }
+            # Строки блокируются в одном порядке во всех транзакциях
+            for sha256, refcount in sorted(refs.items())
+        ])
+        result = await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[self._model.sha256],
+                set_={
+                    'refcount': self._model.refcount + stmt.excluded.refcount
+                }
+            ).
+            returning(self._model.sha256, self._model.codec)
+        )
+        return dict(result.all())
+
+    async def release(self, db: AsyncSession, sha256: str) -> bool:
+        '''
+        Убирает ссылку на содержимое.
+
+        Не делает commit, возвращает True, если ссылок не осталось.
+        Строка blob при этом остается: содержимое вместе с ней удаляет
+        remove_unused после commit.
+        '''
+        stmt = (
+            update(self._model).
+            where(self._model.sha256 == sha256).
+            values(refcount=self._model.refcount - 1).
+            returning(self._model.refcount)
+        )
+        refcount = (await db.execute(stmt)).scalar_one_or_none()
+        return refcount is not None and refcount <= 0
+
+    async def remove_unused(
+        self,
+        db: AsyncSession,
+        sha256s: List[str]
+    ) -> Optional[int]:
+        '''
+        Удаляет с диска и из базы содержимое из sha256s без ссылок.
+
+        Строки blob блокируются до удаления файлов с диска: загрузка того
+        же содержимого ждет commit и кладет содержимое заново, а если
+        она успела добавить ссылку, содержимое остается. Возвращает
+        число удаленных записей.
+        '''
+        try:
+            stmt = (
+                select(self._model).
+                where(
+                    self._model.sha256.in_(sha256s),
+                    self._model.refcount <= 0
+                ).
+                order_by(self._model.sha256).
+                with_for_update()
+            )
+            blobs = (await db.scalars(stmt)).all()
+            for blob in blobs:
+                await io_executor.run(
+                    partial(remove_blob, blob.sha256, blob.codec)
+                )
+                await db.delete(blob)
+            await db.commit()
+            return len(blobs)
+        except Exception as err:
+            await db.rollback()
+            logger.error('Error removing blobs %s', err, exc_info=True)
+
+
+class UsageManager(BaseManager[Usage, UsageCreate, UsageCreate]):
+    async def get(self, db: AsyncSession, user_id: UUID) -> Usage:
+        '''Возвращает счетчики пользователя, None если файлов еще не было.'''
+        try:
+            stmt = select(self._model).where(self._model.user_id == user_id)
+            obj = await db.execute(stmt)
+            logger.info('Запрошен объект Usage %s', user_id)
+            return obj.scalar_one_or_none()
+        except PoolTimeoutError:
+            raise
+        except Exception as err:
+            logger.error('Error getting usage %s', err, exc_info=True)
+
+    async def get_extensions(
+        self,
+        db: AsyncSession,
+        user_id: UUID
+    ) -> List[UsageExtension]:
+        '''Возвращает счетчики пользователя по расширениям.'''
+        try:
+            stmt = (
+                select(UsageExtension).
+                where(
+                    UsageExtension.user_id == user_id,
+                    UsageExtension.files_count > 0
+                ).
+                order_by(UsageExtension.files_size.desc())
+            )
+            result = await db.execute(stmt)
+            return result.scalars().all()
+        except PoolTimeoutError:
+            raise
+        except Exception as err:
+            logger.error('Error getting usage by ext %s', err, exc_info=True)
+
+    async def change(
+        self,
+        db: AsyncSession,
+        data_in: List[UsageCreate]
+    ) -> None:
+        '''
+        Прибавляет к счетчикам пользователей files_count и files_size.
+
+        Изменения складываются по пользователю и расширению, каждая
+        таблица обновляется одним запросом. Не делает commit: вызывается
+        в транзакции, которая меняет файлы, поэтому счетчики всегда
+        согласованы с таблицей file.
+        '''
+        totals: Dict[UUID, List[int]] = defaultdict(lambda: [0, 0])
+        extensions: Dict[Tuple[UUID, str], List[int]] = (
+            defaultdict(lambda: [0, 0])
+        )
+        for delta in data_in:
+            for key, counters in (
+                (delta.user_id, totals),
+                ((delta.user_id, delta.extension), extensions),
+            ):
+                counters[key][0] += delta.files_count
+                counters[key][1] += delta.files_size
+
+        for model, index_elements, rows in (
+            (
+                self._model,
+                [self._model.user_id],
+                [
+                    {'user_id': user_id, 'files_count': c, 'files_size': s}
+                    for user_id, (c, s) in totals.items()
+                ]
+            ),
+            (
+                UsageExtension,
+                [UsageExtension.user_id, UsageExtension.extension],
+                [
+                    {
+                        'user_id': user_id,
+                        'extension': extension,
+                        'files_count': c,
+                        'files_size': s
+                    }
+                    for (user_id, extension), (c, s) in extensions.items()
+                ]
+            ),
+        ):
+            if not rows:
+                continue
+            stmt = insert(model).values(rows)
+            set_ = {
+                'files_count': model.files_count + stmt.excluded.files_count,
+                'files_size': model.files_size + stmt.excluded.files_size,
+            }
+            # onupdate колонки не применяется в ON CONFLICT DO UPDATE
+            if 'updated' in model.__table__.c:
+                set_['updated'] = func.now()
+            await db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=index_elements,
+                    set_=set_
+                )
+            )
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        '''
+        Пересчитывает счетчики всех пользователей по таблице file.
+
+        Таблицы счетчиков блокируются до конца транзакции: загрузки,
+        начатые во время пересчета, дождутся его и добавят свои файлы
+        к уже пересчитанным значениям. Возвращает число пользователей.
+        '''
+        try:
+            for model in (self._model, UsageExtension):
+                await db.execute(text(
+                    f'LOCK TABLE {model.__tablename__} '
+                    'IN SHARE ROW EXCLUSIVE MODE'
+                ))
+                await db.execute(delete(model))
+
+            size = func.coalesce(func.sum(File.size), 0).cast(BigInteger)
+            extension = func.coalesce(File.extension, '')
+            result = await db.execute(
+                insert(self._model).from_select(
+                    ['user_id', 'files_count', 'files_size'],
+                    select(File.user_id, func.count(), size).
+                    where(File.user_id.is_not(None)).
+                    group_by(File.user_id)
+                )
+            )
+            await db.execute(
+                insert(UsageExtension).from_select(
+                    ['user_id', 'extension', 'files_count', 'files_size'],
+                    select(File.user_id, extension, func.count(), size).
+                    where(File.user_id.is_not(None)).
+                    group_by(File.user_id, extension)
+                )
+            )
+            await db.commit()
+            logger.info('Пересчитаны счетчики: %s', result.rowcount)
+            return result.rowcount
+        except Exception as err:
+            await db.rollback()
+            logger.error('Error rebuilding usage %s', err, exc_info=True)
 
 
 class FileManager(BaseManager[File, FileCreate, FileUpdate]):
+    async def create(
+        self,
+        db: AsyncSession,
+        data_in: FileCreate,
+        tmp_path: Optional[Path] = None,
+        **kwargs
+    ) -> File:
+        '''
+        Создает файл, ссылку на его содержимое и обновляет счетчики
+        пользователя в одной транзакции.
+
+        tmp_path - временный файл с содержимым blob. Он переносится
+        в хранилище до commit, пока строка blob заблокирована: созданный
+        файл всегда можно прочитать, а удаление последней ссылки на то
+        же содержимое не уберет его с диска. При ошибке временный файл
+        удаляется.
+        '''
+        try:
+            obj = self._model(**data_in.model_dump())
+            if data_in.blob_id:
+                # Если содержимое уже есть, оно хранится своим кодеком
+                obj.codec = await crud_blob.acquire(
+                    db=db,
+                    sha256=data_in.blob_id,
+                    size=data_in.size,
+                    codec=data_in.codec
+                )
+            await place_blobs(
+                [data_in], [tmp_path], {data_in.blob_id: obj.codec}
+            )
+            await crud_usage.change(db=db, data_in=[usage_delta(obj, 1)])
+            db.add(obj)
+            await db.commit()
+            logger.info('Создан объект File %s', obj.path)
+            await db.refresh(obj)
+            # Сбрасывает отметку об отсутствии файла по этому пути
+            await file_cache.invalidate([obj])
+            return obj
+        except Exception as err:
+            await db.rollback()
+            logger.error('Error creating file %s', err, exc_info=True)
+            await discard_blobs([tmp_path])
+
+    async def create_multi(
+        self,
+        db: AsyncSession,
+        data_in: List[FileCreate],
+        tmp_paths: Optional[List[Optional[Path]]] = None
+    ) -> List[File]:
+        '''
+        Создает файлы одним INSERT ... RETURNING в одной транзакции.
+
+        Ссылки на содержимое и счетчики пользователя обновляются
+        по одному запросу на таблицу. Объекты возвращаются в порядке
+        data_in, при ошибке не создается ни один файл. Кодек файла
+        с уже сохраненным содержимым берется из записи blob. tmp_paths -
+        временные файлы с содержимым blob в порядке data_in, они
+        переносятся в хранилище до commit, как в create.
+        '''
+        tmp_paths = tmp_paths or [None] * len(data_in)
+        try:
+            codecs = await crud_blob.acquire_many(
+                db=db,
+                data_in=[
+                    BlobCreate(
+                        sha256=item.blob_id,
+                        size=item.size,
+                        codec=item.codec
+                    )
+                    for item in data_in
+                    if item.blob_id
+                ]
+            )
+            await place_blobs(data_in, tmp_paths, codecs)
+            rows = [item.model_dump() for item in data_in]
+            for row in rows:
+                if row['blob_id']:
+                    row['codec'] = codecs[row['blob_id']]
+            objs = (await db.scalars(
+                insert(self._model).returning(
+                    self._model, sort_by_parameter_order=True
+                ),
+                rows
+            )).all()
+            await crud_usage.change(
+                db=db,
+                data_in=[usage_delta(obj, 1) for obj in objs]
+            )
+            await db.commit()
+            logger.info('Создано %s объектов File', len(objs))
+            await file_cache.invalidate(objs)
+            return objs
+        except Exception as err:
+            await db.rollback()
+            logger.error('Error creating files %s', err, exc_info=True)
+            await discard_blobs(tmp_paths)
+
+    async def delete(self, db: AsyncSession, db_obj: File) -> bool:
+        '''
+        Удаляет файл из базы данных.
+
+        Содержимое удаляется с диска, только когда на него не осталось
+        ссылок.
+        '''
+        try:
+            await db.delete(db_obj)
+            await db.flush()
+            unused = False
+            if db_obj.blob_id:
+                unused = await crud_blob.release(db=db, sha256=db_obj.blob_id)
+            await crud_usage.change(db=db, data_in=[usage_delta(db_obj, -1)])
+            await db.commit()
+            await file_cache.invalidate([db_obj])
+            if unused:
+                await crud_blob.remove_unused(
+                    db=db, sha256s=[db_obj.blob_id]
+                )
+            elif db_obj.location:
+                # Содержимое в раскладке sharded принадлежит одному файлу
+                await io_executor.run(partial(remove_file, db_obj.location))
+            logger.info('Объект File %s удален из бд.', db_obj.path)
+            return True
+        except Exception as err:
+            await db.rollback()
+            logger.error('Error deleting file %s', err, exc_info=True)
+
     async def get(self, db: AsyncSession, fid: str) -> File:
         '''Ищет объект в базе по fid и возвращает его.'''
         try:
             stmt = select(self._model).where(self._model.fid == fid)
             obj = await db.execute(stmt)
-            logger.info(f'Запрошен объект File {fid}')
+            logger.info('Запрошен объект File %s', fid)
             return obj.scalar_one_or_none()
+        except PoolTimeoutError:
+            raise
         except Exception as err:
-            logger.error(f'Error getting by fid {err}', exc_info=True)
+            logger.error('Error getting by fid %s', err, exc_info=True)
 
     async def get_by_path(self, db: AsyncSession, path: str) -> File:
         '''Ищет объект в базе по path и возвращает его.'''
         try:
             stmt = select(self._model).where(self._model.path == path)
             obj = await db.execute(stmt)
-            logger.info(f'Запрошен объект File {path}')
+            logger.info('Запрошен объект File %s', path)
             return obj.scalar_one_or_none()
+        except PoolTimeoutError:
+            raise
+        except Exception as err:
+            logger.error('Error getting by path %s', err, exc_info=True)
+
+    async def get_recent(self, db: AsyncSession, limit: int) -> List[File]:
+        '''Возвращает limit последних загруженных файлов всех пользователей.'''
+        try:
+            stmt = (
+                select(self._model)
+                .order_by(self._model.created.desc())
+                .limit(limit)
+            )
+            result = await db.execute(stmt)
+            logger.info('Запрошены последние %s объектов File', limit)
+            return result.scalars().all()
+        except PoolTimeoutError:
+            raise
+        except Exception as err:
+            logger.error('Error getting recent files %s', err, exc_info=True)
+
+    async def get_unplaced(
+        self,
+        db: AsyncSession,
+        after: Optional[UUID],
+        limit: int
+    ) -> List[File]:
+        '''
+        Возвращает limit файлов, содержимое которых лежит по путям
+        пользователей, по возрастанию fid после after.
+        '''
+        try:
+            stmt = (
+                select(self._model)
+                .where(
+                    self._model.blob_id.is_(None),
+                    self._model.location.is_(None)
+                )
+                .order_by(self._model.fid)
+                .limit(limit)
+            )
+            if after is not None:
+                stmt = stmt.where(self._model.fid > after)
+            result = await db.execute(stmt)
+            return result.scalars().all()
+        except Exception as err:
+            logger.error('Error getting unplaced files %s', err, exc_info=True)
+
+    async def set_locations(
+        self,
+        db: AsyncSession,
+        locations: Dict[UUID, str]
+    ) -> List[File]:
+        '''
+        Записывает места содержимого файлов одним UPDATE и сбрасывает
+        их записи в кэше.
+
+        Обновляются только файлы, у которых места еще нет. Возвращает
+        обновленные файлы: удаленных за это время среди них не будет.
+        '''
+        try:
+            rows = values(
+                column('fid', Uuid),
+                column('location', String),
+                name='locations'
+            ).data(list(locations.items()))
+            stmt = (
+                update(self._model)
+                .where(
+                    self._model.fid == rows.c.fid,
+                    self._model.location.is_(None)
+                )
+                .values(location=rows.c.location)
+                .returning(self._model)
+            )
+            objs = (await db.scalars(stmt)).all()
+            await db.commit()
+            logger.info('Перенесено %s объектов File', len(objs))
+            await file_cache.invalidate(objs)
+            return objs
         except Exception as err:
-            logger.error(f'Error getting by path {err}', exc_info=True)
+            await db.rollback()
+            logger.error('Error setting locations %s', err, exc_info=True)
+
+    async def get_unplaced_paths(
+        self,
+        db: AsyncSession,
+        paths: List[str]
+    ) -> Set[str]:
+        '''Возвращает пути из paths, по которым еще читаются файлы.'''
+        try:
+            stmt = select(self._model.path).distinct().where(
+                self._model.path.in_(paths),
+                self._model.blob_id.is_(None),
+                self._model.location.is_(None)
+            )
+            return set((await db.scalars(stmt)).all())
+        except Exception as err:
+            logger.error('Error getting unplaced paths %s', err, exc_info=True)
+
+    def search_stmt(self, options: Dict) -> Select:
+        '''
+        Строит запрос поиска файлов пользователя options['user_id'].
+
+        Условия записаны так, чтобы планировщик мог использовать индексы:
+        user_id и path - равенства, prefix - LIKE без % в начале, query -
+        LIKE по триграммному индексу имени, сортировка - по полям из
+        FileOrdering (и path для архивов). options['after'] - пара
+        (значение поля сортировки, fid), после которой начинается страница.
+        '''
+        options = dict(options)
+        ordering = options.pop('order_by', None) or 'created'
+        descending = ordering.startswith('-')
+        column = getattr(self._model, ordering.lstrip('-'))
+        stmt = select(self._model).where(
+            self._model.user_id == options.pop('user_id')
+        )
+
+        # Keyset: продолжение после (значение поля, fid) из курсора,
+        # без OFFSET, поэтому глубина страницы не влияет на время запроса
+        if options.get('after'):
+            position = tuple_(column, self._model.fid)
+            after = options.pop('after')
+            stmt = stmt.where(
+                position < after if descending else position > after
+            )
+
+        if options.get('path'):
+            stmt = stmt.where(self._model.path == options.pop('path'))
+        # Префикс пути - диапазон по индексу ix_file_path
+        if options.get('prefix'):
+            stmt = stmt.where(
+                self._model.path.like(
+                    like_prefix(options.pop('prefix')), escape='/'
+                )
+            )
+        if options.get('extension'):
+            stmt = stmt.where(
+                self._model.extension == options.pop('extension')
+            )
+        if options.get('query'):
+            stmt = stmt.where(
+                self._model.name.like(
+                    like_pattern(options.pop('query')), escape='/'
+                )
+            )
+        # fid делает порядок однозначным при равных значениях поля
+        if descending:
+            stmt = stmt.order_by(column.desc(), self._model.fid.desc())
+        else:
+            stmt = stmt.order_by(column, self._model.fid)
+        if options.get('limit'):
+            stmt = stmt.limit(options.pop('limit'))
+        return stmt
 
     async def get_by_filters(
         self,
@@ -83,23 +823,42 @@ class FileManager(BaseManager[File, FileCreate, FileUpdate]):
         options: Dict
     ) -> List[File]:
         '''Ищет объекты в соответствии с заданными фильтрами.'''
-        ordering = None
-        limit = None
-        stmt = select(self._model)
+        result = await db.execute(self.search_stmt(options))
+        return result.scalars().all()
 
-        if options.get('order_by'):
-            ordering = options.pop('order_by')
-            stmt = stmt.order_by(ordering)
-        if options.get('limit'):
-            limit = options.pop('limit')
-            stmt = stmt.limit(limit)
-        if options.get('query'):
-            name = options.pop('query')
-            stmt = stmt.where(self._model.name.like(f'%{name}%'))
+    async def stream_by_filters(
+        self,
+        options: Dict,
+        batch_size: int
+    ) -> AsyncIterator[List[File]]:
+        '''
+        Отдает найденные объекты пачками по batch_size.
 
-        stmt = stmt.filter_by(**options)
-        result = await db.execute(stmt)
-        return result.scalars().all()
+        Каждая пачка - отдельный keyset-запрос после последнего объекта
+        предыдущей пачки в своей короткой сессии: пока пачка отправляется
+        клиенту, соединение с базой возвращено в пул, поэтому медленные
+        загрузки архивов не держат соединения и серверные курсоры.
+        Сессия открывается здесь, а не передается из обработчика: сессия
+        из зависимости закрывается раньше, чем начинается отправка тела
+        StreamingResponse. options['limit'] ограничивает общее число
+        объектов.
+        '''
+        options = dict(options)
+        ordering = (options.get('order_by') or 'created').lstrip('-')
+        remaining = options.pop('limit', None) or float('inf')
+        while remaining > 0:
+            limit = int(min(batch_size, remaining))
+            async with async_session() as db:
+                batch = (await db.scalars(
+                    self.search_stmt({**options, 'limit': limit})
+                )).all()
+            if batch:
+                yield batch
+            if len(batch) < limit:
+                return
+            remaining -= len(batch)
+            last = batch[-1]
+            options['after'] = (getattr(last, ordering), last.fid)
 
     async def update(
         self,
@@ -109,6 +868,8 @@ class FileManager(BaseManager[File, FileCreate, FileUpdate]):
     ) -> File:
         '''Обновляет объект в базе и возвращает его.'''
         try:
+            old_path_key = file_cache.path_key(db_obj.path)
+            old_usage = usage_delta(db_obj, -1)
             data = data_in.model_dump()
             stmt = (
                 update(self._model).
@@ -116,13 +877,64 @@ class FileManager(BaseManager[File, FileCreate, FileUpdate]):
                 values(**data)
             )
             await db.execute(stmt)
-            await db.commit()
             await db.refresh(db_obj)
-            logger.info(f'Обновлен объект File {db_obj.path}')
+            new_usage = usage_delta(db_obj, 1)
+            # Размер, расширение или владелец изменились
+            if old_usage.model_dump(exclude={'files_count'}) != (
+                new_usage.model_dump(exclude={'files_count'})
+            ):
+                await crud_usage.change(db=db, data_in=[old_usage, new_usage])
+            await db.commit()
+            await file_cache.invalidate([db_obj], extra_keys=[old_path_key])
+            logger.info('Обновлен объект File %s', db_obj.path)
             return db_obj
         except Exception as err:
-            logger.error(f'Error updating file {err}', exc_info=True)
+            await db.rollback()
+            logger.error('Error updating file %s', err, exc_info=True)
+
+
+class UploadSessionManager(
+    BaseManager[UploadSession, UploadSessionCreate, UploadSessionCreate]
+):
+    async def get(self, db: AsyncSession, sid: str) -> UploadSession:
+        '''Ищет объект в базе по sid и возвращает его.'''
+        try:
+            stmt = select(self._model).where(self._model.sid == sid)
+            obj = await db.execute(stmt)
+            logger.info('Запрошен объект UploadSession %s', sid)
+            return obj.scalar_one_or_none()
+        except PoolTimeoutError:
+            raise
+        except Exception as err:
+            logger.error('Error getting by sid %s', err, exc_info=True)
+
+    async def delete_expired(
+        self,
+        db: AsyncSession,
+        now: datetime
+    ) -> List[UUID]:
+        '''Удаляет загрузки, срок жизни которых истек, и возвращает их sid.'''
+        try:
+            stmt = (
+                delete(self._model).
+                where(self._model.expires < now).
+                returning(self._model.sid)
+            )
+            result = await db.execute(stmt)
+            sids = result.scalars().all()
+            await db.commit()
+            logger.info('Удалено просроченных загрузок: %s', len(sids))
+            return sids
+        except Exception as err:
+            await db.rollback()
+            logger.error(
+                'Error deleting expired uploads %s', err, exc_info=True
+            )
+            return []
 
 
 crud_user = UserManager(User)
+crud_usage = UsageManager(Usage)
 crud_file = FileManager(File)
+crud_blob = BlobManager(Blob)
+crud_upload_session = UploadSessionManager(UploadSession)
@@ -1,7 +1,17 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, String, Uuid
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Uuid
+)
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -20,10 +30,14 @@ class User(Base):
         index=True
     )
     password = Column(String, nullable=False)
+    # Файлов у пользователя может быть очень много: они не загружаются
+    # вместе с User, а запрашиваются постранично через crud_file.
+    # Удаляет их база (ondelete='CASCADE'), без загрузки в сессию
     files = relationship(
         'File',
         back_populates='user',
-        lazy='selectin',
+        lazy='raise',
+        passive_deletes=True,
         order_by='File.created'
     )
 
@@ -41,3 +55,96 @@ class File(Base):
     extension = Column(String(length=10), nullable=True)
     user_id = Column(ForeignKey('users.uid', ondelete='CASCADE'))
     user = relationship('User', back_populates='files')
+    blob_id = Column(
+        ForeignKey('blob.sha256'),
+        nullable=True,
+        index=True
+    )
+    # Кодек, которым содержимое сжато на диске, None - без сжатия.
+    # У файлов с blob_id совпадает с Blob.codec
+    codec = Column(String(length=10), nullable=True)
+    # Путь к содержимому относительно DATA_DIR, если оно лежит не по path
+    # (раскладка sharded). У файлов с blob_id не заполняется
+    location = Column(String(length=100), nullable=True)
+
+    __table_args__ = (
+        # Поиск и списки файлов всегда ограничены пользователем
+        Index('ix_file_user_id_created', 'user_id', 'created'),
+        Index('ix_file_user_id_extension', 'user_id', 'extension'),
+        # varchar_pattern_ops: и точное совпадение, и LIKE 'prefix%'
+        Index(
+            'ix_file_path',
+            'path',
+            postgresql_ops={'path': 'varchar_pattern_ops'}
+        ),
+        # Поиск подстроки в имени, требует расширения pg_trgm
+        Index(
+            'ix_file_name_trgm',
+            'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'}
+        ),
+    )
+
+
+class Blob(Base):
+    '''Таблица с уникальным содержимым файлов.'''
+
+    __tablename__ = 'blob'
+
+    sha256 = Column(String(length=64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created = Column(DateTime(timezone=True), default=datetime.utcnow)
+    # Кодек выбирает первая загрузка содержимого, повторные его наследуют
+    codec = Column(String(length=10), nullable=True)
+
+
+class Usage(Base):
+    '''Таблица с числом и общим размером файлов пользователя.'''
+
+    __tablename__ = 'usage'
+
+    user_id = Column(
+        ForeignKey('users.uid', ondelete='CASCADE'),
+        primary_key=True
+    )
+    files_count = Column(BigInteger, nullable=False, default=0)
+    files_size = Column(BigInteger, nullable=False, default=0)
+    updated = Column(
+        DateTime(timezone=True),
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow
+    )
+
+
+class UsageExtension(Base):
+    '''Таблица с числом и размером файлов пользователя по расширениям.'''
+
+    __tablename__ = 'usage_extension'
+
+    user_id = Column(
+        ForeignKey('users.uid', ondelete='CASCADE'),
+        primary_key=True
+    )
+    # Файлы без расширения учитываются под пустой строкой
+    extension = Column(String(length=10), primary_key=True)
+    files_count = Column(BigInteger, nullable=False, default=0)
+    files_size = Column(BigInteger, nullable=False, default=0)
+
+
+class UploadSession(Base):
+    '''Таблица с незавершенными загрузками файлов по частям.'''
+
+    __tablename__ = 'upload_session'
+
+    sid = Column(Uuid, default=uuid4, primary_key=True)
+    path = Column(String(length=250), nullable=False)
+    filename = Column(String(length=250), nullable=False)
+    created = Column(DateTime(timezone=True), default=datetime.utcnow)
+    expires = Column(DateTime(timezone=True), nullable=False, index=True)
+    user_id = Column(
+        ForeignKey('users.uid', ondelete='CASCADE'),
+        nullable=False,
+        index=True
+    )
@@ -0,0 +1,112 @@
+import logging
+import time
+from typing import Any, Dict, Optional, Type
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, PoolProxiedConnection
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    '''
+    Метрики пула соединений с базой.
+
+    Время ожидания соединения и таймауты записывает пул из
+    instrumented_pool, новые и сброшенные соединения - события пула,
+    подключенные listen. Пул работает в цикле событий, поэтому
+    счетчики меняются без блокировок.
+    '''
+
+    def __init__(self):
+        self._engine: Optional[Engine] = None
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.overflow_max = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_checkout(self, waited: float, overflow: int) -> None:
+        self.checkouts += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        self.overflow_max = max(self.overflow_max, overflow)
+
+    def listen(self, engine: Engine) -> None:
+        '''Подключает счетчики к событиям пула engine.'''
+        self._engine = engine
+        # События, подключенные к Engine, переходят и на пул,
+        # пересозданный после dispose
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+        event.listen(engine, 'soft_invalidate', self._on_soft_invalidate)
+
+    def _on_connect(self, *args) -> None:
+        self.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, record, error) -> None:
+        self.invalidations += 1
+        logger.warning('DB connection invalidated: %s', error)
+
+    def _on_soft_invalidate(self, *args) -> None:
+        self.soft_invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        '''Возвращает текущее состояние пула и накопленные метрики.'''
+        result = {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'connects': self.connects,
+            'invalidations': self.invalidations,
+            'soft_invalidations': self.soft_invalidations,
+            'overflow_max': self.overflow_max,
+            'wait_time_avg': (
+                self.wait_time_total / self.checkouts
+                if self.checkouts else 0.0
+            ),
+            'wait_time_max': self.wait_time_max,
+        }
+        if self._engine is not None:
+            pool = self._engine.pool
+            result.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                # overflow() отрицателен, пока пул не заполнен
+                'overflow': max(pool.overflow(), 0),
+            })
+        return result
+
+
+def instrumented_pool(stats: PoolStats) -> Type[AsyncAdaptedQueuePool]:
+    '''
+    Класс пула, который записывает в stats, сколько ждали соединения.
+
+    В ожидание входит и проверка pool_pre_ping, и открытие нового
+    соединения: это задержка, которую видит запрос.
+    '''
+
+    class InstrumentedPool(AsyncAdaptedQueuePool):
+        def connect(self) -> PoolProxiedConnection:
+            start = time.perf_counter()
+            try:
+                connection = super().connect()
+            except exc.TimeoutError:
+                stats.timeouts += 1
+                logger.warning(
+                    'DB pool exhausted: %s connections checked out, '
+                    'timeout %ss',
+                    self.checkedout(),
+                    self._timeout
+                )
+                raise
+            stats.record_checkout(
+                time.perf_counter() - start, max(self.overflow(), 0)
+            )
+            return connection
+
+    return InstrumentedPool
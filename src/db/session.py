@@ -1,12 +1,51 @@
+import time
+
+from sqlalchemy import event, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
-from core.settings import SA_URL
+from core.metrics import DB_QUERY_DURATION
+from core.settings import app_settings, SA_URL
+from .pool import PoolStats, instrumented_pool
+
+pool_stats = PoolStats()
 
 engine = create_async_engine(
     url=SA_URL,
-    future=True
+    future=True,
+    poolclass=instrumented_pool(pool_stats),
+    pool_size=app_settings.DB_POOL_SIZE,
+    max_overflow=app_settings.DB_MAX_OVERFLOW,
+    pool_timeout=app_settings.DB_POOL_TIMEOUT,
+    pool_recycle=app_settings.DB_POOL_RECYCLE,
+    pool_pre_ping=app_settings.DB_POOL_PRE_PING,
+    connect_args={
+        # Параметры asyncpg.connect
+        'timeout': app_settings.DB_CONNECT_TIMEOUT,
+        'command_timeout': app_settings.DB_COMMAND_TIMEOUT,
+        'statement_cache_size': app_settings.DB_STATEMENT_CACHE_SIZE,
+        # Кэш подготовленных запросов на стороне sqlalchemy
+        'prepared_statement_cache_size': (
+            app_settings.DB_STATEMENT_CACHE_SIZE
+        ),
+    }
 )
+pool_stats.listen(engine.sync_engine)
+
+
+@event.listens_for(engine.sync_engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, many):
+    context._query_start = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, 'after_cursor_execute')
+def observe_query_time(conn, cursor, statement, parameters, context, many):
+    # Метка - вид запроса (SELECT, INSERT...), а не его текст
+    operation = statement.lstrip().split(None, 1)[0].upper()
+    DB_QUERY_DURATION.labels(operation).observe(
+        time.perf_counter() - context._query_start
+    )
+
 
 async_session = sessionmaker(
     bind=engine,
@@ -19,3 +58,11 @@ async def get_session() -> AsyncSession:
     '''Генерирует новую сессию для операций с БД.'''
     async with async_session() as session:
         yield session
+
+
+async def ping_database() -> float:
+    '''Проверяет соединение с базой и возвращает время ответа, секунды.'''
+    start = time.perf_counter()
+    async with engine.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+    return time.perf_counter() - start
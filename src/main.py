@@ -1,20 +1,95 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import ORJSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from starlette.formparsers import MultiPartParser
 
 from api.v1 import v1_router
-from core.logger import LOGGING_CONFIG
+from core.executors import executors, shutdown_executors, start_executors
+from core.logger import logging_config, start_log_queue, stop_log_queue
+from core.metrics import (
+    MetricsMiddleware,
+    StatsCollector,
+    mark_worker_stopped,
+    metrics_payload,
+    multiprocess_metrics,
+    register_collector
+)
+from core.redis import close_redis, init_redis
 from core.settings import app_settings, APP_HOST
+from db.session import engine, pool_stats
+from utils.cache import file_cache, principal_cache
+from utils.storage import init_storage
+from utils.tasks import cleanup_upload_sessions, run_periodically
+from utils.warmup import warm_up
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    '''
+    Создает общие ресурсы приложения и освобождает их при остановке.
+
+    Запросы начинают приниматься после прогрева: соединения с базой и
+    Redis уже открыты, процессы пула паролей запущены.
+    '''
+    start_log_queue()
+    # Сколько байт каждого загружаемого файла держится в памяти,
+    # остальное starlette сбрасывает во временный файл. Это атрибут
+    # класса: настройка глобальная для всего процесса, поэтому прежнее
+    # значение возвращается при остановке
+    spool_max_size = MultiPartParser.max_file_size
+    MultiPartParser.max_file_size = app_settings.UPLOAD_SPOOL_MAX_SIZE
+    init_storage()
+    start_executors()
+    init_redis()
+    await warm_up()
+    app.state.ready = True
+    upload_gc = asyncio.create_task(
+        run_periodically(
+            cleanup_upload_sessions,
+            interval=app_settings.UPLOAD_SESSION_GC_INTERVAL
+        )
+    )
+    yield
+    app.state.ready = False
+    upload_gc.cancel()
+    await close_redis()
+    await shutdown_executors()
+    await engine.dispose()
+    mark_worker_stopped()
+    MultiPartParser.max_file_size = spool_max_size
+    stop_log_queue()
+
 
 app = FastAPI(
     title=app_settings.APP_TITLE,
+    lifespan=lifespan,
     docs_url='/api/openapi',
     openapi_url='/api/openapi.json',
     default_response_class=ORJSONResponse
 )
 app.include_router(v1_router)
 
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(
+    request: Request,
+    exc: PoolTimeoutError
+) -> ORJSONResponse:
+    '''Пул соединений с базой исчерпан: отказ вместо долгого ожидания.'''
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'detail': 'Сервер перегружен, повторите попытку позже.'},
+        headers={'Retry-After': '1'}
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=app_settings.ALLOWED_ORIGINS.split(),
@@ -22,13 +97,77 @@ app.add_middleware(
     allow_headers=['*'],
     allow_methods=['*']
 )
+app.add_middleware(MetricsMiddleware, router=app.router)
 
 
-if __name__ == "__main__":
-    uvicorn.run(
-        'main:app',
-        host=APP_HOST,
-        port=app_settings.PORT,
-        reload=True,
-        log_config=LOGGING_CONFIG
+@app.get('/metrics', include_in_schema=False)
+async def metrics() -> Response:
+    '''
+    Метрики процесса для Prometheus.
+
+    Путь вне /api: nginx его не проксирует, метрики собираются
+    напрямую с backend.
+    '''
+    return Response(metrics_payload(), media_type=CONTENT_TYPE_LATEST)
+
+
+# Счетчики, которые уже ведут сами ресурсы процесса
+register_collector(StatsCollector(
+    'executor',
+    'executor',
+    lambda: {name: pool.stats() for name, pool in executors.items()},
+    counters=('completed', 'rejected')
+))
+register_collector(StatsCollector(
+    'cache',
+    'cache',
+    lambda: {
+        'file': file_cache.stats(),
+        'principal': principal_cache.stats(),
+    },
+    counters=(
+        'hits', 'negative_hits', 'redis_hits', 'misses', 'coalesced',
+        'errors'
     )
+))
+register_collector(StatsCollector(
+    'db_pool',
+    'pool',
+    lambda: {'default': pool_stats.stats()},
+    counters=(
+        'checkouts', 'timeouts', 'connects', 'invalidations',
+        'soft_invalidations'
+    )
+))
+
+
+def run_server() -> None:
+    '''
+    Запускает uvicorn с настройками APP_SERVER_*.
+
+    По SIGTERM uvicorn перестает принимать соединения и ждет начатые
+    запросы до SERVER_GRACEFUL_TIMEOUT секунд, затем закрывает ресурсы
+    через lifespan.
+    '''
+    workers = app_settings.SERVER_WORKERS or os.cpu_count() or 1
+    if app_settings.SERVER_RELOAD:
+        workers = 1
+    with multiprocess_metrics() if workers > 1 else nullcontext():
+        uvicorn.run(
+            'main:app',
+            host=APP_HOST,
+            port=app_settings.PORT,
+            reload=app_settings.SERVER_RELOAD,
+            workers=workers,
+            loop=app_settings.SERVER_LOOP,
+            http=app_settings.SERVER_HTTP,
+            backlog=app_settings.SERVER_BACKLOG,
+            timeout_keep_alive=app_settings.SERVER_KEEPALIVE_TIMEOUT,
+            timeout_graceful_shutdown=app_settings.SERVER_GRACEFUL_TIMEOUT,
+            limit_concurrency=app_settings.SERVER_LIMIT_CONCURRENCY,
+            log_config=logging_config()
+        )
+
+
+if __name__ == "__main__":
+    run_server()
@@ -1,8 +1,8 @@
 from datetime import datetime
-from typing import Optional, Union
-from uuid import UUID
+from typing import List, Literal, Optional, Union
+from uuid import UUID, uuid4
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class BaseFile(BaseModel):
@@ -18,13 +18,36 @@ class BaseFile(BaseModel):
     model_config = ConfigDict(from_attribute=True)
 
 
+class FileRecord(BaseFile):
+    '''Запись о файле в кэше метаданных.'''
+    blob_id: Optional[str] = None
+    codec: Optional[str] = None
+    location: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class FileCreate(BaseModel):
     '''Схема данных для создания объекта.'''
+    # fid известен до записи: по нему выбирается место на диске
+    fid: UUID = Field(default_factory=uuid4)
     name: str
     path: str
     size: float | int
     extension: str
     user_id: UUID
+    blob_id: Optional[str] = None
+    codec: Optional[str] = None
+    location: Optional[str] = None
+
+
+class BatchUploadResult(BaseModel):
+    '''Результат загрузки одного файла из пакета.'''
+    filename: str
+    # HTTP-код, который получил бы файл при отдельной загрузке
+    status: int
+    detail: Optional[str] = None
+    file: Optional[BaseFile] = None
 
 
 class FileUpdate(BaseModel):
@@ -36,10 +59,45 @@ class FileUpdate(BaseModel):
     user_id: Optional[UUID]
 
 
+# Поля сортировки результатов поиска, '-' - по убыванию
+FileOrdering = Literal['created', '-created', 'name', '-name', 'size', '-size']
+
+
 class FileFilter(BaseModel):
     '''Набор фильтров для файлов.'''
     path: Optional[str] = None
     extension: Optional[str] = None
-    order_by: Optional[str] = None
-    limit: Optional[int] = None
+    order_by: Optional[FileOrdering] = None
+    limit: Optional[int] = Field(default=None, ge=1)
     query: Optional[str] = None
+    cursor: Optional[str] = None
+
+
+class FilePage(BaseModel):
+    '''Страница результатов поиска файлов.'''
+    items: List[BaseFile]
+    next_cursor: Optional[str] = None
+
+
+class BlobCreate(BaseModel):
+    '''Схема данных для создания записи о содержимом файла.'''
+    sha256: str
+    size: int
+    codec: Optional[str] = None
+
+
+class UsageCreate(BaseModel):
+    '''Изменение счетчиков места, занятого пользователем.'''
+    user_id: UUID
+    extension: str
+    files_count: int
+    files_size: int
+
+
+class ExtensionUsage(BaseModel):
+    '''Число и общий размер файлов одного расширения.'''
+    extension: str
+    files_count: int
+    files_size: int
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import List
+from uuid import UUID
+
+from pydantic import BaseModel, ConfigDict
+
+
+class UploadSessionCreate(BaseModel):
+    '''Схема данных для создания сессии загрузки по частям.'''
+    path: str
+    filename: str
+    user_id: UUID
+    expires: datetime
+
+
+class UploadPart(BaseModel):
+    '''Схема полученной части файла.'''
+    number: int
+    size: int
+
+
+class UploadSessionGet(BaseModel):
+    '''Схема сессии загрузки для ответа пользователям.'''
+    sid: UUID
+    path: str
+    filename: str
+    created: datetime
+    expires: datetime
+    parts: List[UploadPart] = []
+
+    model_config = ConfigDict(from_attributes=True)
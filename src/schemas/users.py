@@ -3,18 +3,33 @@ from uuid import UUID
 
 from pydantic import BaseModel, ConfigDict
 
-from .entities import BaseFile, ConfigDict
+from .entities import ConfigDict, ExtensionUsage, FilePage
 
 
 class UserGet(BaseModel):
     '''Схема для ответа пользователям.'''
     uid: UUID
     username: str
-    files: List[BaseFile]
 
     model_config = ConfigDict(from_attribute=True)
 
 
+class UserFiles(UserGet):
+    '''Сводка по файлам пользователя и страница списка файлов.'''
+    files_count: int
+    files_size: int
+    extensions: List[ExtensionUsage]
+    files: FilePage
+
+
+class UserPrincipal(BaseModel):
+    '''Авторизованный пользователь без пароля и связанных моделей.'''
+    uid: UUID
+    username: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 class BaseUser(BaseModel):
     '''Схема в базе данных без связанных моделей.'''
     username: str
@@ -0,0 +1,85 @@
+'''
+Общие фикстуры и помощники тестов API.
+
+Фикстуры с циклом событий объявлены с scope='session', как и
+pytestmark модулей: асинхронная фикстура выполняется в цикле своей
+области, поэтому модульные фикстуры вызываются из тестов модулей
+через помощники ниже, а не объявляются здесь с scope='module'.
+'''
+import random
+from typing import Any, AsyncGenerator, Dict
+
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient, Response
+
+from src.core.settings import BASE_URL
+from src.main import app
+
+register = '/api/auth/register'
+login = '/api/auth/token'
+user_files = '/api/auth/user/files'
+upload_file = '/api/files/upload'
+upload_batch = '/api/files/upload/batch'
+uploads = '/api/files/uploads'
+download_file = '/api/files/download'
+archive = '/api/files/archive'
+
+PASSWORD = 'Changeme1!'
+
+
+@pytest_asyncio.fixture(scope='session')
+async def client() -> AsyncGenerator[AsyncClient, Any]:
+    '''Асинхронный клиент для pytest.'''
+    async with AsyncClient(app=app, base_url=BASE_URL) as client:
+        yield client
+
+
+def new_credentials(prefix: str) -> Dict[str, str]:
+    '''Данные нового пользователя с именем, начинающимся с prefix.'''
+    return {
+        'username': f'{prefix}{random.randrange(1, 100000)}',
+        'password': PASSWORD
+    }
+
+
+async def login_headers(
+    client: AsyncClient,
+    credentials: Dict[str, str]
+) -> Dict[str, str]:
+    '''Регистрирует пользователя и возвращает заголовки авторизации.'''
+    await client.post(register, json=credentials)
+    token = (await client.post(login, data=credentials)).json()
+    return {'Authorization': f'{token["token_type"]} {token["access_token"]}'}
+
+
+async def register_user(client: AsyncClient, prefix: str) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await login_headers(client, new_credentials(prefix))
+
+
+async def post_upload(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    path: str,
+    content: bytes
+) -> Response:
+    '''Загружает content по пути path, имя файла - последняя часть пути.'''
+    return await client.post(
+        upload_file,
+        params={'path': path},
+        files={'file': (path.split('/')[-1], content)},
+        headers=headers
+    )
+
+
+async def upload(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    path: str,
+    content: bytes
+) -> Dict:
+    '''Загружает файл и возвращает его запись.'''
+    response = await post_upload(client, headers, path, content)
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
@@ -0,0 +1,130 @@
+import io
+import tarfile
+import zipfile
+from typing import Dict
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+
+from core.settings import app_settings
+from db.crud import crud_file
+from db.session import engine
+from utils.archive import ArchiveWriter, ZipArchiveWriter
+from .conftest import archive, register_user, upload, user_files
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+FILES = {
+    'docs/a.txt': b'a' * 5000,
+    'docs/sub/b.csv': b'1,2,3\n' * 100,
+    'docs/photo.jpg': bytes(range(256)) * 10,
+    'other/c.txt': b'not in archive',
+}
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации пользователя с загруженными FILES.'''
+    headers = await register_user(client, 'archive')
+    for path, content in FILES.items():
+        await upload(client, headers, path, content)
+    return headers
+
+
+async def test_zip_archive(client: AsyncClient, auth_headers: Dict[str, str]):
+    response = await client.get(
+        archive, params={'path': '/docs/'}, headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/zip'
+    assert 'docs.zip' in response.headers['content-disposition']
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archived:
+        assert archived.testzip() is None
+        names = sorted(archived.namelist())
+        assert names == ['a.txt', 'photo.jpg', 'sub/b.csv']
+        for name in names:
+            assert archived.read(name) == FILES[f'docs/{name}']
+        # Уже сжатые форматы не пережимаются
+        compression = {
+            name: archived.getinfo(name).compress_type for name in names
+        }
+        assert compression['photo.jpg'] == zipfile.ZIP_STORED
+        assert compression['a.txt'] == zipfile.ZIP_DEFLATED
+
+
+async def test_tar_archive(client: AsyncClient, auth_headers: Dict[str, str]):
+    response = await client.get(
+        archive,
+        params={'path': 'docs/sub', 'format': 'tar'},
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.content) % tarfile.RECORDSIZE == 0
+
+    with tarfile.open(fileobj=io.BytesIO(response.content)) as archived:
+        assert archived.getnames() == ['b.csv']
+        assert archived.extractfile('b.csv').read() == FILES['docs/sub/b.csv']
+
+
+async def test_empty_directory_archive(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    response = await client.get(
+        archive, params={'path': 'missing'}, headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_archive_in_batches(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Между пачками соединение с базой возвращается в пул.'''
+    monkeypatch.setattr(app_settings, 'SEARCH_STREAM_BATCH_SIZE', 1)
+    response = await client.get(
+        archive, params={'path': 'docs'}, headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archived:
+        assert sorted(archived.namelist()) == [
+            'a.txt', 'photo.jpg', 'sub/b.csv'
+        ]
+
+    response = await client.get(user_files, headers=auth_headers)
+    user_id = response.json()['uid']
+    batches = crud_file.stream_by_filters(
+        options={'user_id': user_id, 'order_by': 'path'}, batch_size=2
+    )
+    paths = []
+    async for batch in batches:
+        assert engine.pool.checkedout() == 0
+        paths += [file.path.split('/', 1)[1] for file in batch]
+    assert paths == sorted(FILES)
+
+    batches = crud_file.stream_by_filters(
+        options={'user_id': user_id, 'order_by': '-path', 'limit': 3},
+        batch_size=2
+    )
+    assert [len(batch) async for batch in batches] == [2, 1]
+
+
+async def test_incomplete_writer():
+    '''Writer без части методов формата не создается.'''
+    class NoFinish(ArchiveWriter):
+        def begin(self, entry, size):
+            pass
+
+        def write(self, data):
+            pass
+
+        def end(self):
+            pass
+
+    with pytest.raises(TypeError):
+        NoFinish(chunk_size=1024)
+    assert ZipArchiveWriter(chunk_size=1024).close()
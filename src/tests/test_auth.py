@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from functools import partial
+from typing import Dict
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+
+from core.executors import (
+    InstrumentedExecutor,
+    executors,
+    password_executor
+)
+from utils.auth import hash_password, verify_password
+from .conftest import login, login_headers, new_credentials
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def credentials(client: AsyncClient) -> Dict[str, str]:
+    '''Данные зарегистрированного пользователя.'''
+    credentials = new_credentials('auth')
+    await login_headers(client, credentials)
+    return credentials
+
+
+async def test_password_process_pool():
+    '''bcrypt выполняется в пуле процессов, а не в потоках.'''
+    assert password_executor.processes
+    completed = password_executor.stats()['completed']
+    hashed = await password_executor.run(partial(hash_password, 'Secret1'))
+    assert await password_executor.run(
+        partial(verify_password, 'Secret1', hashed)
+    )
+    assert not await password_executor.run(
+        partial(verify_password, 'Secret2', hashed)
+    )
+    assert password_executor.stats()['completed'] == completed + 3
+
+
+async def test_login_uses_password_pool(
+    client: AsyncClient,
+    credentials: Dict[str, str]
+):
+    completed = password_executor.stats()['completed']
+    response = await client.post(login, data=credentials)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['access_token']
+    assert password_executor.stats()['completed'] == completed + 1
+
+
+async def test_login_overloaded(
+    client: AsyncClient,
+    credentials: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Перегруженный пул паролей отвечает 503 с Retry-After.'''
+    overloaded = InstrumentedExecutor(
+        name='password', max_workers=1,
+        max_concurrency=1, queue_timeout=0.05
+    )
+    monkeypatch.setitem(executors, 'password', overloaded)
+    release = threading.Event()
+    try:
+        # Единственное место в пуле занято долгой задачей
+        running = asyncio.create_task(overloaded.run(release.wait))
+        while overloaded.stats()['active'] < 1:
+            await asyncio.sleep(0.01)
+        response = await client.post(login, data=credentials)
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers['retry-after'] == '1'
+        assert overloaded.stats()['rejected'] == 1
+        release.set()
+        await running
+    finally:
+        release.set()
+        overloaded.shutdown()
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import random
+from typing import Dict, Optional
+from uuid import UUID
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy import select
+
+from core.settings import app_settings, DATA_DIR, UPLOAD_TMP_DIR
+from db.crud import crud_blob, crud_file, crud_usage, crud_user
+from db.crud import entities
+from db.models import Blob
+from db.session import async_session
+from utils.storage import blob_relpath
+from .conftest import (
+    download_file,
+    login_headers,
+    new_credentials,
+    post_upload,
+    register_user,
+    upload,
+    user_files
+)
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'blobs')
+
+
+@pytest.fixture(autouse=True)
+def dedup(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(app_settings, 'STORAGE_DEDUPLICATION', True)
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', None)
+
+
+def unique_content() -> bytes:
+    return f'blob {random.getrandbits(64)}\n'.encode() * 100
+
+
+async def get_blob(sha256: str) -> Optional[Blob]:
+    async with async_session() as db:
+        return await db.get(Blob, sha256)
+
+
+async def release_last_reference(
+    monkeypatch: pytest.MonkeyPatch,
+    file_id: str
+) -> str:
+    '''
+    Удаляет файл, но оставляет его содержимое, как удаление, прерванное
+    между commit и remove_unused. Возвращает sha256 содержимого.
+    '''
+    async def keep(db, sha256s):
+        return 0
+
+    with monkeypatch.context() as patch:
+        patch.setattr(crud_blob, 'remove_unused', keep)
+        async with async_session() as db:
+            file = await crud_file.get(db=db, fid=UUID(file_id))
+            assert await crud_file.delete(db=db, db_obj=file)
+    assert (await get_blob(file.blob_id)).refcount == 0
+    return file.blob_id
+
+
+async def download(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    file_id: str
+) -> bytes:
+    response = await client.get(
+        download_file, params={'file_id': file_id}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    return response.content
+
+
+async def files_count(client: AsyncClient, headers: Dict[str, str]) -> int:
+    response = await client.get(user_files, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()['files_count']
+
+
+async def test_upload_waits_for_blob_removal(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Загрузка во время удаления того же содержимого кладет его заново.'''
+    content = unique_content()
+    body = await upload(client, auth_headers, 'race/first.bin', content)
+    sha256 = await release_last_reference(monkeypatch, body['fid'])
+
+    async with async_session() as deleter:
+        # Удаление держит строку blob, пока убирает содержимое с диска
+        await deleter.execute(
+            select(Blob).where(Blob.sha256 == sha256).with_for_update()
+        )
+        uploading = asyncio.create_task(
+            upload(client, auth_headers, 'race/second.bin', content)
+        )
+        await asyncio.sleep(0.3)
+        assert not uploading.done()
+        assert await crud_blob.remove_unused(
+            db=deleter, sha256s=[sha256]
+        ) == 1
+    body = await uploading
+
+    assert (await get_blob(sha256)).refcount == 1
+    assert (DATA_DIR / blob_relpath(sha256)).read_bytes() == content
+    assert await download(client, auth_headers, body['fid']) == content
+
+
+async def test_remove_unused_rechecks_refcount(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Содержимое, на которое снова сослались, не удаляется.'''
+    content = unique_content()
+    body = await upload(client, auth_headers, 'race/third.bin', content)
+    sha256 = await release_last_reference(monkeypatch, body['fid'])
+
+    # Новая ссылка появилась между commit удаления и remove_unused
+    body = await upload(client, auth_headers, 'race/fourth.bin', content)
+    async with async_session() as db:
+        assert await crud_blob.remove_unused(db=db, sha256s=[sha256]) == 0
+
+    assert (await get_blob(sha256)).refcount == 1
+    assert await download(client, auth_headers, body['fid']) == content
+
+
+async def test_store_failure_creates_no_file(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Если содержимое не легло на диск, записи о файле нет.'''
+    store_blobs = entities.store_blobs
+
+    def failing_store(blobs, keep=True):
+        if keep:
+            raise OSError('No space left on device')
+        store_blobs(blobs, keep=keep)
+
+    monkeypatch.setattr(entities, 'store_blobs', failing_store)
+    files_before = await files_count(client, auth_headers)
+    tmp_before = set(UPLOAD_TMP_DIR.iterdir())
+    content = unique_content()
+    response = await post_upload(
+        client, auth_headers, 'failed/data.bin', content
+    )
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    # Временный файл удален, ссылка на содержимое не создана
+    assert set(UPLOAD_TMP_DIR.iterdir()) <= tmp_before
+
+    digest = hashlib.sha256(content).hexdigest()
+    assert await get_blob(digest) is None
+    assert not (DATA_DIR / blob_relpath(digest)).exists()
+    assert await files_count(client, auth_headers) == files_before
+
+
+async def test_delete_user_releases_blobs(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Удаление пользователя снимает ссылки его файлов на содержимое.'''
+    credentials = new_credentials('blobsgone')
+    headers = await login_headers(client, credentials)
+    shared, own = unique_content(), unique_content()
+    await upload(client, headers, 'shared/one.bin', shared)
+    await upload(client, headers, 'shared/two.bin', shared)
+    own_body = await upload(client, headers, 'own/data.bin', own)
+    kept = await upload(client, auth_headers, 'shared/kept.bin', shared)
+
+    monkeypatch.setattr(app_settings, 'STORAGE_DEDUPLICATION', False)
+    monkeypatch.setattr(app_settings, 'STORAGE_LAYOUT', 'sharded')
+    sharded_body = await upload(client, headers, 'own/sharded.bin', own)
+
+    invalidated = []
+
+    async def invalidate(files, extra_keys=()):
+        invalidated.extend(file.fid for file in files)
+
+    monkeypatch.setattr(entities.file_cache, 'invalidate', invalidate)
+    async with async_session() as db:
+        shared_blob = (await crud_file.get(
+            db=db, fid=UUID(kept['fid'])
+        )).blob_id
+        own_blob = (await crud_file.get(
+            db=db, fid=UUID(own_body['fid'])
+        )).blob_id
+        location = (await crud_file.get(
+            db=db, fid=UUID(sharded_body['fid'])
+        )).location
+        user = await crud_user.get_by_username(
+            db=db, username=credentials['username']
+        )
+        assert (await get_blob(shared_blob)).refcount == 3
+        assert await crud_user.delete(db=db, db_obj=user)
+
+    assert (await get_blob(shared_blob)).refcount == 1
+    assert await get_blob(own_blob) is None
+    assert not (DATA_DIR / blob_relpath(own_blob)).exists()
+    assert not (DATA_DIR / location).exists()
+    # Записи о файлах пользователя сброшены из кэша
+    assert {UUID(own_body['fid']), UUID(sharded_body['fid'])} <= set(
+        invalidated
+    )
+    assert len(invalidated) == 4
+    async with async_session() as db:
+        assert await crud_usage.get(db=db, user_id=user.uid) is None
+    assert await download(client, auth_headers, kept['fid']) == shared
@@ -0,0 +1,372 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from uuid import uuid4
+
+import pytest
+from httpx import AsyncClient
+from redis.exceptions import ConnectionError
+
+from db.crud import crud_user
+from db.models import File
+from db.session import async_session
+from schemas.users import UserPrincipal, UserUpdate
+from utils import cache
+from utils.auth import hash_password
+from utils.cache import FileCache, PrincipalCache
+from .conftest import login_headers, new_credentials, user_files
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+class FakeRedis:
+    '''Redis в памяти с командами, которые использует кэш.'''
+
+    def __init__(self):
+        self.data: Dict[str, bytes] = {}
+        self.down = False
+
+    def check(self) -> None:
+        if self.down:
+            raise ConnectionError('Connection refused')
+
+    async def get(self, key: str) -> Optional[bytes]:
+        self.check()
+        return self.data.get(key)
+
+    async def setex(self, key: str, ttl, value) -> None:
+        self.check()
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    async def delete(self, *keys: str) -> None:
+        self.check()
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self, transaction: bool = True) -> 'FakePipeline':
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    '''Пачка команд FakeRedis, выполняется в execute.'''
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self) -> 'FakePipeline':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.commands = []
+
+    def setex(self, key: str, ttl, value) -> None:
+        self.commands.append((key, ttl, value))
+
+    async def execute(self) -> None:
+        for command in self.commands:
+            await self.redis.setex(*command)
+
+
+class CountingLoader:
+    '''Загрузчик, который считает вызовы и может ждать сигнала.'''
+
+    def __init__(self, result=None):
+        self.result = result
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.result
+
+
+@pytest.fixture
+def redis(monkeypatch: pytest.MonkeyPatch) -> FakeRedis:
+    fake = FakeRedis()
+    monkeypatch.setattr(cache, 'get_redis', lambda: fake)
+    return fake
+
+
+def make_file(**fields) -> File:
+    defaults = {
+        'fid': uuid4(),
+        'name': 'a.txt',
+        'created': datetime(2024, 1, 1),
+        'path': f'cache/{uuid4().hex}/a.txt',
+        'size': 5.0,
+        'extension': 'txt',
+        'user_id': uuid4(),
+    }
+    return File(**(defaults | fields))
+
+
+def file_cache() -> FileCache:
+    return FileCache(ttl=timedelta(days=1), negative_ttl=timedelta(seconds=5))
+
+
+async def test_file_cache_hit(redis: FakeRedis):
+    files = file_cache()
+    file = make_file()
+    loader = CountingLoader(file)
+    key = files.id_key(file.fid)
+
+    first = await files.get_or_load(key, loader)
+    second = await files.get_or_load(key, loader)
+    assert first == second
+    assert (second.fid, second.path) == (file.fid, file.path)
+    assert loader.calls == 1
+    assert files.stats()['hits'] == 1 and files.stats()['misses'] == 1
+
+
+async def test_file_cache_single_flight(redis: FakeRedis):
+    '''Одновременные промахи по ключу дают один запрос в базу.'''
+    files = file_cache()
+    loader = CountingLoader(make_file())
+    loader.release.clear()
+    key = files.path_key('cache/coalesced.txt')
+
+    tasks = [
+        asyncio.create_task(files.get_or_load(key, loader))
+        for _ in range(10)
+    ]
+    await asyncio.sleep(0.01)
+    loader.release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert loader.calls == 1
+    assert all(result == results[0] for result in results)
+    assert files.stats()['coalesced'] == 9
+    assert key not in files._inflight
+
+
+async def test_file_cache_single_flight_error(redis: FakeRedis):
+    '''Ошибку загрузки получают все ожидающие, следующий вызов повторяет.'''
+    files = file_cache()
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise RuntimeError('db is down')
+
+    key = files.id_key(uuid4())
+    tasks = [
+        asyncio.create_task(files.get_or_load(key, failing))
+        for _ in range(3)
+    ]
+    await asyncio.sleep(0.01)
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    loader = CountingLoader(make_file())
+    assert await files.get_or_load(key, loader) is not None
+    assert loader.calls == 1
+
+
+async def test_file_cache_negative(redis: FakeRedis):
+    '''Отсутствие файла кэшируется отдельной отметкой.'''
+    files = file_cache()
+    loader = CountingLoader(None)
+    key = files.path_key('cache/missing.txt')
+
+    assert await files.get_or_load(key, loader) is None
+    assert await files.get_or_load(key, loader) is None
+    assert loader.calls == 1
+    assert redis.data[key] == cache.MISSING
+    assert files.stats()['negative_hits'] == 1
+
+
+async def test_file_cache_invalidate(redis: FakeRedis):
+    '''После удаления или изменения файла запись загружается заново.'''
+    files = file_cache()
+    file = make_file()
+    id_key, path_key = files.id_key(file.fid), files.path_key(file.path)
+    await files.get_or_load(id_key, CountingLoader(file))
+    await files.get_or_load(path_key, CountingLoader(file))
+
+    # Изменение: запись сбрасывается по id и по старому пути
+    renamed = make_file(fid=file.fid, path='cache/renamed.txt')
+    await files.invalidate([renamed], extra_keys=[path_key])
+    assert id_key not in redis.data and path_key not in redis.data
+    loader = CountingLoader(renamed)
+    record = await files.get_or_load(id_key, loader)
+    assert record.path == 'cache/renamed.txt' and loader.calls == 1
+
+    # Удаление: следующий запрос видит отсутствие файла
+    await files.invalidate([renamed])
+    loader = CountingLoader(None)
+    assert await files.get_or_load(id_key, loader) is None
+    assert loader.calls == 1
+
+
+async def test_file_cache_redis_down(redis: FakeRedis):
+    '''Без Redis запросы идут в базу, ошибки не доходят до вызывающего.'''
+    files = file_cache()
+    redis.down = True
+    file = make_file()
+    loader = CountingLoader(file)
+    key = files.id_key(file.fid)
+
+    assert (await files.get_or_load(key, loader)).fid == file.fid
+    assert (await files.get_or_load(key, loader)).fid == file.fid
+    assert loader.calls == 2
+    await files.invalidate([file])
+    assert await files.preload([file]) == 0
+    assert files.stats()['errors'] == 6
+
+    # Redis вернулся: кэш снова работает
+    redis.down = False
+    await files.get_or_load(key, loader)
+    await files.get_or_load(key, loader)
+    assert loader.calls == 3
+
+
+def make_principal(username: str = 'cached') -> UserPrincipal:
+    return UserPrincipal(uid=uuid4(), username=username)
+
+
+async def test_principal_cache_local_hit(redis: FakeRedis):
+    principals = PrincipalCache(ttl=60, max_size=10, use_redis=False)
+    loader = CountingLoader(make_principal())
+
+    first = await principals.get_or_load('cached', loader)
+    assert await principals.get_or_load('cached', loader) == first
+    assert loader.calls == 1
+    assert principals.stats() == {
+        'size': 1, 'hits': 1, 'redis_hits': 0, 'misses': 1, 'errors': 0
+    }
+    # Без use_redis второй уровень не трогается
+    assert redis.data == {}
+
+
+async def test_principal_cache_redis_tier(redis: FakeRedis):
+    '''Запись, загруженная одним воркером, видна другому через Redis.'''
+    first = PrincipalCache(ttl=60, max_size=10, use_redis=True)
+    second = PrincipalCache(ttl=60, max_size=10, use_redis=True)
+    principal = make_principal()
+    await first.get_or_load('cached', CountingLoader(principal))
+    assert PrincipalCache.key('cached') in redis.data
+
+    loader = CountingLoader(None)
+    assert await second.get_or_load('cached', loader) == principal
+    assert await second.get_or_load('cached', loader) == principal
+    assert loader.calls == 0
+    assert second.stats()['redis_hits'] == 1
+    assert second.stats()['hits'] == 1
+
+
+async def test_principal_cache_expiry(
+    redis: FakeRedis,
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''По истечении ttl пользователь загружается заново.'''
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    principals = PrincipalCache(ttl=60, max_size=10, use_redis=False)
+    loader = CountingLoader(make_principal())
+
+    await principals.get_or_load('cached', loader)
+    now[0] += 59
+    await principals.get_or_load('cached', loader)
+    assert loader.calls == 1
+    now[0] += 2
+    await principals.get_or_load('cached', loader)
+    assert loader.calls == 2
+
+
+async def test_principal_cache_max_size(redis: FakeRedis):
+    '''При переполнении вытесняется давно не использованная запись.'''
+    principals = PrincipalCache(ttl=60, max_size=2, use_redis=False)
+    for username in ('first', 'second'):
+        await principals.get_or_load(
+            username, CountingLoader(make_principal(username))
+        )
+    await principals.get_or_load('first', CountingLoader(None))
+    await principals.get_or_load(
+        'third', CountingLoader(make_principal('third'))
+    )
+
+    assert principals.stats()['size'] == 2
+    loader = CountingLoader(None)
+    assert await principals.get_or_load('first', loader) is not None
+    assert await principals.get_or_load('second', loader) is None
+    assert loader.calls == 1
+
+
+async def test_principal_cache_invalidate(redis: FakeRedis):
+    principals = PrincipalCache(ttl=60, max_size=10, use_redis=True)
+    await principals.get_or_load('cached', CountingLoader(make_principal()))
+    await principals.invalidate('cached')
+    assert redis.data == {}
+
+    # Удаленный пользователь не кэшируется и не проходит авторизацию
+    loader = CountingLoader(None)
+    assert await principals.get_or_load('cached', loader) is None
+    assert await principals.get_or_load('cached', loader) is None
+    assert loader.calls == 2
+
+
+async def test_principal_cache_redis_down(redis: FakeRedis):
+    principals = PrincipalCache(ttl=60, max_size=10, use_redis=True)
+    redis.down = True
+    loader = CountingLoader(make_principal())
+
+    assert await principals.get_or_load('cached', loader) is not None
+    assert await principals.get_or_load('cached', loader) is not None
+    assert loader.calls == 1
+    await principals.invalidate('cached')
+    assert principals.stats()['errors'] == 3
+
+
+async def test_principal_cache_user_changes(
+    client: AsyncClient,
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Изменение и удаление пользователя сбрасывают его запись в кэше.'''
+    principals = PrincipalCache(ttl=60, max_size=10, use_redis=False)
+    monkeypatch.setattr('utils.auth.principal_cache', principals)
+    monkeypatch.setattr('db.crud.entities.principal_cache', principals)
+    credentials = new_credentials('principal')
+    headers = await login_headers(client, credentials)
+    response = await client.get(user_files, headers=headers)
+    assert response.status_code == 200
+    assert principals.stats()['size'] == 1
+
+    username = credentials['username']
+    async with async_session() as db:
+        user = await crud_user.get_by_username(db=db, username=username)
+        # Смена пароля
+        user = await crud_user.update(
+            db=db, db_obj=user, data_in=UserUpdate(
+                username=username, password=hash_password('Changeme2!')
+            )
+        )
+        assert principals.stats()['size'] == 0
+        response = await client.get(user_files, headers=headers)
+        assert response.status_code == 200
+        assert principals.stats()['misses'] == 2
+
+        # Смена имени
+        user = await crud_user.update(
+            db=db, db_obj=user, data_in=UserUpdate(
+                username=f'{username}x', password=user.password
+            )
+        )
+        assert principals.stats()['size'] == 0
+        # Токен со старым именем больше не действует
+        response = await client.get(user_files, headers=headers)
+        assert response.status_code == 401
+
+        headers = await login_headers(
+            client, {'username': user.username, 'password': 'Changeme2!'}
+        )
+        response = await client.get(user_files, headers=headers)
+        assert response.status_code == 200
+        assert principals.stats()['size'] == 1
+        assert await crud_user.delete(db=db, db_obj=user)
+    assert principals.stats()['size'] == 0
+    response = await client.get(user_files, headers=headers)
+    assert response.status_code == 401
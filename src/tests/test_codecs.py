@@ -0,0 +1,201 @@
+import gzip
+import hashlib
+import io
+import random
+import zipfile
+from typing import Dict
+from uuid import UUID
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+
+from core.settings import app_settings, DATA_DIR
+from db.crud import crud_file
+from db.session import async_session
+from utils.codecs import CODECS, choose_codec
+from utils.responses import accepts_encoding
+from utils.storage import file_location
+from .conftest import (
+    archive,
+    download_file,
+    register_user,
+    upload,
+    uploads
+)
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'codecs')
+
+
+def csv_content() -> bytes:
+    # Уникальное содержимое, чтобы не совпасть с файлами прошлых запусков
+    header = f'id,value,{random.getrandbits(64)}\n'.encode()
+    return header + b''.join(
+        f'{number},{number * 7 % 13}\n'.encode() for number in range(5000)
+    )
+
+
+async def test_accepts_encoding():
+    assert accepts_encoding('gzip, deflate, br', 'gzip')
+    assert accepts_encoding('br;q=1.0, *;q=0.5', 'zstd')
+    assert not accepts_encoding('gzip;q=0, *', 'gzip')
+    assert not accepts_encoding('identity', 'gzip')
+    assert not accepts_encoding(None, 'gzip')
+
+
+async def test_choose_codec(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', 'gzip')
+    assert choose_codec('CSV', b'') == 'gzip'
+    assert choose_codec('jpg', b'a' * 1000) is None
+    assert choose_codec('bin', b'a' * 1000) == 'gzip'
+    # Случайные байты не сжимаются
+    assert choose_codec('bin', random.randbytes(1000)) is None
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', None)
+    assert choose_codec('csv', b'a' * 1000) is None
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'zstd'])
+async def test_compressed_download(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+    codec: str
+):
+    if codec not in CODECS:
+        pytest.skip(f'{codec} is unavailable')
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', codec)
+    content = csv_content()
+    body = await upload(client, auth_headers, f'{codec}/data.csv', content)
+    assert body['size'] == len(content)
+
+    async with async_session() as db:
+        file = await crud_file.get(db=db, fid=UUID(body['fid']))
+    assert file.codec == codec
+    stored = DATA_DIR / file_location(file)
+    assert stored.stat().st_size < len(content) / 2
+
+    # Клиент принимает кодек: байты с диска как есть
+    async with client.stream(
+        'GET',
+        download_file,
+        params={'file_id': body['fid']},
+        headers=auth_headers | {'Accept-Encoding': f'{codec}, br'}
+    ) as response:
+        raw = b''.join([chunk async for chunk in response.aiter_raw()])
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-encoding'] == codec
+    assert response.headers['vary'] == 'Accept-Encoding'
+    # У сжатого и исходного представлений разные ETag
+    assert response.headers['etag'].endswith(f'-{codec}"')
+    assert raw == stored.read_bytes()
+
+    # Не принимает: распаковка на лету
+    response = await client.get(
+        download_file,
+        params={'file_id': body['fid']},
+        headers=auth_headers | {'Accept-Encoding': 'identity'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert 'content-encoding' not in response.headers
+    assert response.headers['etag'] == f'"{file.blob_id}"'
+    assert response.headers['content-length'] == str(len(content))
+    assert response.content == content
+
+
+async def test_incompressible_stored_as_is(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', 'gzip')
+    body = await upload(
+        client, auth_headers, 'plain/photo.jpg', csv_content()
+    )
+    async with async_session() as db:
+        file = await crud_file.get(db=db, fid=UUID(body['fid']))
+    assert file.codec is None
+
+
+async def test_duplicate_keeps_stored_codec(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Повторная загрузка того же содержимого ссылается на сжатый blob.'''
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', 'gzip')
+    content = csv_content()
+    await upload(client, auth_headers, 'dup/first.csv', content)
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', None)
+    body = await upload(client, auth_headers, 'dup/second.csv', content)
+
+    async with async_session() as db:
+        file = await crud_file.get(db=db, fid=UUID(body['fid']))
+    assert file.codec == 'gzip'
+    response = await client.get(
+        download_file,
+        params={'file_id': body['fid']},
+        headers=auth_headers | {'Accept-Encoding': 'gzip'}
+    )
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.content == content
+
+
+async def test_archive_decodes_files(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', 'gzip')
+    content = csv_content()
+    await upload(client, auth_headers, 'archived/data.csv', content)
+
+    response = await client.get(
+        archive, params={'path': 'archived'}, headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archived:
+        assert archived.read('data.csv') == content
+    # Сам архив не сжимается кодеком хранилища
+    assert 'content-encoding' not in response.headers
+
+
+async def test_multipart_upload_compressed(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', 'gzip')
+    content = csv_content()
+    half = len(content) // 2
+    response = await client.post(
+        uploads, params={'path': 'parts/data.csv'}, headers=auth_headers
+    )
+    sid = response.json()['sid']
+    for number, part in enumerate((content[:half], content[half:]), 1):
+        response = await client.put(
+            f'{uploads}/{sid}/parts/{number}',
+            files={'file': ('part', part)},
+            headers=auth_headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+    response = await client.post(
+        f'{uploads}/{sid}/complete', headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body['size'] == len(content)
+
+    async with async_session() as db:
+        file = await crud_file.get(db=db, fid=UUID(body['fid']))
+    assert file.codec == 'gzip'
+    # sha256 считается по исходному содержимому
+    assert file.blob_id == hashlib.sha256(content).hexdigest()
+    stored = DATA_DIR / file_location(file)
+    assert gzip.decompress(stored.read_bytes()) == content
@@ -0,0 +1,121 @@
+import hashlib
+import random
+from typing import Dict
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+
+from core.settings import app_settings
+from .conftest import download_file, register_user, upload
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+CONTENT = f'conditional {random.getrandbits(64)}\n'.encode() * 100
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'conditional')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def file_id(client: AsyncClient, auth_headers: Dict[str, str]) -> str:
+    '''id загруженного файла с содержимым CONTENT.'''
+    body = await upload(client, auth_headers, 'photos/sync.bin', CONTENT)
+    return body['fid']
+
+
+async def download(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    file_id: str,
+    **extra: str
+):
+    return await client.get(
+        download_file,
+        params={'file_id': file_id},
+        headers=headers | extra
+    )
+
+
+async def test_validators(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    file_id: str
+):
+    response = await download(client, auth_headers, file_id)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == CONTENT
+    if app_settings.STORAGE_DEDUPLICATION:
+        digest = hashlib.sha256(CONTENT).hexdigest()
+        assert response.headers['etag'] == f'"{digest}"'
+    assert response.headers['last-modified'].endswith(' GMT')
+    assert response.headers['cache-control'] == 'private, no-cache'
+
+
+async def test_if_none_match(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    file_id: str
+):
+    etag = (await download(client, auth_headers, file_id)).headers['etag']
+
+    response = await download(
+        client, auth_headers, file_id,
+        **{'If-None-Match': f'"other", W/{etag}'}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+
+    response = await download(
+        client, auth_headers, file_id, **{'If-None-Match': '"other"'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == CONTENT
+
+
+async def test_if_modified_since(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    file_id: str
+):
+    response = await download(client, auth_headers, file_id)
+    last_modified = response.headers['last-modified']
+
+    response = await download(
+        client, auth_headers, file_id,
+        **{'If-Modified-Since': last_modified}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    response = await download(
+        client, auth_headers, file_id,
+        **{'If-Modified-Since': 'Thu, 01 Jan 2015 00:00:00 GMT'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    # If-None-Match важнее If-Modified-Since
+    response = await download(
+        client, auth_headers, file_id,
+        **{'If-Modified-Since': last_modified, 'If-None-Match': '"other"'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
+async def test_cache_control_by_path(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    file_id: str,
+    monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(
+        app_settings,
+        'DOWNLOAD_CACHE_CONTROL',
+        {'docs/*': 'no-store', 'photos/*': 'private, max-age=86400'}
+    )
+    response = await download(client, auth_headers, file_id)
+    assert response.headers['cache-control'] == 'private, max-age=86400'
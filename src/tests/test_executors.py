@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import pytest
+
+from core.executors import ExecutorOverloaded, InstrumentedExecutor
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+def make_executor(**kwargs) -> InstrumentedExecutor:
+    # Создается вне цикла событий, как пулы приложения при импорте
+    return InstrumentedExecutor(name='test', max_workers=2, **kwargs)
+
+
+async def test_run_and_stats():
+    executor = make_executor()
+    try:
+        results = await asyncio.gather(
+            *(executor.run(lambda n=n: n * 2) for n in range(10))
+        )
+        assert results == [n * 2 for n in range(10)]
+        stats = executor.stats()
+        assert stats['completed'] == 10
+        assert stats['queued'] == 0 and stats['active'] == 0
+        assert stats['rejected'] == 0
+        assert stats['wait_time_max'] >= stats['wait_time_avg'] >= 0
+    finally:
+        executor.shutdown()
+
+
+async def test_run_raises_task_error():
+    executor = make_executor()
+
+    def fail() -> None:
+        raise ValueError('broken')
+
+    try:
+        with pytest.raises(ValueError):
+            await executor.run(fail)
+        assert executor.stats()['completed'] == 1
+    finally:
+        executor.shutdown()
+
+
+async def test_active_and_queued():
+    executor = make_executor()
+    release = threading.Event()
+    try:
+        tasks = [
+            asyncio.create_task(executor.run(release.wait))
+            for _ in range(3)
+        ]
+        while executor.stats()['active'] < 2:
+            await asyncio.sleep(0.01)
+        # Два воркера заняты, третья задача ждет в очереди пула
+        assert executor.stats()['queued'] == 1
+        release.set()
+        await asyncio.gather(*tasks)
+        assert executor.stats()['completed'] == 3
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+async def test_overloaded_rejects():
+    executor = make_executor(max_concurrency=1, queue_timeout=0.05)
+    # Семафор создается при запуске пула, а не при создании объекта
+    assert executor._semaphore is None
+    release = threading.Event()
+    try:
+        running = asyncio.create_task(executor.run(release.wait))
+        while executor.stats()['active'] < 1:
+            await asyncio.sleep(0.01)
+        with pytest.raises(ExecutorOverloaded):
+            await executor.run(lambda: None)
+        assert executor.stats()['rejected'] == 1
+        release.set()
+        await running
+        # Место освободилось: следующая задача выполняется
+        assert await executor.run(lambda: 'ok') == 'ok'
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+async def test_restart_after_shutdown():
+    executor = make_executor(max_concurrency=1, queue_timeout=1)
+    await executor.run(lambda: None)
+    executor.shutdown()
+    assert not executor.started
+    assert await executor.run(lambda: 'again') == 'again'
+    executor.shutdown()
@@ -0,0 +1,172 @@
+import errno
+import random
+from pathlib import Path
+from typing import Dict, List
+from uuid import UUID
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+
+from commands.relocate_files import relocate_batch
+from core.settings import app_settings, DATA_DIR
+from db.crud import crud_file
+from db.session import async_session
+from utils import storage
+from utils.storage import file_location, sharded_relpath
+from .conftest import (
+    download_file,
+    post_upload,
+    register_user,
+    upload,
+    upload_batch
+)
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'layout')
+
+
+@pytest.fixture
+def no_dedup(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(app_settings, 'STORAGE_DEDUPLICATION', False)
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', None)
+
+
+async def download(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    fid: str
+) -> bytes:
+    response = await client.get(
+        download_file, params={'file_id': fid}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    return response.content
+
+
+async def test_sharded_upload(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+    no_dedup: None
+):
+    monkeypatch.setattr(app_settings, 'STORAGE_LAYOUT', 'sharded')
+    content = random.randbytes(1000)
+    body = await upload(client, auth_headers, 'deep/dir/one.bin', content)
+    fid = UUID(body['fid'])
+    user_dir = DATA_DIR / body['path'].split('/')[0]
+
+    async with async_session() as db:
+        file = await crud_file.get(db=db, fid=fid)
+    assert file.location == sharded_relpath(fid)
+    assert file_location(file) == (
+        f'.files/{fid.hex[:2]}/{fid.hex[2:4]}/{fid.hex}'
+    )
+    assert (DATA_DIR / file.location).read_bytes() == content
+    # Директории пути пользователя на диске не создаются
+    assert not (user_dir / 'deep').exists()
+    assert await download(client, auth_headers, body['fid']) == content
+
+    # Повторная загрузка по тому же пути не затирает прежний файл
+    again = await upload(client, auth_headers, 'deep/dir/one.bin', b'new')
+    assert await download(client, auth_headers, body['fid']) == content
+    assert await download(client, auth_headers, again['fid']) == b'new'
+
+    async with async_session() as db:
+        assert await crud_file.delete(db=db, db_obj=file)
+    assert not (DATA_DIR / file.location).exists()
+
+
+async def test_sharded_batch_upload(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+    no_dedup: None
+):
+    monkeypatch.setattr(app_settings, 'STORAGE_LAYOUT', 'sharded')
+    contents = {f'{n}.bin': random.randbytes(100) for n in range(3)}
+    response = await client.post(
+        upload_batch,
+        params={'path': 'batch'},
+        files=[('files', (name, data)) for name, data in contents.items()],
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    for result in response.json():
+        fid = UUID(result['file']['fid'])
+        stored = DATA_DIR / sharded_relpath(fid)
+        assert stored.read_bytes() == contents[result['filename']]
+
+
+async def test_relocate_files(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+    no_dedup: None
+):
+    monkeypatch.setattr(app_settings, 'STORAGE_LAYOUT', 'user')
+    content = random.randbytes(1000)
+    first = await upload(client, auth_headers, 'old/same.bin', b'old')
+    second = await upload(client, auth_headers, 'old/same.bin', content)
+    other = await upload(client, auth_headers, 'old/other.bin', b'other')
+    source = DATA_DIR / second['path']
+    assert source.read_bytes() == content
+
+    async with async_session() as db:
+        files = [
+            await crud_file.get(db=db, fid=UUID(body['fid']))
+            for body in (first, second, other)
+        ]
+    assert all(file.location is None for file in files)
+
+    # Путь, по которому читается еще не перенесенный файл, остается
+    assert await relocate_batch(files[:1], grace=0) == (1, 0)
+    assert source.exists()
+    assert await relocate_batch(files[1:], grace=0) == (2, 0)
+    assert not source.exists()
+    # Опустевшая директория из пути пользователя удалена
+    assert not source.parent.exists()
+
+    for body in (second, other):
+        async with async_session() as db:
+            file = await crud_file.get(db=db, fid=UUID(body['fid']))
+        assert file.location == sharded_relpath(file.fid)
+    # Оба файла по одному пути читали последнее содержимое
+    assert await download(client, auth_headers, first['fid']) == content
+    assert await download(client, auth_headers, second['fid']) == content
+    assert await download(client, auth_headers, other['fid']) == b'other'
+
+
+@pytest.mark.parametrize('dedup,layout', [
+    (False, 'user'), (False, 'sharded'), (True, 'user')
+])
+async def test_upload_disk_full(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+    dedup: bool,
+    layout: str
+):
+    '''Ошибка записи на диск дает 500 и не оставляет частей файла.'''
+    monkeypatch.setattr(app_settings, 'STORAGE_DEDUPLICATION', dedup)
+    monkeypatch.setattr(app_settings, 'STORAGE_LAYOUT', layout)
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', None)
+    written: List[Path] = []
+
+    def disk_full(filepath: Path, stream, chunk_size, **kwargs) -> int:
+        written.append(Path(filepath))
+        Path(filepath).write_bytes(stream.read(chunk_size))
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(storage, 'write_stream', disk_full)
+    response = await post_upload(
+        client, auth_headers, f'full/{layout}{dedup}.bin', b'x' * 1000
+    )
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    assert len(written) == 1 and not written[0].exists()
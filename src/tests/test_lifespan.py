@@ -0,0 +1,40 @@
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from starlette.formparsers import MultiPartParser
+
+from core.settings import app_settings
+from db.session import pool_stats
+from .conftest import app
+
+ready_url = '/api/internal/ready'
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+async def test_ready_after_warmup(client: AsyncClient):
+    response = await client.get(ready_url)
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.json()['status'] == 'warming'
+
+    async with app.router.lifespan_context(app):
+        # Прогрев открыл соединения заранее, они ждут в пуле
+        assert pool_stats.stats()['idle'] >= min(
+            app_settings.WARMUP_DB_CONNECTIONS, app_settings.DB_POOL_SIZE
+        )
+        response = await client.get(ready_url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()['status'] == 'ok'
+
+    response = await client.get(ready_url)
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+async def test_spool_size_restored():
+    default = MultiPartParser.max_file_size
+    async with app.router.lifespan_context(app):
+        assert (
+            MultiPartParser.max_file_size
+            == app_settings.UPLOAD_SPOOL_MAX_SIZE
+        )
+    assert MultiPartParser.max_file_size == default
@@ -0,0 +1,97 @@
+import io
+import logging
+import sys
+
+import orjson
+import pytest
+
+from core.logger import (
+    JsonFormatter,
+    LogQueueHandler,
+    SamplingFilter,
+    start_log_queue,
+    stop_log_queue
+)
+from core.settings import app_settings
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+def make_record(name: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord(
+        name, level, __file__, 1, 'user %s uploaded %d bytes',
+        ('alice', 10), None
+    )
+
+
+async def test_sampling_filter_rates():
+    sampling = SamplingFilter({'db.crud': 0.0, 'uvicorn': 1.0})
+    # Доля действует и на дочерние логеры
+    assert not sampling.filter(make_record('db.crud.entities'))
+    assert sampling.filter(make_record('uvicorn.access'))
+    # Логеры вне rates не прореживаются
+    assert sampling.filter(make_record('db.crudite'))
+    assert sampling.filter(make_record('api'))
+    # Предупреждения и ошибки проходят всегда
+    assert sampling.filter(make_record('db.crud', logging.WARNING))
+    assert sampling.filter(make_record('db.crud', logging.ERROR))
+
+
+async def test_sampling_filter_share():
+    sampling = SamplingFilter({'db': 0.1})
+    passed = sum(
+        sampling.filter(make_record('db.crud')) for _ in range(10000)
+    )
+    assert 500 < passed < 1500
+
+
+async def test_json_formatter():
+    record = make_record('db.crud', logging.ERROR)
+    entry = orjson.loads(JsonFormatter().format(record))
+    assert entry['level'] == 'ERROR'
+    assert entry['logger'] == 'db.crud'
+    assert entry['message'] == 'user alice uploaded 10 bytes'
+    assert 'time' in entry and 'exc_info' not in entry
+
+
+async def test_queue_keeps_exception_text():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    try:
+        raise ValueError('broken')
+    except ValueError:
+        record = logging.LogRecord(
+            'db.crud', logging.ERROR, __file__, 1, 'failed %s', ('x',),
+            sys.exc_info()
+        )
+    prepared = LogQueueHandler(None).prepare(record)
+    assert prepared.args is None and prepared.exc_info is None
+    handler.handle(prepared)
+    entry = orjson.loads(stream.getvalue())
+    assert entry['message'] == 'failed x'
+    assert 'ValueError: broken' in entry['exc_info']
+
+
+async def test_log_queue_swaps_handlers(monkeypatch):
+    monkeypatch.setattr(app_settings, 'LOG_SAMPLING', {'db.crud': 0.0})
+    root = logging.getLogger()
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handlers, level = list(root.handlers), root.level
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    try:
+        start_log_queue()
+        assert [type(h) for h in root.handlers] == [LogQueueHandler]
+        logging.getLogger('db.crud').info('dropped')
+        logging.getLogger('db.crud').warning('kept %s', 'warning')
+        logging.getLogger('api').info('kept %s', 'info')
+        stop_log_queue()
+        assert root.handlers == [handler]
+    finally:
+        stop_log_queue()
+        root.handlers = handlers
+        root.setLevel(level)
+    lines = stream.getvalue().splitlines()
+    assert lines == ['kept warning', 'kept info']
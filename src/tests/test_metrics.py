@@ -0,0 +1,71 @@
+import random
+from typing import Dict
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+
+from core.metrics import StatsCollector, register_collector
+from .conftest import download_file, register_user, upload
+
+metrics = '/metrics'
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'metrics')
+
+
+def sample(text: str, name: str) -> float:
+    '''Значение ряда name из ответа /metrics.'''
+    for line in text.splitlines():
+        if line.startswith(f'{name} '):
+            return float(line.split()[-1])
+    return 0.0
+
+
+async def test_metrics(client: AsyncClient, auth_headers: Dict[str, str]):
+    before = (await client.get(metrics)).text
+    content = f'metrics {random.getrandbits(64)}\n'.encode() * 100
+    body = await upload(client, auth_headers, 'metrics/data.bin', content)
+    response = await client.get(
+        download_file,
+        params={'file_id': body['fid']},
+        headers=auth_headers | {'Accept-Encoding': 'identity'}
+    )
+    assert response.content == content
+
+    response = await client.get(metrics)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'].startswith('text/plain')
+    text = response.text
+    # Метка - шаблон маршрута, а не путь запроса
+    assert (
+        'http_request_duration_seconds_count{method="POST",'
+        'route="/api/files/upload",status="200"}'
+    ) in text
+    assert 'db_query_duration_seconds_count{operation="SELECT"}' in text
+    assert 'executor_queued{executor="io"}' in text
+    assert 'cache_hits_total{cache="file"}' in text
+    assert 'db_pool_checkouts_total{pool="default"}' in text
+    assert (
+        sample(text, 'storage_upload_bytes_total')
+        - sample(before, 'storage_upload_bytes_total')
+    ) >= len(content)
+
+
+async def test_unmatched_route(client: AsyncClient):
+    await client.get(f'/no-such-path/{random.getrandbits(32)}')
+    text = (await client.get(metrics)).text
+    assert 'route="unmatched"' in text
+
+
+async def test_register_collector_twice():
+    '''Повторный импорт main в воркере uvicorn не ломает реестр.'''
+    collector = StatsCollector('executor', 'executor', lambda: {})
+    register_collector(collector)
+    register_collector(collector)
@@ -0,0 +1,96 @@
+from typing import Any, AsyncGenerator
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from core.settings import SA_URL
+from db.pool import PoolStats, instrumented_pool
+from db.session import get_session
+from utils import auth
+from utils.cache import PrincipalCache
+from .conftest import app, user_files
+
+stats_url = '/api/internal/stats'
+health_url = '/api/internal/health'
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+async def test_health_and_stats(client: AsyncClient):
+    response = await client.get(health_url)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['status'] == 'ok'
+
+    pool = (await client.get(stats_url)).json()['db_pool']
+    assert pool['checkouts'] >= 1
+    assert pool['checked_out'] == 0
+    assert pool['idle'] >= 1
+    assert pool['timeouts'] == 0
+
+
+async def test_pool_timeout_and_invalidation():
+    '''Исчерпанный пул быстро отказывает, отказ виден в метриках.'''
+    stats = PoolStats()
+    engine = create_async_engine(
+        SA_URL,
+        poolclass=instrumented_pool(stats),
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1
+    )
+    stats.listen(engine.sync_engine)
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text('SELECT 1'))
+            with pytest.raises(exc.TimeoutError):
+                async with engine.connect():
+                    pass
+            await conn.invalidate()
+        result = stats.stats()
+        assert result['checkouts'] == 1
+        assert result['timeouts'] == 1
+        assert result['connects'] == 1
+        assert result['invalidations'] == 1
+        assert result['wait_time_max'] > 0
+    finally:
+        await engine.dispose()
+
+
+async def test_pool_timeout_response(
+    client: AsyncClient,
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Обработчик отвечает 503, а не 401, когда пул соединений исчерпан.'''
+    engine = create_async_engine(
+        SA_URL, pool_size=1, max_overflow=0, pool_timeout=0.1
+    )
+    session = sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+    async def get_busy_session() -> AsyncGenerator[AsyncSession, Any]:
+        async with session() as db:
+            yield db
+
+    # Пользователь не в кэше: авторизация идет в базу
+    monkeypatch.setattr(
+        auth, 'principal_cache',
+        PrincipalCache(ttl=60, max_size=10, use_redis=False)
+    )
+    monkeypatch.setitem(
+        app.dependency_overrides, get_session, get_busy_session
+    )
+    headers = {
+        'Authorization': f'Bearer {auth.create_access_token({"sub": "x"})}'
+    }
+    try:
+        async with engine.connect():
+            response = await client.get(user_files, headers=headers)
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers['retry-after'] == '1'
+    finally:
+        await engine.dispose()
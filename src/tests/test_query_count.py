@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+
+from db.crud import crud_user
+from db.session import async_session, engine
+from .conftest import login_headers, new_credentials, upload, user_files
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@contextmanager
+def count_queries() -> Iterator[List[str]]:
+    '''Собирает SQL-запросы, выполненные внутри блока.'''
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    event.listen(
+        engine.sync_engine, 'before_cursor_execute', before_cursor_execute
+    )
+    try:
+        yield statements
+    finally:
+        event.remove(
+            engine.sync_engine, 'before_cursor_execute', before_cursor_execute
+        )
+
+
+@pytest_asyncio.fixture(scope='session')
+async def credentials() -> Dict[str, str]:
+    '''Данные нового пользователя.'''
+    return new_credentials('queries')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(
+    client: AsyncClient,
+    credentials: Dict[str, str]
+) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await login_headers(client, credentials)
+
+
+async def upload_numbered(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    number: int
+) -> None:
+    await upload(
+        client, headers, f'queries/file{number}.txt',
+        f'content {number}'.encode()
+    )
+
+
+async def test_user_files_queries_do_not_grow(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Число запросов /auth/user/files не зависит от числа файлов.'''
+    await upload_numbered(client, auth_headers, 0)
+    # Прогрев кэша авторизации
+    await client.get(user_files, headers=auth_headers)
+
+    with count_queries() as before:
+        response = await client.get(user_files, headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['files_count'] == 1
+
+    for number in range(1, 4):
+        await upload_numbered(client, auth_headers, number)
+    with count_queries() as after:
+        response = await client.get(
+            user_files, params={'limit': 2}, headers=auth_headers
+        )
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body['files_count'] == 4
+    assert len(body['files']['items']) == 2
+    assert body['files']['next_cursor']
+
+    # Счетчики, счетчики по расширениям и страница списка
+    assert len(before) == 3, before
+    assert len(after) == len(before), after
+
+
+async def test_user_load_does_not_load_files(
+    auth_headers: Dict[str, str],
+    credentials: Dict[str, str]
+):
+    '''Загрузка пользователя не тянет за собой его файлы.'''
+    async with async_session() as db:
+        with count_queries() as statements:
+            user = await crud_user.get_by_username(
+                db=db, username=credentials['username']
+            )
+        assert len(statements) == 1, statements
+        with pytest.raises(InvalidRequestError):
+            user.files
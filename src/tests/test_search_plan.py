@@ -0,0 +1,154 @@
+import hashlib
+import json
+import uuid
+from typing import Any, AsyncGenerator, Dict, Set
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from db.crud import crud_file
+from db.session import engine
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+USERS = 20
+FILES_PER_USER = 2500
+
+
+@pytest_asyncio.fixture(scope='session')
+async def seeded() -> AsyncGenerator[AsyncConnection, Any]:
+    '''
+    Соединение с транзакцией, в которой таблица file заполнена.
+
+    Данные и статистика видны только внутри транзакции и откатываются
+    после тестов.
+    '''
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        await conn.execute(text(
+            '''
+            INSERT INTO users (uid, username, password)
+            SELECT md5('plan' || u)::uuid, 'plan-user-' || u, '-'
+            FROM generate_series(1, :users) AS u
+            '''
+        ), {'users': USERS})
+        await conn.execute(text(
+            '''
+            INSERT INTO file
+                (fid, name, created, path, size, extension, user_id)
+            SELECT
+                md5('plan-file' || u || '-' || n)::uuid,
+                CASE WHEN n % 1000 = 0 THEN 'report-needle-' ELSE 'file-' END
+                    || n || '.' || ext,
+                now() - n * interval '1 minute',
+                'plan-user-' || u || '/dir' || n % 50
+                    || '/file-' || n || '.' || ext,
+                n * 10,
+                ext,
+                md5('plan' || u)::uuid
+            FROM generate_series(1, :users) AS u,
+                generate_series(1, :files) AS n,
+                LATERAL (
+                    SELECT (ARRAY['txt', 'pdf', 'png', 'jpg', 'doc', 'xls',
+                                  'zip', 'mp3', 'mp4', 'csv'])[n % 10 + 1]
+                ) AS e(ext)
+            '''
+        ), {'users': USERS, 'files': FILES_PER_USER})
+        await conn.execute(text('ANALYZE file'))
+        yield conn
+        await transaction.rollback()
+
+
+async def used_indexes(conn: AsyncConnection, options: Dict) -> Set[str]:
+    '''Возвращает индексы таблицы file из плана запроса поиска.'''
+    stmt = crud_file.search_stmt(options)
+    sql = stmt.compile(
+        dialect=conn.dialect,
+        compile_kwargs={'literal_binds': True}
+    )
+    result = await conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}')
+    plan = result.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    indexes, scans = set(), []
+
+    def walk(node: Dict) -> None:
+        if 'Index Name' in node:
+            indexes.add(node['Index Name'])
+        scans.append(node['Node Type'])
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    assert 'Seq Scan' not in scans, plan
+    return indexes
+
+
+def user_id(number: int = 1) -> uuid.UUID:
+    '''uid пользователя number из заполненной таблицы.'''
+    return uuid.UUID(hashlib.md5(f'plan{number}'.encode()).hexdigest())
+
+
+async def test_search_by_name_uses_trigram_index(seeded: AsyncConnection):
+    indexes = await used_indexes(
+        seeded, {'user_id': user_id(), 'query': 'needle'}
+    )
+    assert 'ix_file_name_trgm' in indexes
+
+
+async def test_search_by_extension_uses_composite_index(
+    seeded: AsyncConnection
+):
+    indexes = await used_indexes(
+        seeded, {'user_id': user_id(), 'extension': 'pdf'}
+    )
+    assert 'ix_file_user_id_extension' in indexes
+
+
+async def test_search_by_path_uses_path_index(seeded: AsyncConnection):
+    indexes = await used_indexes(
+        seeded,
+        {'user_id': user_id(), 'path': 'plan-user-1/dir7/file-7.mp4'}
+    )
+    assert 'ix_file_path' in indexes
+
+
+async def test_latest_files_use_created_index(seeded: AsyncConnection):
+    indexes = await used_indexes(
+        seeded, {'user_id': user_id(), 'order_by': '-created', 'limit': 20}
+    )
+    assert 'ix_file_user_id_created' in indexes
+
+
+async def test_next_page_seeks_created_index(seeded: AsyncConnection):
+    after = (
+        await seeded.execute(text(
+            'SELECT created, fid FROM file WHERE user_id = :uid '
+            'ORDER BY created DESC, fid DESC OFFSET 2000 LIMIT 1'
+        ), {'uid': user_id()})
+    ).one()
+    indexes = await used_indexes(
+        seeded,
+        {
+            'user_id': user_id(),
+            'order_by': '-created',
+            'limit': 21,
+            'after': tuple(after)
+        }
+    )
+    assert 'ix_file_user_id_created' in indexes
+
+
+async def test_directory_prefix_uses_path_index(seeded: AsyncConnection):
+    indexes = await used_indexes(
+        seeded,
+        {
+            'user_id': user_id(),
+            'prefix': 'plan-user-1/dir7/',
+            'order_by': 'path'
+        }
+    )
+    assert 'ix_file_path' in indexes
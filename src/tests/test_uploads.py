@@ -0,0 +1,234 @@
+import hashlib
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+from uuid import UUID
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy import update
+
+from core.settings import app_settings
+from db.crud import crud_file, crud_upload_session
+from db.models import UploadSession
+from db.session import async_session
+from utils.storage import session_dir
+from utils.tasks import cleanup_upload_sessions
+from .conftest import download_file, register_user, uploads
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'uploads')
+
+
+@pytest.fixture(autouse=True)
+def no_codec(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', None)
+
+
+def make_parts(count: int) -> List[bytes]:
+    # Уникальное содержимое, чтобы не совпасть с файлами прошлых запусков
+    return [
+        f'part {number} {random.getrandbits(64)}\n'.encode() * 100
+        for number in range(count)
+    ]
+
+
+async def start(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    path: str
+) -> str:
+    response = await client.post(
+        uploads, params={'path': path}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()['sid']
+
+
+async def send_part(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    sid: str,
+    number: int,
+    content: bytes
+) -> None:
+    response = await client.put(
+        f'{uploads}/{sid}/parts/{number}',
+        files={'file': ('part', content)},
+        headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'number': number, 'size': len(content)}
+
+
+async def complete(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    sid: str,
+    **params
+):
+    return await client.post(
+        f'{uploads}/{sid}/complete', params=params, headers=headers
+    )
+
+
+async def expire(sid: str) -> None:
+    async with async_session() as db:
+        await db.execute(
+            update(UploadSession).
+            where(UploadSession.sid == UUID(sid)).
+            values(expires=datetime.utcnow() - timedelta(minutes=1))
+        )
+        await db.commit()
+
+
+async def test_parts_out_of_order(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Части собираются по номерам, а не в порядке получения.'''
+    parts = make_parts(3)
+    sid = await start(client, auth_headers, 'resumable/ordered.bin')
+    for number in (3, 1, 2):
+        await send_part(client, auth_headers, sid, number, parts[number - 1])
+
+    response = await client.get(f'{uploads}/{sid}', headers=auth_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['parts'] == [
+        {'number': number, 'size': len(parts[number - 1])}
+        for number in (1, 2, 3)
+    ]
+
+    response = await complete(client, auth_headers, sid)
+    assert response.status_code == status.HTTP_200_OK
+    fid = response.json()['fid']
+    response = await client.get(
+        download_file, params={'file_id': fid}, headers=auth_headers
+    )
+    assert response.content == b''.join(parts)
+    # Завершенная загрузка удаляется вместе с частями
+    response = await client.get(f'{uploads}/{sid}', headers=auth_headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert not session_dir(UUID(sid)).exists()
+
+
+async def test_part_resent(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Повторно отправленная часть заменяет полученную ранее.'''
+    parts = make_parts(2)
+    sid = await start(client, auth_headers, 'resumable/resent.bin')
+    await send_part(client, auth_headers, sid, 1, b'broken')
+    await send_part(client, auth_headers, sid, 2, parts[1])
+    await send_part(client, auth_headers, sid, 1, parts[0])
+
+    response = await complete(client, auth_headers, sid)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['size'] == len(parts[0]) + len(parts[1])
+
+
+async def test_missing_part(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    sid = await start(client, auth_headers, 'resumable/missing.bin')
+    await send_part(client, auth_headers, sid, 2, b'second')
+    response = await complete(client, auth_headers, sid)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert '[1]' in response.json()['detail']
+
+
+async def test_complete_mismatch(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Несовпадение размера или хэша не создает файл.'''
+    parts = make_parts(2)
+    content = b''.join(parts)
+    digest = hashlib.sha256(content).hexdigest()
+    sid = await start(client, auth_headers, 'resumable/checked.bin')
+    await send_part(client, auth_headers, sid, 1, parts[0])
+    await send_part(client, auth_headers, sid, 2, parts[0])
+
+    response = await complete(
+        client, auth_headers, sid, size=len(content) + 1
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = await complete(client, auth_headers, sid, sha256=digest)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # Загрузка не потеряна: неверную часть можно отправить заново
+    await send_part(client, auth_headers, sid, 2, parts[1])
+    response = await complete(
+        client, auth_headers, sid, size=len(content), sha256=digest.upper()
+    )
+    assert response.status_code == status.HTTP_200_OK
+    async with async_session() as db:
+        file = await crud_file.get(db=db, fid=UUID(response.json()['fid']))
+    if app_settings.STORAGE_DEDUPLICATION:
+        assert file.blob_id == digest
+
+
+async def test_abort(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    sid = await start(client, auth_headers, 'resumable/aborted.bin')
+    await send_part(client, auth_headers, sid, 1, b'data')
+    response = await client.delete(f'{uploads}/{sid}', headers=auth_headers)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert not session_dir(UUID(sid)).exists()
+
+    response = await complete(client, auth_headers, sid)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = await client.delete(f'{uploads}/{sid}', headers=auth_headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_complete_expired(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Просроченную загрузку нельзя завершить до очистки.'''
+    sid = await start(client, auth_headers, 'resumable/expired.bin')
+    await send_part(client, auth_headers, sid, 1, b'data')
+    await expire(sid)
+
+    response = await complete(client, auth_headers, sid)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = await client.put(
+        f'{uploads}/{sid}/parts/2',
+        files={'file': ('part', b'more')},
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_cleanup_upload_sessions(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    expired = await start(client, auth_headers, 'resumable/old.bin')
+    await send_part(client, auth_headers, expired, 1, b'old')
+    await expire(expired)
+    active = await start(client, auth_headers, 'resumable/new.bin')
+    await send_part(client, auth_headers, active, 1, b'new')
+
+    await cleanup_upload_sessions()
+
+    async with async_session() as db:
+        assert await crud_upload_session.get(db=db, sid=UUID(expired)) is None
+        assert await crud_upload_session.get(db=db, sid=UUID(active))
+    assert not session_dir(UUID(expired)).exists()
+    assert session_dir(UUID(active)).exists()
+
+    response = await client.delete(f'{uploads}/{active}', headers=auth_headers)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
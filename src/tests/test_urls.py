@@ -1,14 +1,20 @@
+import gzip
+import hashlib
 import io
+import json
 import random
-from typing import Any, AsyncGenerator
+import string
+from typing import Dict, List, Tuple
 
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient
 from fastapi import status
 
-from src.core.settings import BASE_URL
-from src.main import app
+# Обработчики импортируют настройки как core.settings
+from core.settings import app_settings
+from utils.storage import blob_relpath
+from .conftest import register_user, upload
 
 # Относительные url приложения
 register = '/api/auth/register'
@@ -17,15 +23,16 @@ user_files = '/api/auth/user/files'
 upload_file = '/api/files/upload'
 download_file = '/api/files/download'
 search_file = '/api/files/search'
+search_stream = '/api/files/search/stream'
+export_files = '/api/files/export'
 
 pytestmark = pytest.mark.asyncio(scope='session')
 
 
-@pytest_asyncio.fixture(scope='session')
-async def client() -> AsyncGenerator[AsyncClient, Any]:
-    '''Асинхронный клиент для pytest.'''
-    async with AsyncClient(app=app, base_url=BASE_URL) as client:
-        yield client
+# Содержимое для проверки диапазонов: уникальное, печатные символы
+RANGE_CONTENT = (
+    f'{random.getrandbits(64):016x}' + string.ascii_letters * 20
+).encode()[:1000]
 
 
 class TestUrls:
@@ -121,6 +128,358 @@ class TestUrls:
 
         assert files_response.status_code == status.HTTP_200_OK
         files_response = files_response.json()
-        files_in_db = files_response.get('files')
+        files_in_db = files_response.get('files').get('items')
+        assert files_response.get('files_count') > 0
         assert len(files_in_db) > 0
         assert files_in_db[0].get('path') == self.download_path
+
+    async def test_download_accel_redirect(
+        self,
+        client: AsyncClient,
+        monkeypatch: pytest.MonkeyPatch
+    ):
+        '''Проверяет заголовки отдачи файла через nginx.'''
+        monkeypatch.setattr(app_settings, 'DOWNLOAD_ACCEL_REDIRECT', True)
+        login_response = (await client.post(
+            login,
+            data=self.login_data
+        )).json()
+        self.auth_headers['Authorization'] = (
+            f'{login_response["token_type"]} {login_response["access_token"]}'
+        )
+
+        # Путь уникален: повторный запуск не находит несколько файлов
+        filename = f'accel{random.getrandbits(32)}.txt'
+        upload_response = await client.post(
+            upload_file,
+            params={'path': f'accel/{filename}'},
+            files={'file': (filename, self.tmp_file_content.encode())},
+            headers=self.auth_headers
+        )
+        assert upload_response.status_code == status.HTTP_200_OK
+        file_path = upload_response.json()['path']
+
+        response = await client.get(
+            download_file,
+            params={'path': file_path},
+            headers=self.auth_headers
+        )
+        # При дедупликации файл лежит на диске под своим sha256
+        if app_settings.STORAGE_DEDUPLICATION:
+            file_path = blob_relpath(
+                hashlib.sha256(self.tmp_file_content.encode()).hexdigest()
+            )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['x-accel-redirect'] == (
+            f'{app_settings.ACCEL_REDIRECT_LOCATION}{file_path}'
+        )
+        assert response.headers['content-disposition'] == (
+            f'attachment; filename="{filename}"'
+        )
+        assert response.content == b''
+
+        # Диапазоны отдает nginx с sendfile, backend их не читает
+        response = await client.get(
+            download_file,
+            params={'path': upload_response.json()['path']},
+            headers={**self.auth_headers, 'Range': 'bytes=0-3'}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert 'x-accel-redirect' in response.headers
+        assert 'content-range' not in response.headers
+
+    async def test_search_pages(self, client: AsyncClient):
+        '''Проверяет постраничный поиск по курсору.'''
+        login_response = (await client.post(
+            login,
+            data=self.login_data
+        )).json()
+        self.auth_headers['Authorization'] = (
+            f'{login_response["token_type"]} {login_response["access_token"]}'
+        )
+        folder = f'pages{random.randrange(1, 100000)}'
+        for number in range(3):
+            response = await client.post(
+                upload_file,
+                params={'path': f'pages/{folder}-{number}.txt'},
+                files={'file': ('page.txt', f'{folder}{number}'.encode())},
+                headers=self.auth_headers
+            )
+            assert response.status_code == status.HTTP_200_OK
+
+        found, cursor = [], None
+        for _ in range(3):
+            response = await client.post(
+                search_file,
+                json={'query': folder, 'limit': 2, 'cursor': cursor},
+                headers=self.auth_headers
+            )
+            assert response.status_code == status.HTTP_200_OK
+            page = response.json()
+            found += [file['path'] for file in page['items']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        assert len(found) == 3
+        assert len(set(found)) == 3
+
+        response = await client.post(
+            search_file,
+            json={'query': folder, 'order_by': 'name', 'cursor': 'broken'},
+            headers=self.auth_headers
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    async def test_search_stream(self, client: AsyncClient):
+        '''Проверяет потоковый поиск и выгрузку файлов.'''
+        login_response = (await client.post(
+            login,
+            data=self.login_data
+        )).json()
+        self.auth_headers['Authorization'] = (
+            f'{login_response["token_type"]} {login_response["access_token"]}'
+        )
+        folder = f'stream{random.randrange(1, 100000)}'
+        for number in range(2):
+            await client.post(
+                upload_file,
+                params={'path': f'stream/{folder}-{number}.txt'},
+                files={'file': ('stream.txt', f'{folder}{number}'.encode())},
+                headers=self.auth_headers
+            )
+
+        response = await client.post(
+            search_stream,
+            json={'query': folder, 'order_by': 'name'},
+            headers=self.auth_headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [file['name'] for file in lines] == [
+            f'{folder}-0.txt', f'{folder}-1.txt'
+        ]
+
+        response = await client.post(
+            export_files,
+            params={'format': 'json'},
+            json={'query': folder},
+            headers=self.auth_headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert 'attachment' in response.headers['content-disposition']
+        assert len(response.json()) == 2
+
+
+@pytest.mark.parametrize('url', [search_stream, export_files])
+async def test_search_stream_anonymous(client: AsyncClient, url: str):
+    '''Потоковый поиск и выгрузка без токена отвечают 401.'''
+    response = await client.post(url, json={'query': 'test'})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'ranges')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def range_file(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+) -> Dict:
+    '''Запись загруженного файла с содержимым RANGE_CONTENT.'''
+    return await upload(client, auth_headers, 'ranges/data.bin', RANGE_CONTENT)
+
+
+async def download_range(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    file_id: str,
+    value: str,
+    **extra: str
+):
+    return await client.get(
+        download_file,
+        params={'file_id': file_id},
+        headers=headers | {'Range': value} | extra
+    )
+
+
+def byteranges(response) -> List[Tuple[str, bytes]]:
+    '''Разбирает тело multipart/byteranges на (Content-Range, данные).'''
+    media_type, _, boundary = response.headers['content-type'].partition(
+        '; boundary='
+    )
+    assert media_type == 'multipart/byteranges'
+    delimiter = f'--{boundary}'.encode()
+    body = response.content
+    assert body.endswith(delimiter + b'--\r\n')
+    parts = []
+    for part in body.split(delimiter)[1:-1]:
+        head, _, data = part.partition(b'\r\n\r\n')
+        headers = dict(
+            line.split(': ', 1)
+            for line in head.decode().strip().split('\r\n')
+        )
+        assert data.endswith(b'\r\n')
+        parts.append((headers['Content-Range'], data[:-2]))
+    return parts
+
+
+@pytest.mark.parametrize('value, start, end', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=100-199', 100, 199),
+    # Суффикс и диапазон до конца файла
+    ('bytes=-10', 990, 999),
+    ('bytes=990-', 990, 999),
+    # Конец за пределами файла обрезается по размеру
+    ('bytes=995-5000', 995, 999),
+    # Пересекающиеся и соседние диапазоны склеиваются в один
+    ('bytes=0-9,5-19,20-29', 0, 29),
+])
+async def test_single_range(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    range_file: Dict,
+    value: str,
+    start: int,
+    end: int
+):
+    response = await download_range(
+        client, auth_headers, range_file['fid'], value
+    )
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.headers['content-range'] == f'bytes {start}-{end}/1000'
+    assert response.headers['content-length'] == str(end - start + 1)
+    assert response.content == RANGE_CONTENT[start:end + 1]
+
+
+async def test_multiple_ranges(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    range_file: Dict
+):
+    response = await download_range(
+        client, auth_headers, range_file['fid'], 'bytes=500-509, 0-4, -3'
+    )
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert int(response.headers['content-length']) == len(response.content)
+    assert byteranges(response) == [
+        ('bytes 0-4/1000', RANGE_CONTENT[:5]),
+        ('bytes 500-509/1000', RANGE_CONTENT[500:510]),
+        ('bytes 997-999/1000', RANGE_CONTENT[997:]),
+    ]
+
+
+@pytest.mark.parametrize(
+    'value', ['bytes=1000-', 'bytes=5000-6000', 'bytes=-0']
+)
+async def test_range_not_satisfiable(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    range_file: Dict,
+    value: str
+):
+    response = await download_range(
+        client, auth_headers, range_file['fid'], value
+    )
+    assert (
+        response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+    )
+    assert response.headers['content-range'] == 'bytes */1000'
+    assert response.content == b''
+
+
+@pytest.mark.parametrize('value', ['items=0-10', 'bytes=20-10', 'bytes=a-'])
+async def test_invalid_range_ignored(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    range_file: Dict,
+    value: str
+):
+    response = await download_range(
+        client, auth_headers, range_file['fid'], value
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == RANGE_CONTENT
+
+
+async def test_if_range(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    range_file: Dict
+):
+    response = await client.get(
+        download_file,
+        params={'file_id': range_file['fid']},
+        headers=auth_headers
+    )
+    assert response.headers['accept-ranges'] == 'bytes'
+    etag = response.headers['etag']
+
+    response = await download_range(
+        client, auth_headers, range_file['fid'], 'bytes=0-9',
+        **{'If-Range': etag}
+    )
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.content == RANGE_CONTENT[:10]
+
+    # Файл на клиенте устарел: вместо диапазона весь файл
+    response = await download_range(
+        client, auth_headers, range_file['fid'], 'bytes=0-9',
+        **{'If-Range': '"stale"'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert 'content-range' not in response.headers
+    assert response.content == RANGE_CONTENT
+
+
+async def raw_range(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    file_id: str,
+    value: str
+) -> bytes:
+    '''Диапазон сжатого файла без распаковки на стороне клиента.'''
+    async with client.stream(
+        'GET',
+        download_file,
+        params={'file_id': file_id},
+        headers=headers | {'Range': value, 'Accept-Encoding': 'gzip'}
+    ) as response:
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response.headers['content-encoding'] == 'gzip'
+        size = response.headers['content-range'].rsplit('/', 1)[1]
+        content = b''.join([chunk async for chunk in response.aiter_raw()])
+    assert response.headers['content-range'] == (
+        f'{value.replace("=", " ")}{int(size) - 1}/{size}'
+    )
+    return content
+
+
+async def test_range_compressed_on_disk(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Сжатый на диске файл: диапазоны только в сжатом представлении.'''
+    monkeypatch.setattr(app_settings, 'STORAGE_CODEC', 'gzip')
+    content = RANGE_CONTENT * 10
+    body = await upload(client, auth_headers, 'ranges/data.txt', content)
+
+    # Распаковка во время отправки: Range не поддерживается
+    response = await download_range(
+        client, auth_headers, body['fid'], 'bytes=0-9',
+        **{'Accept-Encoding': 'identity'}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['accept-ranges'] == 'none'
+    assert response.content == content
+
+    # Клиент принимает gzip: диапазоны считаются по сжатому файлу
+    encoded = await raw_range(client, auth_headers, body['fid'], 'bytes=0-')
+    assert gzip.decompress(encoded) == content
+    tail = await raw_range(client, auth_headers, body['fid'], 'bytes=10-')
+    assert tail == encoded[10:]
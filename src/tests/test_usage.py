@@ -0,0 +1,158 @@
+import random
+from typing import Dict
+from uuid import UUID
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+from httpx import AsyncClient
+
+from core.settings import app_settings
+from db.crud import crud_file, crud_usage
+from db.models import Blob
+from db.session import async_session
+from .conftest import (
+    download_file,
+    post_upload,
+    register_user,
+    upload_batch,
+    user_files
+)
+
+pytestmark = pytest.mark.asyncio(scope='session')
+
+
+@pytest_asyncio.fixture(scope='session')
+async def auth_headers(client: AsyncClient) -> Dict[str, str]:
+    '''Заголовки авторизации нового пользователя.'''
+    return await register_user(client, 'usage')
+
+
+async def upload(
+    client: AsyncClient,
+    headers: Dict[str, str],
+    filename: str,
+    content: bytes
+):
+    return await post_upload(client, headers, f'usage/{filename}', content)
+
+
+async def get_usage(client: AsyncClient, headers: Dict[str, str]) -> Dict:
+    response = await client.get(user_files, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    return response.json()
+
+
+async def test_usage_counters(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Счетчики меняются вместе с загрузкой файлов и совпадают с пересчетом.'''
+    body = await get_usage(client, auth_headers)
+    assert (body['files_count'], body['files_size']) == (0, 0)
+    assert body['extensions'] == []
+
+    for filename, content in (
+        ('a.txt', b'12345'),
+        ('b.txt', b'123'),
+        ('c.pdf', b'1234567890'),
+    ):
+        response = await upload(client, auth_headers, filename, content)
+        assert response.status_code == status.HTTP_200_OK
+
+    body = await get_usage(client, auth_headers)
+    assert (body['files_count'], body['files_size']) == (3, 18)
+    extensions = {
+        usage['extension']: (usage['files_count'], usage['files_size'])
+        for usage in body['extensions']
+    }
+    assert extensions == {'pdf': (1, 10), 'txt': (2, 8)}
+
+    async with async_session() as db:
+        assert await crud_usage.rebuild(db=db)
+    assert await get_usage(client, auth_headers) == body
+
+
+async def test_upload_over_quota(
+    client: AsyncClient,
+    auth_headers: Dict[str, str],
+    monkeypatch: pytest.MonkeyPatch
+):
+    '''Файл сверх квоты отклоняется и не меняет счетчики.'''
+    before = await get_usage(client, auth_headers)
+    monkeypatch.setattr(
+        app_settings, 'QUOTA_MAX_BYTES', before['files_size'] + 4
+    )
+    response = await upload(client, auth_headers, 'big.bin', b'12345')
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+    monkeypatch.setattr(app_settings, 'QUOTA_MAX_BYTES', None)
+    monkeypatch.setattr(
+        app_settings, 'QUOTA_MAX_FILES', before['files_count']
+    )
+    response = await upload(client, auth_headers, 'small.bin', b'1')
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+    assert await get_usage(client, auth_headers) == before
+
+
+async def test_upload_batch(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Пакетная загрузка сохраняет файлы и сообщает статус каждого.'''
+    before = await get_usage(client, auth_headers)
+    response = await client.post(
+        upload_batch,
+        params={'path': 'batch'},
+        files=[
+            ('files', ('one.txt', b'1')),
+            ('files', ('nested/two.txt', b'22')),
+            ('files', ('three.' + 'x' * 20, b'333')),
+            ('files', ('one.txt', b'1')),
+        ],
+        headers=auth_headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()
+    assert [result['status'] for result in results] == [
+        status.HTTP_200_OK,
+        status.HTTP_200_OK,
+        status.HTTP_400_BAD_REQUEST,
+        status.HTTP_200_OK,
+    ]
+    assert results[1]['file']['path'].endswith('/batch/two.txt')
+    assert results[2]['file'] is None
+
+    after = await get_usage(client, auth_headers)
+    assert after['files_count'] == before['files_count'] + 3
+    assert after['files_size'] == before['files_size'] + 4
+
+    response = await client.get(
+        download_file,
+        params={'file_id': results[1]['file']['fid']},
+        headers=auth_headers
+    )
+    assert response.content == b'22'
+
+
+async def test_delete_last_blob_reference(
+    client: AsyncClient,
+    auth_headers: Dict[str, str]
+):
+    '''Удаление последнего файла с содержимым удаляет и запись blob.'''
+    content = f'unique {random.random()}'.encode()
+    response = await upload(client, auth_headers, 'last.txt', content)
+    assert response.status_code == status.HTTP_200_OK
+    before = await get_usage(client, auth_headers)
+
+    async with async_session() as db:
+        file = await crud_file.get(db=db, fid=UUID(response.json()['fid']))
+        blob_id = file.blob_id
+        assert await crud_file.delete(db=db, db_obj=file)
+        if blob_id:
+            assert await db.get(Blob, blob_id) is None
+
+    after = await get_usage(client, auth_headers)
+    assert after['files_count'] == before['files_count'] - 1
+    assert after['files_size'] == before['files_size'] - len(content)
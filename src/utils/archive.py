@@ -0,0 +1,193 @@
+import logging
+import tarfile
+import zipfile
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from utils.codecs import open_decoded
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveEntry(NamedTuple):
+    '''Файл, который нужно добавить в архив.'''
+    name: str
+    path: Path
+    mtime: datetime
+    compress: bool
+    # Кодек, которым файл сжат на диске, и его исходный размер
+    codec: Optional[str] = None
+    size: Optional[int] = None
+
+
+class ChunkSink:
+    '''
+    Файлоподобный объект без seek, из которого записанное забирается частями.
+
+    Архив пишется в него, а отправленные клиенту части сразу освобождаются.
+    '''
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+        self.offset = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        self.offset += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+class ArchiveWriter(ABC):
+    '''
+    Потоковый архив, который собирается по мере отправки.
+
+    write_entries отдает части не меньше chunk_size байт (кроме последней),
+    поэтому в памяти одновременно находится около одной части архива.
+    Методы блокирующие и вызываются в пуле потоков. Формат задают
+    наследники: без любого из абстрактных методов writer не создается,
+    а не обрывает архив посреди отправки.
+    '''
+
+    media_type = 'application/octet-stream'
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.sink = ChunkSink()
+
+    def write_entries(
+        self,
+        entries: Iterable[ArchiveEntry]
+    ) -> Iterator[bytes]:
+        for entry in entries:
+            try:
+                source = open_decoded(entry.path, entry.codec)
+            except FileNotFoundError:
+                logger.warning(
+                    'Archive entry %s not found, skipped', entry.path
+                )
+                continue
+            with source:
+                if entry.codec is None:
+                    size = source.seek(0, 2)
+                    source.seek(0)
+                else:
+                    # Размер до сжатия известен только из записи о файле
+                    size = entry.size
+                self.begin(entry, size=size)
+                while chunk := source.read(self.chunk_size):
+                    self.write(chunk)
+                    if self.sink.size >= self.chunk_size:
+                        yield self.sink.drain()
+                self.end()
+        if self.sink.size:
+            yield self.sink.drain()
+
+    def close(self) -> bytes:
+        '''Дописывает конец архива и возвращает оставшиеся байты.'''
+        self.finish()
+        return self.sink.drain()
+
+    @abstractmethod
+    def begin(self, entry: ArchiveEntry, size: int) -> None:
+        '''Начинает запись entry размером size байт.'''
+
+    @abstractmethod
+    def write(self, data: bytes) -> None:
+        '''Дописывает данные текущей записи.'''
+
+    @abstractmethod
+    def end(self) -> None:
+        '''Завершает текущую запись.'''
+
+    @abstractmethod
+    def finish(self) -> None:
+        '''Дописывает конец архива.'''
+
+
+class ZipArchiveWriter(ArchiveWriter):
+    '''
+    ZIP с data descriptor после каждой записи: размеры и CRC становятся
+    известны только после сжатия, а вернуться назад в потоке нельзя.
+    Записи больше 4 ГБ и архивы больше 65535 файлов пишутся в ZIP64.
+    '''
+
+    media_type = 'application/zip'
+
+    def __init__(self, chunk_size: int):
+        super().__init__(chunk_size)
+        self.archive = zipfile.ZipFile(self.sink, mode='w', allowZip64=True)
+
+    def begin(self, entry: ArchiveEntry, size: int) -> None:
+        info = zipfile.ZipInfo(
+            entry.name, date_time=entry.mtime.timetuple()[:6]
+        )
+        # По размеру zipfile решает, нужен ли записи ZIP64
+        info.file_size = size
+        info.compress_type = (
+            zipfile.ZIP_DEFLATED if entry.compress else zipfile.ZIP_STORED
+        )
+        self.entry = self.archive.open(info, mode='w')
+
+    def write(self, data: bytes) -> None:
+        self.entry.write(data)
+
+    def end(self) -> None:
+        self.entry.close()
+
+    def finish(self) -> None:
+        self.archive.close()
+
+
+class TarArchiveWriter(ArchiveWriter):
+    '''
+    tar в формате PAX без сжатия: длинные имена и размеры больше 8 ГБ
+    хранятся в расширенных заголовках.
+    '''
+
+    media_type = 'application/x-tar'
+
+    def begin(self, entry: ArchiveEntry, size: int) -> None:
+        info = tarfile.TarInfo(entry.name)
+        info.size = size
+        info.mtime = int(entry.mtime.timestamp())
+        info.mode = 0o644
+        self.sink.write(
+            info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
+        )
+        self.expected, self.written = size, 0
+
+    def write(self, data: bytes) -> None:
+        self.written += len(data)
+        self.sink.write(data)
+
+    def end(self) -> None:
+        # Заголовок уже отправлен, другой размер испортил бы архив
+        if self.written != self.expected:
+            raise OSError(
+                f'File size changed while archiving: {self.written} bytes '
+                f'instead of {self.expected}'
+            )
+        self.sink.write(b'\0' * (-self.written % tarfile.BLOCKSIZE))
+
+    def finish(self) -> None:
+        self.sink.write(b'\0' * (2 * tarfile.BLOCKSIZE))
+        self.sink.write(b'\0' * (-self.sink.offset % tarfile.RECORDSIZE))
+
+
+ARCHIVE_WRITERS = {
+    'zip': ZipArchiveWriter,
+    'tar': TarArchiveWriter,
+}
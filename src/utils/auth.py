@@ -1,28 +1,51 @@
 import logging
 import re
 from datetime import datetime, timedelta
-from typing import Annotated, Any, Dict
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Annotated, Any, Dict
 
 from fastapi import Depends, HTTPException, status
-from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from core.settings import app_settings, oauth2_scheme, pwd_context
+from core.settings import app_settings, oauth2_scheme
 from db.session import get_session
 from db.crud import crud_user
-from schemas.users import BaseUser, TokenData
+from schemas.users import BaseUser, TokenData, UserPrincipal
+from utils.cache import principal_cache
+from utils.services import run_in_executor
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_pwd_context() -> 'CryptContext':
+    '''
+    Схема шифрования пароля пользователя.
+
+    passlib импортируется при первом вызове: пароли проверяются в пуле
+    процессов, основному процессу и командам он не нужен.
+    '''
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+def load_password_backend() -> str:
+    '''Загружает bcrypt заранее, вызывается при прогреве в пуле паролей.'''
+    return get_pwd_context().handler().get_backend()
+
+
 def verify_password(raw_password: str, hashed_password: str) -> bool:
     '''Верифицирует совпадение введенного пароля с зашифрованным.'''
-    return pwd_context.verify(raw_password, hashed_password)
+    return get_pwd_context().verify(raw_password, hashed_password)
 
 
 def hash_password(raw_password: str) -> str:
     '''Хэширует пароль пользователя.'''
-    return pwd_context.hash(raw_password)
+    return get_pwd_context().hash(raw_password)
 
 
 def validate_password(raw_password: str) -> bool:
@@ -52,19 +75,20 @@ def validate_password(raw_password: str) -> bool:
         else:
             return True
     except AttributeError as err:
-        logger.error(f'Attr error validating password {err}', exc_info=True)
+        logger.error('Attr error validating password %s', err, exc_info=True)
     except ValueError as err:
-        logger.error(f'Value error validating password {err}', exc_info=True)
+        logger.error('Value error validating password %s', err, exc_info=True)
 
 
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
     db: Annotated[AsyncSession, Depends(get_session)]
-) -> BaseUser:
+) -> UserPrincipal:
     '''
     Проверяет токен пользователя.
 
-    Если пользователь найден, возвращает объект пользователя.
+    Если пользователь найден, возвращает его uid и username. Пользователь
+    берется из кэша, база запрашивается только при промахе.
     '''
     credentials_error = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -74,6 +98,8 @@ async def get_current_user(
     if not token:
         return None
 
+    from jose import JWTError, jwt
+
     try:
         payload = jwt.decode(
             token,
@@ -81,19 +107,23 @@ async def get_current_user(
             algorithms=[app_settings.CRYPTO_ALGORITHM]
         )
     except JWTError as err:
-        logger.error(f'Error checking user token: {err}')
+        logger.error('Error checking user token: %s', err)
         raise credentials_error
 
     username = payload.get('sub')
     if username is None:
         raise credentials_error
     token_data = TokenData(username=username)
-    user = await crud_user.get_by_username(
-        db=db,
-        username=token_data.username
+    user = await principal_cache.get_or_load(
+        username=token_data.username,
+        loader=partial(
+            crud_user.get_principal,
+            db=db,
+            username=token_data.username
+        )
     )
     if user is None:
-        logger.error(f'User {username} not found')
+        logger.error('User %s not found', username)
         raise credentials_error
     return user
 
@@ -108,11 +138,17 @@ async def authenticate_user(
         user = await crud_user.get_by_username(db=db, username=username)
         if not user:
             return None
-        if not verify_password(password, user.password):
+        is_valid = await run_in_executor(
+            partial(verify_password, password, user.password),
+            executor='password'
+        )
+        if not is_valid:
             return None
         return user
+    except HTTPException:
+        raise
     except Exception as err:
-        logger.error(f'Error authenticating user {err}.', exc_info=True)
+        logger.error('Error authenticating user %s.', err, exc_info=True)
 
 
 def create_access_token(
@@ -120,6 +156,9 @@ def create_access_token(
     expires_delta: timedelta = timedelta(days=1)
 ) -> str:
     '''Генерирует новый токен.'''
+    # jose импортируется при первом входе или при прогреве
+    from jose import jwt
+
     try:
         to_encode = data.copy()
         expire = datetime.utcnow() + expires_delta
@@ -131,4 +170,4 @@ def create_access_token(
         )
         return encoded_jwt
     except Exception as err:
-        logger.error(f'Error creating token {err}', exc_info=True)
+        logger.error('Error creating token %s', err, exc_info=True)
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from core.redis import get_redis
+from core.settings import app_settings, REDIS_NEGATIVE_TTL, REDIS_TTL
+from db.models import File
+from schemas.entities import FileRecord
+from schemas.users import UserPrincipal
+
+logger = logging.getLogger(__name__)
+
+# Отметка в кэше о том, что файла нет в базе
+MISSING = b'-'
+
+
+class FileCache:
+    '''
+    Кэш метаданных файлов в Redis.
+
+    Хранит запись File целиком, отсутствие файла кэшируется отдельной
+    отметкой на короткое время. Одновременные промахи по одному ключу
+    объединяются: в базу идет только один запрос на процесс. Если Redis
+    недоступен, запросы выполняются напрямую в базу.
+    '''
+
+    def __init__(self, ttl: timedelta, negative_ttl: timedelta):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def id_key(fid: Any) -> str:
+        return f'file:id:{fid}'
+
+    @staticmethod
+    def path_key(path: str) -> str:
+        return f'file:path:{path}'
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Optional[File]]]
+    ) -> Optional[FileRecord]:
+        '''Возвращает запись из кэша или загружает ее через loader.'''
+        try:
+            cached = await get_redis().get(key)
+        except RedisError as err:
+            self.errors += 1
+            logger.warning('Redis get failed %s', err)
+            cached = None
+
+        if cached == MISSING:
+            self.negative_hits += 1
+            return None
+        if cached is not None:
+            self.hits += 1
+            return FileRecord.model_validate_json(cached)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            file = await loader()
+            record = FileRecord.model_validate(file) if file else None
+            await self._store(key, record)
+            future.set_result(record)
+            return record
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as err:
+            future.set_exception(err)
+            # Ошибку получат ожидающие запросы, если они есть
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _store(self, key: str, record: Optional[FileRecord]) -> None:
+        try:
+            if record is None:
+                await get_redis().setex(key, self.negative_ttl, MISSING)
+            else:
+                await get_redis().setex(
+                    key, self.ttl, record.model_dump_json()
+                )
+        except RedisError as err:
+            self.errors += 1
+            logger.warning('Redis set failed %s', err)
+
+    async def preload(self, files: Iterable[File]) -> int:
+        '''Кладет в кэш записи о файлах по id и по пути.'''
+        count = 0
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for file in files:
+                    dump = FileRecord.model_validate(file).model_dump_json()
+                    pipe.setex(self.id_key(file.fid), self.ttl, dump)
+                    pipe.setex(self.path_key(file.path), self.ttl, dump)
+                    count += 1
+                await pipe.execute()
+        except RedisError as err:
+            self.errors += 1
+            logger.warning('Redis preload failed %s', err)
+            return 0
+        return count
+
+    async def invalidate(
+        self,
+        files: Iterable[File],
+        extra_keys: Iterable[str] = ()
+    ) -> None:
+        '''Удаляет из кэша записи о файлах по id и по пути.'''
+        keys = list(extra_keys)
+        for file in files:
+            keys += [self.id_key(file.fid), self.path_key(file.path)]
+        if not keys:
+            return
+        try:
+            await get_redis().delete(*keys)
+        except RedisError as err:
+            self.errors += 1
+            logger.warning('Redis invalidation failed %s', err)
+
+    def stats(self) -> Dict[str, Any]:
+        '''Возвращает счетчики попаданий и промахов.'''
+        lookups = self.hits + self.negative_hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'hit_ratio': (
+                (lookups - self.misses) / lookups if lookups else 0.0
+            ),
+        }
+
+
+file_cache = FileCache(
+    ttl=timedelta(days=REDIS_TTL),
+    negative_ttl=timedelta(seconds=REDIS_NEGATIVE_TTL)
+)
+
+
+class TTLCache:
+    '''LRU-кэш в памяти процесса с ограничением размера и времени жизни.'''
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class PrincipalCache:
+    '''
+    Кэш авторизованных пользователей по username из токена.
+
+    Первый уровень - LRU в памяти процесса, второй (необязательный) -
+    Redis, общий для всех воркеров. Хранит только uid и username, без
+    пароля и файлов. Записи в памяти других воркеров не сбрасываются при
+    изменении пользователя, поэтому срок жизни записей короткий.
+    '''
+
+    def __init__(self, ttl: int, max_size: int, use_redis: bool):
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._local = TTLCache(max_size=max_size, ttl=ttl)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(username: str) -> str:
+        return f'principal:{username}'
+
+    async def get_or_load(
+        self,
+        username: str,
+        loader: Callable[[], Awaitable[Optional[UserPrincipal]]]
+    ) -> Optional[UserPrincipal]:
+        '''Возвращает пользователя из кэша или загружает его через loader.'''
+        principal = self._local.get(username)
+        if principal is not None:
+            self.hits += 1
+            return principal
+
+        if self.use_redis:
+            try:
+                cached = await get_redis().get(self.key(username))
+            except RedisError as err:
+                self.errors += 1
+                logger.warning('Redis get failed %s', err)
+                cached = None
+            if cached is not None:
+                self.redis_hits += 1
+                principal = UserPrincipal.model_validate_json(cached)
+                self._local.set(username, principal)
+                return principal
+
+        self.misses += 1
+        principal = await loader()
+        if principal is None:
+            return None
+        self._local.set(username, principal)
+        if self.use_redis:
+            try:
+                await get_redis().setex(
+                    self.key(username), self.ttl, principal.model_dump_json()
+                )
+            except RedisError as err:
+                self.errors += 1
+                logger.warning('Redis set failed %s', err)
+        return principal
+
+    async def invalidate(self, *usernames: str) -> None:
+        '''Удаляет пользователей из кэша.'''
+        for username in usernames:
+            self._local.delete(username)
+        if self.use_redis and usernames:
+            try:
+                await get_redis().delete(*map(self.key, usernames))
+            except RedisError as err:
+                self.errors += 1
+                logger.warning('Redis invalidation failed %s', err)
+
+    def stats(self) -> Dict[str, Any]:
+        '''Возвращает счетчики попаданий и промахов.'''
+        return {
+            'size': len(self._local),
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'errors': self.errors,
+        }
+
+
+principal_cache = PrincipalCache(
+    ttl=app_settings.PRINCIPAL_CACHE_TTL,
+    max_size=app_settings.PRINCIPAL_CACHE_SIZE,
+    use_redis=app_settings.PRINCIPAL_CACHE_REDIS
+)
@@ -0,0 +1,111 @@
+import gzip
+import logging
+import zlib
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, NamedTuple, Optional
+
+from core.settings import app_settings
+
+try:
+    import zstandard
+except ImportError:
+    # zstd необязателен: без пакета доступен только gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class Codec(NamedTuple):
+    '''Способ сжатия содержимого файлов на диске.'''
+    # Совпадает со значением Content-Encoding для этих байт
+    name: str
+    # Расширение, которое добавляется к имени содержимого в хранилище
+    suffix: str
+    # Создает объект с методами compress(data) и flush()
+    compressor: Callable[[Optional[int]], Any]
+    # Открывает сжатый файл для чтения исходных байт
+    open: Callable[[Path], BinaryIO]
+
+
+def gzip_compressor(level: Optional[int]) -> Any:
+    '''Сжатие в формате gzip: при wbits=31 zlib пишет заголовок gzip.'''
+    return zlib.compressobj(
+        6 if level is None else level, zlib.DEFLATED, 31
+    )
+
+
+def gzip_open(path: Path) -> BinaryIO:
+    return gzip.open(path, mode='rb')
+
+
+def zstd_compressor(level: Optional[int]) -> Any:
+    return zstandard.ZstdCompressor(
+        level=3 if level is None else level
+    ).compressobj()
+
+
+def zstd_open(path: Path) -> BinaryIO:
+    return zstandard.ZstdDecompressor().stream_reader(
+        open(path, mode='rb'), closefd=True
+    )
+
+
+CODECS: Dict[str, Codec] = {
+    'gzip': Codec('gzip', 'gz', gzip_compressor, gzip_open),
+}
+if zstandard is not None:
+    CODECS['zstd'] = Codec('zstd', 'zst', zstd_compressor, zstd_open)
+
+if app_settings.STORAGE_CODEC and app_settings.STORAGE_CODEC not in CODECS:
+    logger.warning(
+        'Storage codec %s is unavailable, files are stored uncompressed',
+        app_settings.STORAGE_CODEC
+    )
+
+
+def choose_codec(extension: Optional[str], sample: bytes) -> Optional[str]:
+    '''
+    Выбирает кодек для файла с расширением extension.
+
+    sample - начало файла. Уже сжатые форматы хранятся как есть,
+    текстовые из STORAGE_CODEC_EXTENSIONS сжимаются всегда, остальные -
+    если быстрое сжатие sample дает выигрыш не меньше
+    STORAGE_CODEC_MAX_RATIO. None - хранить без сжатия.
+    '''
+    codec = app_settings.STORAGE_CODEC
+    if codec not in CODECS:
+        return None
+    extension = (extension or '').lower()
+    if extension in app_settings.COMPRESSED_EXTENSIONS:
+        return None
+    if extension in app_settings.STORAGE_CODEC_EXTENSIONS:
+        return codec
+    if not sample:
+        return None
+    # Проба уровнем 1: нужна оценка, а не лучший результат
+    probe = zlib.compress(sample, 1)
+    if len(probe) > len(sample) * app_settings.STORAGE_CODEC_MAX_RATIO:
+        return None
+    return codec
+
+
+def read_sample(stream: BinaryIO) -> bytes:
+    '''Читает начало stream для choose_codec и возвращается на место.'''
+    position = stream.tell()
+    sample = stream.read(app_settings.STORAGE_CODEC_SAMPLE)
+    stream.seek(position)
+    return sample
+
+
+def open_decoded(path: Path, codec: Optional[str]) -> BinaryIO:
+    '''Открывает файл хранилища на чтение исходного содержимого.'''
+    if codec is None:
+        return open(path, mode='rb')
+    return CODECS[codec].open(path)
+
+
+def get_compressor(codec: Optional[str]) -> Optional[Any]:
+    '''Компрессор для записи файла кодеком codec, None - без сжатия.'''
+    if codec is None:
+        return None
+    return CODECS[codec].compressor(app_settings.STORAGE_CODEC_LEVEL)
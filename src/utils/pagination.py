@@ -0,0 +1,53 @@
+import base64
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Tuple
+from uuid import UUID
+
+import orjson
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+# Как восстановить значение поля сортировки из JSON курсора
+CURSOR_FIELDS: Dict[str, Callable[[Any], Any]] = {
+    'created': datetime.fromisoformat,
+    'name': str,
+    'size': float,
+}
+
+
+def encode_cursor(ordering: str, obj: Any) -> str:
+    '''
+    Возвращает курсор, указывающий на позицию сразу после obj.
+
+    Курсор непрозрачен для клиента: это base64 от пары (значение поля
+    сортировки, fid) и самого порядка сортировки.
+    '''
+    field = ordering.lstrip('-')
+    payload = orjson.dumps([ordering, getattr(obj, field), str(obj.fid)])
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, ordering: str) -> Tuple[Any, UUID]:
+    '''
+    Возвращает значение поля сортировки и fid из курсора.
+
+    Курсор, выданный для другого порядка сортировки, считается неверным.
+    '''
+    cursor_error = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail='Неверный курсор, начните поиск с первой страницы.'
+    )
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_ordering, value, fid = orjson.loads(payload)
+        if cursor_ordering != ordering:
+            raise cursor_error
+        return CURSOR_FIELDS[ordering.lstrip('-')](value), UUID(fid)
+    except HTTPException:
+        raise
+    # Ошибки base64 и JSON - подклассы ValueError
+    except (KeyError, TypeError, ValueError) as err:
+        logger.warning('Invalid cursor %s: %s', cursor, err)
+        raise cursor_error
@@ -0,0 +1,403 @@
+import os
+import re
+import secrets
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from functools import partial
+from mimetypes import guess_type
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from fastapi import status
+from fastapi.responses import (
+    FileResponse,
+    ORJSONResponse,
+    Response,
+    StreamingResponse
+)
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+
+from core.executors import io_executor
+from core.metrics import DOWNLOAD_BYTES
+from utils.codecs import open_decoded
+
+RANGE_SPEC = re.compile(r'^(\d*)-(\d*)$')
+
+
+def content_disposition(filename: str) -> str:
+    '''Заголовок Content-Disposition для скачивания файла filename.'''
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def accepts_encoding(header: Optional[str], coding: str) -> bool:
+    '''
+    Проверяет, что по заголовку Accept-Encoding клиент примет ответ,
+    сжатый coding.
+
+    Учитываются q-значения: 'gzip;q=0' означает отказ от gzip.
+    '''
+    accepted = {}
+    for item in (header or '').split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        key, _, value = params.partition('=')
+        if key.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+    if coding in accepted:
+        return accepted[coding] > 0
+    return accepted.get('*', 0) > 0
+
+
+def http_date(value: datetime) -> str:
+    '''Дата value в формате заголовков HTTP.'''
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return formatdate(value.timestamp(), usegmt=True)
+
+
+def is_not_modified(
+    request_headers: Headers,
+    etag: str,
+    last_modified: datetime
+) -> bool:
+    '''
+    Проверяет If-None-Match и If-Modified-Since запроса: True, если
+    у клиента актуальная версия и можно ответить 304.
+
+    If-Modified-Since учитывается только без If-None-Match, ETag
+    сравниваются без учета W/.
+    '''
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = {
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+        }
+        return '*' in tags or etag.removeprefix('W/') in tags
+    try:
+        since = parsedate_to_datetime(request_headers['if-modified-since'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # В заголовке дата с точностью до секунды
+    return int(last_modified.timestamp()) <= since.timestamp()
+
+
+def parse_range_spec(spec: str, size: int) -> Optional[Tuple[int, int]]:
+    '''
+    Разбирает один диапазон из заголовка Range для файла размером size.
+
+    Возвращает (начало, конец включительно) или None, если диапазон
+    не попадает в файл. Неверная запись - ValueError.
+    '''
+    match = RANGE_SPEC.match(spec)
+    if not match or match.groups() == ('', ''):
+        raise ValueError(f'Invalid range {spec}')
+    first, last = match.groups()
+    if not first:
+        # Суффикс: последние N байт файла
+        suffix = int(last)
+        if suffix == 0:
+            return None
+        start, end = max(size - suffix, 0), size - 1
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            raise ValueError(f'Invalid range {spec}')
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return None
+    return start, end
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    '''Сортирует диапазоны и склеивает пересекающиеся и соседние.'''
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def parse_range_header(
+    value: str,
+    size: int,
+    max_ranges: int = 16
+) -> Optional[List[Tuple[int, int]]]:
+    '''
+    Разбирает заголовок Range для файла размером size.
+
+    Возвращает отсортированные непересекающиеся диапазоны (начало, конец
+    включительно). None означает, что заголовок некорректен и его нужно
+    проигнорировать, пустой список - что ни один диапазон не попадает
+    в файл.
+    '''
+    unit, _, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+
+    try:
+        ranges = [
+            parse_range_spec(spec.strip(), size)
+            for spec in specs.split(',')
+            if spec.strip()
+        ]
+    except ValueError:
+        return None
+    ranges = [item for item in ranges if item is not None]
+    if len(ranges) > max_ranges:
+        return None
+    return merge_ranges(ranges)
+
+
+class RangeFileResponse(FileResponse):
+    '''
+    FileResponse с поддержкой докачки и перемотки.
+
+    Обрабатывает заголовки Range и If-Range: отвечает 206 Partial Content
+    с одним диапазоном или multipart/byteranges с несколькими, 416 если
+    диапазоны не попадают в файл. Байты читаются частями через os.pread
+    в пуле io. Без копирования через Python, с sendfile, файлы и их
+    диапазоны отдает nginx при DOWNLOAD_ACCEL_REDIRECT.
+    '''
+
+    chunk_size = 256 * 1024
+    max_ranges = 16
+
+    def requested_ranges(
+        self,
+        request_headers: Headers,
+        size: int
+    ) -> Optional[List[Tuple[int, int]]]:
+        '''Возвращает запрошенные диапазоны или None для полного ответа.'''
+        range_header = request_headers.get('range')
+        if not range_header:
+            return None
+        # If-Range: диапазон отдается, только если файл не изменился
+        if_range = request_headers.get('if-range')
+        if if_range and if_range not in (
+            self.headers.get('etag'),
+            self.headers.get('last-modified')
+        ):
+            return None
+        return parse_range_header(range_header, size, self.max_ranges)
+
+    def body_parts(
+        self,
+        ranges: Optional[List[Tuple[int, int]]],
+        size: int
+    ) -> List[Union[bytes, Tuple[int, int]]]:
+        '''
+        Выставляет статус и заголовки ответа на запрошенные диапазоны.
+
+        Возвращает части тела: bytes отправляются как есть,
+        (начало, длина) - из файла.
+        '''
+        if ranges is None:
+            return [(0, size)]
+        if not ranges:
+            self.status_code = status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+            self.headers['content-range'] = f'bytes */{size}'
+            self.headers['content-length'] = '0'
+            return []
+
+        self.status_code = status.HTTP_206_PARTIAL_CONTENT
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.headers['content-range'] = f'bytes {start}-{end}/{size}'
+            self.headers['content-length'] = str(end - start + 1)
+            return [(start, end - start + 1)]
+
+        boundary = secrets.token_hex(13)
+        parts: List[Union[bytes, Tuple[int, int]]] = []
+        content_length = 0
+        for start, end in ranges:
+            part_headers = (
+                f'--{boundary}\r\n'
+                f'Content-Type: {self.media_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode('latin-1')
+            parts += [part_headers, (start, end - start + 1), b'\r\n']
+            content_length += len(part_headers) + end - start + 3
+        closing = f'--{boundary}--\r\n'.encode('latin-1')
+        parts.append(closing)
+        self.headers['content-length'] = str(content_length + len(closing))
+        self.headers['content-type'] = (
+            f'multipart/byteranges; boundary={boundary}'
+        )
+        return parts
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        try:
+            stat_result = await io_executor.run(partial(os.stat, self.path))
+        except FileNotFoundError:
+            response = ORJSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={'detail': 'Файл не найден в хранилище.'}
+            )
+            return await response(scope, receive, send)
+        if self.stat_result is None:
+            self.set_stat_headers(stat_result)
+        self.headers['accept-ranges'] = 'bytes'
+
+        size = stat_result.st_size
+        parts = self.body_parts(
+            self.requested_ranges(Headers(scope=scope), size), size
+        )
+
+        await send({
+            'type': 'http.response.start',
+            'status': self.status_code,
+            'headers': self.raw_headers,
+        })
+        if scope['method'].upper() != 'HEAD' and parts:
+            file = await io_executor.run(partial(open, self.path, 'rb'))
+            try:
+                for part in parts:
+                    await self.send_part(send, file, part)
+            finally:
+                await io_executor.run(file.close)
+        await send({
+            'type': 'http.response.body',
+            'body': b'',
+            'more_body': False
+        })
+
+        if self.background is not None:
+            await self.background()
+
+    async def send_part(
+        self,
+        send: Send,
+        file: BinaryIO,
+        part: Union[bytes, Tuple[int, int]]
+    ) -> None:
+        '''Отправляет часть тела: готовые байты или диапазон файла.'''
+        if isinstance(part, bytes):
+            await send({
+                'type': 'http.response.body',
+                'body': part,
+                'more_body': True,
+            })
+        else:
+            await self.send_slice(send, file, *part)
+
+    async def send_slice(
+        self,
+        send: Send,
+        file: BinaryIO,
+        offset: int,
+        count: int
+    ) -> None:
+        '''Отправляет count байт файла начиная с offset частями.'''
+        end = offset + count
+        while offset < end:
+            chunk = await io_executor.run(partial(
+                os.pread,
+                file.fileno(),
+                min(self.chunk_size, end - offset),
+                offset
+            ))
+            if not chunk:
+                break
+            offset += len(chunk)
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': True,
+            })
+            DOWNLOAD_BYTES.labels('file').inc(len(chunk))
+
+
+class AccelRedirectResponse(Response):
+    '''
+    Пустой ответ с заголовком X-Accel-Redirect.
+
+    Тело файла отдает nginx из internal location, python-воркер только
+    проверяет доступ и находит файл в базе.
+    '''
+
+    def __init__(
+        self,
+        location: str,
+        path: str,
+        filename: str,
+        media_type: Optional[str] = None
+    ):
+        if media_type is None:
+            media_type = guess_type(filename)[0] or 'application/octet-stream'
+        super().__init__(media_type=media_type)
+        self.headers['x-accel-redirect'] = (
+            location.rstrip('/') + '/' + quote(path.lstrip('/'))
+        )
+        self.headers['content-disposition'] = content_disposition(filename)
+
+
+class DecodedFileResponse(StreamingResponse):
+    '''
+    Файл, сжатый на диске кодеком codec, в исходном виде.
+
+    Для клиентов, которые не принимают этот кодек в Accept-Encoding.
+    Файл распаковывается в пуле io по частям во время отправки, Range
+    не поддерживается. size - исходный размер для Content-Length.
+    '''
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: Path,
+        filename: str,
+        codec: str,
+        size: Optional[int] = None,
+        media_type: Optional[str] = None
+    ):
+        if media_type is None:
+            media_type = guess_type(filename)[0] or 'application/octet-stream'
+        super().__init__(
+            self.iter_decoded(path, codec),
+            media_type=media_type,
+            headers={
+                'content-disposition': content_disposition(filename),
+                'accept-ranges': 'none',
+                'vary': 'Accept-Encoding',
+            }
+        )
+        if size is not None:
+            self.headers['content-length'] = str(size)
+
+    async def iter_decoded(
+        self,
+        path: Path,
+        codec: str
+    ) -> AsyncIterator[bytes]:
+        file = await io_executor.run(partial(open_decoded, path, codec))
+        try:
+            while chunk := await io_executor.run(
+                partial(file.read, self.chunk_size)
+            ):
+                yield chunk
+                DOWNLOAD_BYTES.labels('decoded').inc(len(chunk))
+        finally:
+            await io_executor.run(file.close)
@@ -1,12 +1,13 @@
-import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Awaitable, Callable, Optional, Tuple
+from typing import Any, Awaitable, BinaryIO, Callable, Optional, Tuple
 
 from fastapi import HTTPException, status
 from pydantic import FilePath
 
+from core.executors import ExecutorOverloaded, executors
+from core.settings import DATA_DIR
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,29 +20,84 @@ def write_data(filepath: FilePath, data: bytes | str):
         with open(filepath, mode=mode) as f:
             f.write(data)
     except Exception as err:
-        logger.error(f'Error writing data {err}', exc_info=True)
+        logger.error('Error writing data %s', err, exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail='Ошибка при сохранении файла, попробуйте позже.'
+        )
+
+
+def write_stream(
+    filepath: FilePath,
+    stream: BinaryIO,
+    chunk_size: int = 1024 * 1024,
+    hasher: Optional[Any] = None,
+    compressor: Optional[Any] = None
+) -> int:
+    '''
+    Потоково сохраняет данные из stream в файл под названием filepath.
+
+    Данные читаются частями по chunk_size байт, поэтому в памяти
+    одновременно находится не больше одной части файла. Если передан
+    hasher (объект hashlib), он обновляется каждой частью. Если передан
+    compressor (см. utils.codecs), на диск пишутся сжатые данные, а hasher
+    и размер считаются по исходным.
+    Возвращает количество прочитанных из stream байт.
+    '''
+    written = 0
+    try:
+        with open(filepath, mode='wb') as f:
+            while chunk := stream.read(chunk_size):
+                if compressor is not None:
+                    f.write(compressor.compress(chunk))
+                else:
+                    f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                written += len(chunk)
+            if compressor is not None:
+                f.write(compressor.flush())
+        return written
+    except Exception as err:
+        logger.error('Error writing stream %s', err, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail='Ошибка при сохранении файла, попробуйте позже.'
         )
 
 
-async def run_in_executor(func: Callable) -> Awaitable:
-    '''Выполнить блокирующую операцию в отдельном потоке.'''
+async def run_in_executor(func: Callable, executor: str = 'io') -> Awaitable:
+    '''
+    Выполнить блокирующую операцию в общем пуле потоков.
+
+    executor: 'io' для дисковых операций, 'cpu' для вычислений,
+    'password' для bcrypt. Если пул перегружен, отвечает 503.
+    '''
     try:
-        loop = asyncio.get_running_loop()
-        with ThreadPoolExecutor() as pool:
-            result = await loop.run_in_executor(pool, func)
-        return result
+        return await executors[executor].run(func)
+    except HTTPException:
+        raise
+    except ExecutorOverloaded as err:
+        logger.warning('%s, request rejected', err)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Сервер перегружен, повторите попытку позже.',
+            headers={'Retry-After': '1'}
+        )
     except Exception as err:
-        logger.error(f'Error in run in executor {err}', exc_info=True)
+        logger.error('Error in run in executor %s', err, exc_info=True)
 
 
 def get_path_name(
     filepath: str,
-    base_dir: Path
+    base_dir: Path,
+    create_dirs: bool = True
 ) -> Tuple[str, Path, Optional[str]]:
-    '''Проверяет путь к файлу на корректность и наличие названия файла.'''
+    '''
+    Проверяет путь к файлу на корректность и наличие названия файла.
+
+    При create_dirs создает недостающие директории в base_dir.
+    '''
     try:
         # Убираем лишние слэши вначале, если такие есть
         paths = [path for path in filepath.split('/') if path]
@@ -52,16 +108,47 @@ def get_path_name(
         data_dir = '/'.join(paths[:-1]) if filename else '/'.join(paths)
         data_path = base_dir.joinpath(data_dir)
 
-        if not data_path.exists():
-            logger.info(f'Created dir {filepath}')
+        if create_dirs and not data_path.exists():
+            logger.info('Created dir %s', filepath)
             data_path.mkdir(parents=True, exist_ok=True)
 
         if filename:
             data_path = base_dir.joinpath(filepath)
         return filepath, data_path, filename
     except IndexError as err:
-        logger.error(f'Index error in get_path_name {err}', exc_info=True)
+        logger.error('Index error in get_path_name %s', err, exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Нужно указать путь к файлу или директории.'
         )
+
+
+def resolve_upload_path(
+    path: str,
+    username: str,
+    default_filename: Optional[str],
+    create_dirs: bool = True
+) -> Tuple[str, Path, str]:
+    '''
+    Определяет, куда сохранить файл пользователя.
+
+    Возвращает путь файла для пользователя, путь на диске и имя файла.
+    Если в path нет имени файла, используется default_filename.
+    '''
+    path_for_user, data_path, filename = get_path_name(
+        filepath=path,
+        base_dir=DATA_DIR / username,
+        create_dirs=create_dirs
+    )
+    path_for_user = f'{username}/{path_for_user}'
+
+    if not filename:
+        if not default_filename:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Нужно указать имя файла.'
+            )
+        filename = default_filename
+        data_path = data_path / filename
+        path_for_user = f'{path_for_user}/{filename}'
+    return path_for_user, data_path, filename
@@ -0,0 +1,428 @@
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import (
+    BinaryIO,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union
+)
+from uuid import UUID, uuid4
+
+from core.metrics import UPLOAD_BYTES
+from core.settings import (
+    app_settings,
+    BLOB_DIR,
+    DATA_DIR,
+    FILES_DIR,
+    UPLOAD_SESSIONS_DIR,
+    UPLOAD_TMP_DIR
+)
+from db.models import File
+from schemas.entities import FileRecord
+from utils.codecs import CODECS, choose_codec, get_compressor, read_sample
+from utils.services import write_stream
+
+logger = logging.getLogger(__name__)
+
+
+class WrittenFile(NamedTuple):
+    '''Загруженный файл, записанный на диск.'''
+    path: Path
+    # sha256 содержимого, если файл записан во временный файл для blob
+    blob_id: Optional[str]
+    # Размер до сжатия
+    size: int
+    codec: Optional[str]
+
+
+def init_storage() -> None:
+    '''Создает директории данных, вызывается при старте приложения.'''
+    for directory in (
+        DATA_DIR, BLOB_DIR, FILES_DIR, UPLOAD_TMP_DIR, UPLOAD_SESSIONS_DIR
+    ):
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+def blob_relpath(digest: str, codec: Optional[str] = None) -> str:
+    '''
+    Путь к содержимому с хэшем digest относительно DATA_DIR.
+
+    Сжатое содержимое лежит под именем с расширением кодека.
+    '''
+    blob_root = BLOB_DIR.relative_to(DATA_DIR)
+    name = f'{digest}.{CODECS[codec].suffix}' if codec else digest
+    return f'{blob_root}/{digest[:2]}/{digest[2:4]}/{name}'
+
+
+def sharded_relpath(fid: UUID) -> str:
+    '''Путь к содержимому файла fid в раскладке sharded от DATA_DIR.'''
+    files_root = FILES_DIR.relative_to(DATA_DIR)
+    return f'{files_root}/{fid.hex[:2]}/{fid.hex[2:4]}/{fid.hex}'
+
+
+def upload_location(fid: UUID) -> Optional[str]:
+    '''
+    Место для содержимого нового файла fid без дедупликации.
+
+    В раскладке sharded возвращает путь относительно DATA_DIR, в
+    раскладке user - None: содержимое лежит по пути пользователя.
+    '''
+    if app_settings.STORAGE_LAYOUT == 'sharded':
+        return sharded_relpath(fid)
+    return None
+
+
+def file_location(file: Union[File, FileRecord]) -> str:
+    '''Путь к содержимому файла на диске относительно DATA_DIR.'''
+    if file.blob_id:
+        return blob_relpath(file.blob_id, file.codec)
+    return file.location or file.path
+
+
+def write_temp_blob(
+    stream: BinaryIO,
+    chunk_size: int,
+    codec: Optional[str] = None
+) -> Tuple[Path, str, int]:
+    '''
+    Потоково пишет загрузку во временный файл, считая sha256.
+
+    Содержимое сжимается кодеком codec, хэш и размер считаются по
+    исходным данным. Возвращает путь к временному файлу, хэш и размер.
+    '''
+    tmp_path = UPLOAD_TMP_DIR / uuid4().hex
+    hasher = hashlib.sha256()
+    try:
+        size = write_stream(
+            filepath=tmp_path,
+            stream=stream,
+            chunk_size=chunk_size,
+            hasher=hasher,
+            compressor=get_compressor(codec)
+        )
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path, hasher.hexdigest(), size
+
+
+def write_upload(
+    stream: BinaryIO,
+    filename: str,
+    data_path: Optional[Path],
+    chunk_size: int
+) -> WrittenFile:
+    '''
+    Потоково пишет загруженный файл на диск, при необходимости сжимая.
+
+    Кодек выбирается по расширению filename и началу stream. При
+    data_path=None файл пишется во временный файл с подсчетом sha256
+    (дедупликация), иначе сразу в data_path.
+    '''
+    codec = choose_codec(filename.split('.')[-1], read_sample(stream))
+    if data_path is None:
+        tmp_path, digest, size = write_temp_blob(stream, chunk_size, codec)
+        UPLOAD_BYTES.inc(size)
+        return WrittenFile(tmp_path, digest, size, codec)
+    # В раскладке sharded директория создается при первой записи в нее
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        size = write_stream(
+            filepath=data_path,
+            stream=stream,
+            chunk_size=chunk_size,
+            compressor=get_compressor(codec)
+        )
+    except Exception:
+        # Недописанный файл не должен остаться в хранилище
+        data_path.unlink(missing_ok=True)
+        raise
+    UPLOAD_BYTES.inc(size)
+    return WrittenFile(data_path, None, size, codec)
+
+
+def write_batch(
+    streams: List[BinaryIO],
+    data_paths: Optional[List[Path]],
+    filenames: List[str],
+    chunk_size: int
+) -> List[Optional[WrittenFile]]:
+    '''
+    Потоково пишет на диск файлы из одной пакетной загрузки.
+
+    При data_paths=None файлы пишутся во временные файлы с подсчетом
+    sha256 (дедупликация), иначе сразу по путям из data_paths.
+    Для каждого файла возвращает WrittenFile или None, если файл
+    записать не удалось: ошибка одного файла не прерывает остальные.
+    '''
+    written = []
+    for index, (stream, filename) in enumerate(zip(streams, filenames)):
+        try:
+            written.append(write_upload(
+                stream=stream,
+                filename=filename,
+                data_path=data_paths[index] if data_paths else None,
+                chunk_size=chunk_size
+            ))
+        except Exception as err:
+            logger.error('Error writing %s %s', filename, err)
+            written.append(None)
+    return written
+
+
+def hash_file(path: Path, chunk_size: int) -> str:
+    '''Считает sha256 файла, читая его частями по chunk_size байт.'''
+    hasher = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def store_blob(
+    tmp_path: Path,
+    digest: str,
+    codec: Optional[str] = None
+) -> None:
+    '''
+    Переносит временный файл, сжатый кодеком codec, в хранилище под
+    именем digest.
+
+    Если такое содержимое уже лежит на диске, временный файл удаляется.
+    '''
+    target = DATA_DIR / blob_relpath(digest, codec)
+    if target.exists():
+        tmp_path.unlink(missing_ok=True)
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, target)
+    logger.info('Stored blob %s', digest)
+
+
+def store_blobs(
+    blobs: List[Tuple[Path, str, Optional[str]]],
+    keep: bool = True
+) -> None:
+    '''
+    Переносит временные файлы пакетной загрузки в хранилище.
+
+    blobs - пути к временным файлам, хэши и кодеки. При keep=False
+    (записи о файлах не созданы) временные файлы удаляются.
+    '''
+    for tmp_path, digest, codec in blobs:
+        if keep:
+            store_blob(tmp_path, digest, codec)
+        else:
+            tmp_path.unlink(missing_ok=True)
+
+
+def remove_blob(digest: str, codec: Optional[str] = None) -> None:
+    '''Удаляет содержимое, на которое больше не ссылается ни один файл.'''
+    (DATA_DIR / blob_relpath(digest, codec)).unlink(missing_ok=True)
+    logger.info('Removed blob %s', digest)
+
+
+def remove_file(location: str) -> None:
+    '''Удаляет содержимое файла, лежащее по location (раскладка sharded).'''
+    (DATA_DIR / location).unlink(missing_ok=True)
+    logger.info('Removed file %s', location)
+
+
+def link_location(path: str, location: str) -> bool:
+    '''
+    Делает содержимое файла по пути пользователя path доступным
+    по location жесткой ссылкой.
+
+    Исходный файл не трогается: пока запись о файле не обновлена,
+    его читают по старому пути. Возвращает False, если исходного
+    файла нет.
+    '''
+    target = DATA_DIR / location
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(DATA_DIR / path, target)
+    except FileExistsError:
+        # Ссылка осталась от прерванного переноса
+        pass
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def remove_user_paths(paths: Iterable[str]) -> None:
+    '''
+    Удаляет перенесенные файлы по путям пользователей и опустевшие
+    после этого директории, кроме корневых директорий пользователей.
+    '''
+    for path in paths:
+        (DATA_DIR / path).unlink(missing_ok=True)
+        parent = (DATA_DIR / path).parent
+        while parent.parent != DATA_DIR:
+            try:
+                parent.rmdir()
+            except OSError:
+                # В директории остались другие файлы
+                break
+            parent = parent.parent
+
+
+def session_dir(sid: UUID) -> Path:
+    '''Директория с частями файла из загрузки sid.'''
+    return UPLOAD_SESSIONS_DIR / str(sid)
+
+
+def write_part(
+    sid: UUID,
+    number: int,
+    stream: BinaryIO,
+    chunk_size: int
+) -> int:
+    '''
+    Сохраняет часть файла number из загрузки sid.
+
+    Часть сначала пишется во временный файл и переименовывается после
+    записи, поэтому повторная отправка той же части безопасна.
+    Возвращает размер части.
+    '''
+    part_dir = session_dir(sid)
+    part_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = part_dir / f'{number:05d}.{uuid4().hex}.tmp'
+    try:
+        size = write_stream(
+            filepath=tmp_path,
+            stream=stream,
+            chunk_size=chunk_size
+        )
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, part_dir / f'{number:05d}')
+    UPLOAD_BYTES.inc(size)
+    return size
+
+
+def list_parts(sid: UUID) -> List[Tuple[int, int]]:
+    '''Возвращает номера и размеры полученных частей по возрастанию.'''
+    part_dir = session_dir(sid)
+    if not part_dir.exists():
+        return []
+    with os.scandir(part_dir) as entries:
+        parts = [
+            (int(entry.name), entry.stat().st_size)
+            for entry in entries
+            if entry.name.isdigit()
+        ]
+    return sorted(parts)
+
+
+def hash_parts(sid: UUID, numbers: List[int], chunk_size: int) -> str:
+    '''Считает sha256 файла, который соберется из частей numbers.'''
+    hasher = hashlib.sha256()
+    for number in numbers:
+        with open(session_dir(sid) / f'{number:05d}', mode='rb') as part:
+            while chunk := part.read(chunk_size):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, size: int) -> None:
+    '''Копирует size байт между файлами внутри ядра, если это возможно.'''
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                sent = os.copy_file_range(
+                    src.fileno(), dst.fileno(), size - copied
+                )
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError as err:
+            # Например, ФС или ядро не поддерживают copy_file_range
+            logger.info('copy_file_range unavailable, fallback: %s', err)
+    if copied < size:
+        src.seek(copied)
+        dst.seek(0, os.SEEK_END)
+        shutil.copyfileobj(src, dst)
+
+
+def assemble_parts(sid: UUID, target: Path, numbers: List[int]) -> int:
+    '''
+    Склеивает части загрузки sid в файл target.
+
+    Данные копируются через copy_file_range без чтения в Python.
+    Возвращает размер получившегося файла.
+    '''
+    part_dir = session_dir(sid)
+    # Без буферизации: позиции в файлах двигает ядро, а не python
+    with open(target, mode='wb', buffering=0) as dst:
+        for number in numbers:
+            part_path = part_dir / f'{number:05d}'
+            with open(part_path, mode='rb', buffering=0) as src:
+                _copy_range(src, dst, os.fstat(src.fileno()).st_size)
+        return os.fstat(dst.fileno()).st_size
+
+
+def encode_parts(
+    sid: UUID,
+    target: Path,
+    numbers: List[int],
+    codec: str,
+    chunk_size: int
+) -> Tuple[int, str]:
+    '''
+    Склеивает части загрузки sid в файл target, сжимая их кодеком codec.
+
+    Возвращает размер и sha256 исходных данных.
+    '''
+    part_dir = session_dir(sid)
+    compressor = get_compressor(codec)
+    hasher = hashlib.sha256()
+    size = 0
+    with open(target, mode='wb') as dst:
+        for number in numbers:
+            with open(part_dir / f'{number:05d}', mode='rb') as src:
+                while chunk := src.read(chunk_size):
+                    dst.write(compressor.compress(chunk))
+                    hasher.update(chunk)
+                    size += len(chunk)
+        dst.write(compressor.flush())
+    return size, hasher.hexdigest()
+
+
+def assemble_upload(
+    sid: UUID,
+    target: Path,
+    numbers: List[int],
+    filename: str,
+    chunk_size: int
+) -> Tuple[int, Optional[str], Optional[str]]:
+    '''
+    Собирает файл filename из частей загрузки sid в target.
+
+    Кодек выбирается по расширению и началу первой части. Без сжатия
+    части копируются assemble_parts, и sha256 не считается.
+    Возвращает размер исходных данных, их sha256 и кодек.
+    '''
+    with open(session_dir(sid) / f'{numbers[0]:05d}', mode='rb') as first:
+        codec = choose_codec(filename.split('.')[-1], read_sample(first))
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if codec is None:
+        return assemble_parts(sid, target, numbers), None, None
+    try:
+        size, digest = encode_parts(sid, target, numbers, codec, chunk_size)
+    except Exception:
+        target.unlink(missing_ok=True)
+        raise
+    return size, digest, codec
+
+
+def remove_session_parts(sid: UUID) -> None:
+    '''Удаляет все части загрузки sid.'''
+    shutil.rmtree(session_dir(sid), ignore_errors=True)
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+from datetime import datetime
+from functools import partial
+from typing import Awaitable, Callable
+
+from db.crud import crud_upload_session
+from db.session import async_session
+from utils.services import run_in_executor
+from utils.storage import remove_session_parts
+
+logger = logging.getLogger(__name__)
+
+
+async def cleanup_upload_sessions() -> None:
+    '''Удаляет просроченные загрузки по частям вместе с частями на диске.'''
+    async with async_session() as db:
+        sids = await crud_upload_session.delete_expired(
+            db=db,
+            now=datetime.utcnow()
+        )
+    for sid in sids:
+        await run_in_executor(partial(remove_session_parts, sid=sid))
+
+
+async def run_periodically(
+    func: Callable[[], Awaitable],
+    interval: float
+) -> None:
+    '''Выполняет func каждые interval секунд, пока задачу не отменят.'''
+    while True:
+        try:
+            await func()
+        except Exception as err:
+            logger.error('Error in periodic task %s', err, exc_info=True)
+        await asyncio.sleep(interval)
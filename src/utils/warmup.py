@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict
+
+from core.executors import password_executor
+from core.redis import get_redis
+from core.settings import app_settings
+from db.crud import crud_file
+from db.session import async_session, engine
+from utils.auth import create_access_token, load_password_backend
+from utils.cache import file_cache
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_auth() -> None:
+    '''Импортирует jose в процессе и запускает процессы пула паролей.'''
+    create_access_token(data={'sub': 'warmup'})
+    await asyncio.gather(*(
+        password_executor.run(load_password_backend)
+        for _ in range(password_executor.max_workers)
+    ))
+
+
+async def warm_database(connections: int) -> None:
+    '''
+    Открывает connections соединений с базой и возвращает их в пул.
+
+    Соединения сверх DB_POOL_SIZE пул закрыл бы сразу после возврата,
+    поэтому их число ограничено размером пула.
+    '''
+    connections = min(connections, app_settings.DB_POOL_SIZE)
+    async with AsyncExitStack() as stack:
+        results = await asyncio.gather(
+            *(
+                stack.enter_async_context(engine.connect())
+                for _ in range(connections)
+            ),
+            return_exceptions=True
+        )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+async def warm_redis(connections: int) -> None:
+    '''Открывает connections соединений с Redis и возвращает их в пул.'''
+    pool = get_redis().connection_pool
+    results = await asyncio.gather(
+        *(pool.get_connection('PING') for _ in range(connections)),
+        return_exceptions=True
+    )
+    for result in results:
+        if not isinstance(result, BaseException):
+            await pool.release(result)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+async def warm_file_cache(files: int) -> None:
+    '''Кладет в кэш метаданных последние загруженные файлы.'''
+    if not files:
+        return
+    async with async_session() as db:
+        recent = await crud_file.get_recent(db=db, limit=files)
+    if recent is None:
+        raise RuntimeError('recent files query failed')
+    await file_cache.preload(recent)
+
+
+async def warm_up() -> Dict[str, Any]:
+    '''
+    Прогревает ресурсы процесса до приема запросов.
+
+    Шаги выполняются по очереди, каждый не дольше WARMUP_TIMEOUT.
+    Ошибка шага не останавливает запуск: без Redis приложение работает,
+    а недоступность базы покажет /internal/ready. Возвращает время
+    каждого шага в секундах или текст ошибки.
+    '''
+    steps: Dict[str, Callable[[], Awaitable]] = {
+        'auth': warm_auth,
+        'database': partial(
+            warm_database, app_settings.WARMUP_DB_CONNECTIONS
+        ),
+        'redis': partial(warm_redis, app_settings.WARMUP_REDIS_CONNECTIONS),
+        'file_cache': partial(
+            warm_file_cache, app_settings.WARMUP_CACHE_FILES
+        ),
+    }
+    report = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), timeout=app_settings.WARMUP_TIMEOUT)
+        except Exception as err:
+            logger.warning('Warmup step %s failed: %r', name, err)
+            report[name] = repr(err)
+        else:
+            report[name] = time.perf_counter() - start
+    logger.info('Warmup finished: %s', report)
+    return report
@@ -4,4 +4,5 @@ alembic upgrade head
 
 echo "Running app..."
 
-python src/main.py
+# exec: SIGTERM от docker должен получить сам сервер, а не оболочка
+exec python src/main.py